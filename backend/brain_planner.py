@@ -3,6 +3,7 @@ import json
 import chromadb
 import re  # [NEW] 用于正则匹配
 from openai import AsyncOpenAI
+from plan_cache import PlanCache
 
 class PlannerBrain:
     def __init__(self, model_name="deepseek-r1:14b"):
@@ -13,6 +14,16 @@ class PlannerBrain:
         )
         self.chroma = chromadb.PersistentClient(path="./agent_brain_db")
         self.demo_coll = self.chroma.get_collection("demonstrations")
+        self.plan_cache = PlanCache()
+
+    def _retrieve_demos(self, user_goal):
+        return self.demo_coll.query(query_texts=[user_goal], n_results=3)
+
+    def lookup_plan(self, user_goal, sitemap_version=""):
+        """Returns a cached plan for this goal if the planner inputs are unchanged, else None."""
+        results = self._retrieve_demos(user_goal)
+        if not results['documents'][0]: return None
+        return self.plan_cache.get(user_goal, results['ids'][0], sitemap_version)
 
     def _simplify_steps(self, steps_json):
         """
@@ -41,11 +52,17 @@ class PlannerBrain:
                 
         return summary, image_map
 
-    async def generate_plan(self, user_goal, sitemap_context=""):
+    async def generate_plan(self, user_goal, sitemap_context="", sitemap_version="", use_cache=True):
         print(f"🧠 [Planner] Thinking about: {user_goal}...")
         
-        results = self.demo_coll.query(query_texts=[user_goal], n_results=3)
+        results = self._retrieve_demos(user_goal)
         if not results['documents'][0]: return None
+        demo_ids = results['ids'][0]
+
+        cached = self.plan_cache.get(user_goal, demo_ids, sitemap_version) if use_cache else None
+        if cached:
+            print("♻️ [Planner] Plan cache hit.")
+            return cached
 
         # 1. 收集所有参考步骤和图片
         ref_text = ""
@@ -101,7 +118,9 @@ class PlannerBrain:
                     "text": clean_step,
                     "image": best_img # 可能是 None
                 })
-                
+
+            if structured_plan:
+                self.plan_cache.put(user_goal, demo_ids, sitemap_version, structured_plan)
             return structured_plan
             
         except Exception as e:
@@ -1,8 +1,16 @@
 import json
 import os
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 
 INPUT_FILE = "user_trajectories.jsonl"
-OUTPUT_FILE = "train_dataset.json"
+OUTPUT_DIR = "train_dataset"             # Sharded output: part-<run>-<chunk>-<n>.jsonl|.parquet
+STATE_FILE = "data_prep_state.json"      # Checkpoint: byte offset already consumed
+SHARD_SIZE = 5000                        # Samples per output shard
+CHUNK_BYTES = 64 * 1024 * 1024           # Log bytes per parallel work unit
+SAVE_MARKERS = ('demo_saved', 'save_demo', 'demo_completed')
+HEAD_BYTES = 64 * 1024                   # Log prefix hashed to detect a replaced/rotated log
 
 def format_system_prompt(dom_state):
     return f"""You are an intelligent web agent.
@@ -16,72 +24,228 @@ CURRENT VISIBLE UI:
 {dom_state}
 """
 
-def process_logs():
-    if not os.path.exists(INPUT_FILE):
-        print(f"❌ Log file not found: {INPUT_FILE}")
-        return
+def build_samples(task_name, steps):
+    """Turns the (element_desc, action) steps of one saved task into training samples."""
+    for dom_snippet, action in steps:
+        target_id = action.get('target_id')
+        if not target_id or target_id == 'UNKNOWN':
+            continue
+
+        clean_action = {
+            "action": action.get('type'),
+            "id": target_id,
+            "value": action.get('value', '')
+        }
+        yield {
+            "instruction": f"USER GOAL: {task_name}",
+            "input": format_system_prompt(dom_snippet),
+            "output": json.dumps(clean_action)
+        }
+
+class ShardWriter:
+    """Streams samples into fixed-size JSONL or Parquet shards (memory bounded by one shard)."""
+    def __init__(self, out_dir, prefix, fmt="jsonl", shard_size=SHARD_SIZE):
+        self.out_dir = out_dir
+        self.prefix = prefix
+        self.fmt = fmt
+        self.shard_size = shard_size
+        self.files = []
+        self.count = 0
+        self._rows = []   # Parquet only: rows of the open shard
+        self._fh = None   # JSONL only: open shard
+        self._in_shard = 0
+
+    def _path(self):
+        return os.path.join(self.out_dir, f"{self.prefix}-{len(self.files):03d}.{self.fmt}")
+
+    def write(self, sample):
+        if self._in_shard == 0:
+            self.files.append(self._path())
+            if self.fmt == "jsonl":
+                self._fh = open(self.files[-1] + ".tmp", "w", encoding="utf-8")
+        if self.fmt == "jsonl":
+            self._fh.write(json.dumps(sample, ensure_ascii=False) + "\n")
+        else:
+            self._rows.append(sample)
+        self._in_shard += 1
+        self.count += 1
+        if self._in_shard >= self.shard_size:
+            self._close_shard()
+
+    def _close_shard(self):
+        if self._in_shard == 0: return
+        path = self.files[-1]
+        if self.fmt == "jsonl":
+            self._fh.close()
+            self._fh = None
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            pq.write_table(pa.Table.from_pylist(self._rows), path + ".tmp")
+            self._rows = []
+        os.replace(path + ".tmp", path) # Readers never see a half-written shard
+        self._in_shard = 0
 
-    print("⏳ Processing logs...")
-    
-    buffer_steps = []
-    final_dataset = []
-    
-    with open(INPUT_FILE, 'r', encoding='utf-8') as f:
-        for line in f:
+    def close(self):
+        self._close_shard()
+        return self.files
+
+def process_range(input_file, start, end, out_dir, prefix, fmt="jsonl", shard_size=SHARD_SIZE):
+    """
+    Converts the log lines starting in [start, end).
+    Tasks are cut at save markers; the steps before the first marker ("head")
+    belong to a task that started in an earlier range, so they are returned
+    for stitching instead of being emitted here.
+    """
+    writer = ShardWriter(out_dir, prefix, fmt, shard_size)
+    head, head_task, tail = [], None, []
+    seen_marker = False
+    last_marker_end = None
+
+    with open(input_file, 'rb') as f:
+        if start > 0:
+            f.seek(start - 1)
+            if f.read(1) != b"\n": f.readline() # Partial line belongs to the previous range
+        while f.tell() < end:
+            line = f.readline()
+            if not line: break
             try:
                 entry = json.loads(line)
-                msg_type = entry.get('type')
-                
-                # 1. Collect steps
-                if msg_type == 'record_event':
-                    buffer_steps.append(entry)
-                    
-                # 2. Found Save Marker
-                elif msg_type in ['demo_saved', 'save_demo', 'demo_completed']:
-                    task_name = entry.get('name') or entry.get('task_name')
-                    
-                    if not task_name: 
-                        print("⚠️ Unnamed task, skipping")
-                        buffer_steps = []
-                        continue
-
-                    if buffer_steps:
-                        print(f"✅ Extracted Task: '{task_name}' ({len(buffer_steps)} steps)")
-                        
-                        for step in buffer_steps:
-                            dom_snippet = step.get('element_desc', '')
-                            action = step.get('action', {})
-                            
-                            target_id = action.get('target_id')
-                            if not target_id or target_id == 'UNKNOWN':
-                                continue 
-
-                            clean_action = {
-                                "action": action.get('type'),
-                                "id": target_id,
-                                "value": action.get('value', '')
-                            }
-                            
-                            sample = {
-                                "instruction": f"USER GOAL: {task_name}",
-                                "input": format_system_prompt(dom_snippet),
-                                "output": json.dumps(clean_action)
-                            }
-                            final_dataset.append(sample)
-                        
-                        buffer_steps = [] 
-                    else:
-                        print(f"⚠️ Task '{task_name}' has no steps")
-
             except json.JSONDecodeError:
                 continue
+            msg_type = entry.get('type')
+
+            # 1. Collect steps (only what the samples need, not the full DOM/screenshots)
+            if msg_type == 'record_event':
+                tail.append((entry.get('element_desc', ''), entry.get('action') or {}))
+
+            # 2. Found Save Marker
+            elif msg_type in SAVE_MARKERS:
+                task_name = entry.get('name') or entry.get('task_name') or ""
+                last_marker_end = f.tell()
+                if not seen_marker:
+                    head, head_task, tail = tail, task_name, []
+                    seen_marker = True
+                    continue
+                if not task_name:
+                    print("⚠️ Unnamed task, skipping")
+                elif tail:
+                    print(f"✅ Extracted Task: '{task_name}' ({len(tail)} steps)")
+                    for sample in build_samples(task_name, tail): writer.write(sample)
+                else:
+                    print(f"⚠️ Task '{task_name}' has no steps")
+                tail = []
+
+    return {
+        "start": start,
+        "seen_marker": seen_marker,
+        "head": head if seen_marker else tail,
+        "head_task": head_task,
+        "tail": tail if seen_marker else [],
+        "last_marker_end": last_marker_end,
+        "files": writer.close(),
+        "samples": writer.count
+    }
+
+def log_identity(input_file, offset):
+    """Inode + hash of the first bytes already consumed: changes when the log is replaced or rotated."""
+    with open(input_file, 'rb') as f:
+        head = hashlib.sha256(f.read(min(offset, HEAD_BYTES))).hexdigest()[:16]
+    return {"inode": os.stat(input_file).st_ino, "head": head}
+
+def load_state(input_file):
+    """Checkpoint of the previous run, or None if there is none or it no longer matches the log."""
+    if not os.path.exists(STATE_FILE): return None
+    with open(STATE_FILE, 'r', encoding='utf-8') as f:
+        state = json.load(f)
+    offset = state.get("offset", 0)
+    if (state.get("input") != os.path.abspath(input_file) or offset > os.path.getsize(input_file)
+            or log_identity(input_file, offset) != {"inode": state.get("inode"), "head": state.get("head")}):
+        print("⚠️ Log file was replaced or truncated since the last run. Rebuilding all shards.")
+        return None
+    return state
+
+def save_state(state):
+    tmp = STATE_FILE + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, STATE_FILE)
+
+def process_logs(input_file=INPUT_FILE, out_dir=OUTPUT_DIR, fmt="jsonl", workers=1, full=False, shard_size=SHARD_SIZE):
+    """
+    Streams new log bytes (since the checkpoint) into training shards.
+    Memory stays bounded by one task's steps plus one output shard.
+    """
+    if not os.path.exists(input_file):
+        print(f"❌ Log file not found: {input_file}")
+        return
+
+    os.makedirs(out_dir, exist_ok=True)
+    state = None if full else load_state(input_file)
+    if state is None:
+        # Full rebuild (--full, first run, or a replaced log): old shards would duplicate the new ones
+        state = {"offset": 0, "run": 0, "samples": 0}
+        for name in os.listdir(out_dir):
+            if name.startswith("part-"): os.remove(os.path.join(out_dir, name))
+
+    start, end = state["offset"], os.path.getsize(input_file)
+    if start >= end:
+        print("✅ No new log data since the last run.")
+        return
+    run = state["run"] + 1
+    print(f"⏳ Processing logs (bytes {start}-{end}, run {run})...")
+
+    # Every worker converts its own byte range into its own shards
+    ranges = [(s, min(s + CHUNK_BYTES, end)) for s in range(start, end, CHUNK_BYTES)]
+    jobs = [(input_file, s, e, out_dir, f"part-{run:04d}-{i:04d}", fmt, shard_size) for i, (s, e) in enumerate(ranges)]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(process_range, *zip(*jobs)))
+    else:
+        results = [process_range(*job) for job in jobs]
+
+    # Stitch tasks that span range boundaries (in log order)
+    stitch = ShardWriter(out_dir, f"part-{run:04d}-stitch", fmt, shard_size)
+    carry = [] # Range starts at a task boundary (checkpoint = end of a save marker)
+    for res in results:
+        carry.extend(res["head"])
+        if not res["seen_marker"]: continue
+        task_name = res["head_task"]
+        if not task_name:
+            print("⚠️ Unnamed task, skipping")
+        elif carry:
+            print(f"✅ Extracted Task: '{task_name}' ({len(carry)} steps)")
+            for sample in build_samples(task_name, carry): stitch.write(sample)
+        else:
+            print(f"⚠️ Task '{task_name}' has no steps")
+        carry = res["tail"]
+    stitch.close()
+
+    new_samples = stitch.count + sum(r["samples"] for r in results)
+    marker_ends = [r["last_marker_end"] for r in results if r["last_marker_end"] is not None]
+    # Steps after the last save marker are re-read next run, once their task is saved
+    offset = max(marker_ends) if marker_ends else start
+    state.update({
+        "input": os.path.abspath(input_file),
+        **log_identity(input_file, offset),
+        "offset": offset,
+        "run": run,
+        "samples": state["samples"] + new_samples
+    })
+    save_state(state)
 
-    if final_dataset:
-        with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-            json.dump(final_dataset, f, indent=2, ensure_ascii=False)
-        print(f"🎉 Success! Generated {len(final_dataset)} training samples -> {OUTPUT_FILE}")
+    if new_samples:
+        print(f"🎉 Success! Generated {new_samples} new training samples -> {out_dir}/ ({state['samples']} total)")
     else:
         print("⚠️ No valid data extracted.")
 
 if __name__ == "__main__":
-    process_logs()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Convert recorded trajectories into sharded training data.")
+    parser.add_argument("--input", default=INPUT_FILE)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Parallel byte-range workers")
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE)
+    parser.add_argument("--full", action="store_true", help="Ignore the checkpoint and rebuild all shards")
+    args = parser.parse_args()
+    process_logs(args.input, args.output_dir, args.format, args.workers, args.full, args.shard_size)
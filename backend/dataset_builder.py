@@ -0,0 +1,318 @@
+import os
+import re
+import glob
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from data_prep import format_system_prompt, SAVE_MARKERS
+
+LOG_FILE = "user_trajectories.jsonl"   # save_raw_log (recorded demos)
+BASE_DIR = "agent_datasets"            # DatasetRecorder sessions (trajectory.jsonl, dpo_pairs.jsonl)
+OUTPUT_DIR = "dataset_build"           # sft/*.arrow, dpo/*.arrow, index.json
+APPEND_ONLY = ("log", "session")       # Sources that only ever grow (resume from offset)
+HEAD_BYTES = 64 * 1024                 # Prefix hashed to detect rewritten files
+
+def dom_fingerprint(dom_str):
+    """Same structural fingerprint as server.get_context_fingerprint."""
+    if not dom_str: return "empty"
+    tokens = re.findall(r'\[\d+\]\s*<(\w+)', dom_str)
+    return hashlib.md5("|".join(tokens[:300]).encode('utf-8')).hexdigest()
+
+def sample_hash(prompt, dom, *actions):
+    raw = json.dumps([prompt, dom_fingerprint(dom), *actions], ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:20]
+
+def head_hash(path, limit):
+    """Hash of the first `limit` bytes (capped at HEAD_BYTES): detects rewritten vs appended files."""
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read(min(limit, HEAD_BYTES))).hexdigest()[:16]
+
+def existing_images(root, *paths):
+    """Resolves screenshot paths relative to their recording dir; drops missing files."""
+    found = []
+    for p in paths:
+        if not p: continue
+        full = p if os.path.isabs(p) else os.path.join(root, p)
+        if os.path.exists(full): found.append(full)
+    return found
+
+def as_json(action):
+    return action if isinstance(action, str) else json.dumps(action, ensure_ascii=False)
+
+# ==========================================
+# Source scanners (run in worker processes)
+# ==========================================
+
+def _scan_log(path, start, base_dir):
+    """user_trajectories.jsonl: record_event steps grouped by save markers."""
+    rows, steps, offset = [], [], start
+    with open(path, 'rb') as f:
+        f.seek(start)
+        for line in iter(f.readline, b""):
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            msg_type = entry.get('type')
+            if msg_type == 'record_event':
+                steps.append(entry)
+            elif msg_type in SAVE_MARKERS:
+                task_name = entry.get('name') or entry.get('task_name')
+                offset = f.tell()
+                for step in steps if task_name else []:
+                    action = step.get('action') or {}
+                    target_id = action.get('target_id')
+                    if not target_id or target_id == 'UNKNOWN': continue
+                    dom = step.get('dom') or step.get('element_desc', '')
+                    instruction = f"USER GOAL: {task_name}"
+                    output = json.dumps({"action": action.get('type'), "id": target_id, "value": action.get('value', '')})
+                    rows.append({
+                        "instruction": instruction,
+                        "input": format_system_prompt(step.get('element_desc', '')),
+                        "output": output,
+                        "images": existing_images(base_dir, step.get('full_image_path'), step.get('crop_image_path')),
+                        "hash": sample_hash(instruction, dom, output)
+                    })
+                steps = []
+    return {"sft": rows, "dpo": [], "offset": offset}
+
+def _session_info(session_dir):
+    info = os.path.join(session_dir, "session_info.jsonl")
+    if not os.path.exists(info): return {}
+    with open(info, 'r', encoding='utf-8') as f:
+        for line in f:
+            try: return json.loads(line)
+            except json.JSONDecodeError: continue
+    return {}
+
+TRAINABLE_ACTIONS = ("click", "type", "select", "scroll", "navigate")
+
+def accepted_action(entry):
+    """
+    The step's action if server.ask_brain_task would have sent it, else None.
+    Frontend Guard rows, errors/messages and actions on IDs missing from the DOM
+    (same check as server.verify_id_in_dom) are not trainable.
+    """
+    if entry.get("model") == "Frontend Guard": return None
+    action = (entry.get("llm_output") or {}).get("parsed_action")
+    if not isinstance(action, dict) or action.get("action") not in TRAINABLE_ACTIONS: return None
+    if action["action"] == "navigate":
+        value = action.get("value")
+        return action if isinstance(value, str) and value.startswith("#/") else None
+    if action["action"] == "scroll": return action
+    target_id = str(action.get("id", "")).strip()
+    dom = (entry.get("context") or {}).get("dom") or ""
+    if not target_id.isdigit() or not re.search(rf'\[{target_id}\].*?"', dom): return None
+    return action
+
+def _scan_session(path, start, base_dir):
+    """
+    agent_datasets/session_*/trajectory.jsonl: one line per model attempt.
+    Attempts are logged before validation. Sessions with sent markers
+    (DatasetRecorder.mark_sent) use exactly the attempt the server sent; older
+    ones fall back to the last attempt of each step. Either way the action must
+    be trainable and not rejected by the frontend afterwards.
+    The trailing step may still be retried: it is left for the next scan.
+    """
+    session_dir = os.path.dirname(path)
+    info = _session_info(session_dir)
+    instruction = f"USER GOAL: {info.get('goal', '')}"
+    marked = bool(info.get("sent_markers"))
+    rows = []
+    pending = None # [step, last attempt, sent attempt]: not known to be final until the next step
+
+    def emit(entry):
+        action = accepted_action(entry) if entry else None
+        if action is None: return
+        dom = (entry.get("context") or {}).get("dom") or ""
+        output = json.dumps({"action": action.get("action"), "id": action.get("id", ""), "value": action.get("value", "")})
+        images = entry.get("images") or {}
+        rows.append({
+            "instruction": instruction,
+            "input": format_system_prompt(dom),
+            "output": output,
+            "images": existing_images(session_dir, images.get("raw"), images.get("marked")),
+            "hash": sample_hash(instruction, dom, output)
+        })
+
+    pos = group_start = start
+    with open(path, 'rb') as f:
+        f.seek(start)
+        for line in iter(f.readline, b""):
+            if not line.endswith(b"\n"): break # Still being written
+            line_start, pos = pos, pos + len(line)
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if entry.get("sent"):
+                if pending is not None and pending[0] == entry.get("step") and pending[1].get("attempt") == entry.get("attempt"):
+                    pending[2] = pending[1]
+                continue
+            if entry.get("model") == "Frontend Guard":
+                pending = None # The frontend rejected the action sent for the pending step
+                continue
+            if pending is not None and pending[0] != entry.get("step"):
+                emit(pending[2] if marked else pending[1]) # A new step began: the previous one is final
+                pending = None
+            if pending is None:
+                group_start = line_start
+                pending = [entry.get("step"), entry, None]
+            else:
+                pending[1] = entry
+    return {"sft": rows, "dpo": [], "offset": group_start if pending else pos}
+
+def _scan_dpo(path, start, base_dir, include_pending=False):
+    """agent_datasets/session_*/dpo_pairs.jsonl: reviewed preference pairs."""
+    session_dir = os.path.dirname(path)
+    accepted = ("verified", "pending") if include_pending else ("verified",)
+    rows = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                pair = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if pair.get("verification_status") not in accepted: continue
+            if not pair.get("chosen") or not pair.get("rejected"): continue
+            dom = pair.get("dom") or ""
+            prompt = pair.get("prompt") or f"USER GOAL: {pair.get('task_goal', '')}\n{format_system_prompt(dom)}"
+            chosen, rejected = as_json(pair["chosen"]), as_json(pair["rejected"])
+            rows.append({
+                "prompt": prompt,
+                "chosen": chosen,
+                "rejected": rejected,
+                "images": existing_images(session_dir, pair.get("context_image")) or existing_images(base_dir, pair.get("context_image")),
+                "hash": sample_hash(prompt, dom, chosen, rejected)
+            })
+    return {"sft": [], "dpo": rows, "offset": os.path.getsize(path)}
+
+def scan_source(kind, path, start, base_dir, include_pending):
+    if kind == "log": return _scan_log(path, start, base_dir)
+    if kind == "session": return _scan_session(path, start, base_dir)
+    return _scan_dpo(path, start, base_dir, include_pending)
+
+# ==========================================
+# Index + Arrow output
+# ==========================================
+
+def discover_sources(log_file, base_dir):
+    sources = []
+    if os.path.exists(log_file): sources.append(("log", log_file))
+    sources += [("session", p) for p in sorted(glob.glob(os.path.join(base_dir, "session_*", "trajectory.jsonl")))]
+    sources += [("dpo", p) for p in sorted(glob.glob(os.path.join(base_dir, "session_*", "dpo_pairs.jsonl")))]
+    return sources
+
+def part_name(kind, path, n):
+    key = re.sub(r'[^A-Za-z0-9_.-]+', '_', os.path.relpath(path)).strip('_')
+    return f"{key}-{n:04d}.arrow"
+
+def write_arrow(path, rows, source):
+    import pyarrow as pa
+    for row in rows: row["source"] = source
+    table = pa.Table.from_pylist(rows)
+    tmp = path + ".tmp"
+    with pa.OSFile(tmp, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp, path)
+
+class DatasetIndex:
+    """index.json: per source file -> {size, mtime, head, offset, parts, hashes}."""
+    def __init__(self, out_dir):
+        self.path = os.path.join(out_dir, "index.json")
+        self.sources = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.sources = json.load(f).get("sources", {})
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({"sources": self.sources}, f)
+        os.replace(tmp, self.path)
+
+    def drop(self, out_dir, path):
+        entry = self.sources.pop(path, None)
+        for part in (entry or {}).get("parts", []):
+            full = os.path.join(out_dir, part)
+            if os.path.exists(full): os.remove(full)
+
+def build(log_file=LOG_FILE, base_dir=BASE_DIR, out_dir=OUTPUT_DIR, workers=None, full=False, include_pending=False):
+    """
+    Scans all recording sources (in parallel) into deduplicated SFT/DPO Arrow parts.
+    Unchanged sources are skipped; append-only sources resume from their last offset.
+    """
+    for sub in ("sft", "dpo"): os.makedirs(os.path.join(out_dir, sub), exist_ok=True)
+    index = DatasetIndex(out_dir)
+    sources = discover_sources(log_file, base_dir)
+    live = {path for _, path in sources}
+
+    for path in list(index.sources):
+        if full or path not in live:
+            index.drop(out_dir, path)
+
+    jobs = []
+    for kind, path in sources:
+        stat = os.stat(path)
+        entry = index.sources.get(path)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            continue
+        if (entry and kind in APPEND_ONLY and stat.st_size >= entry["offset"]
+                and head_hash(path, entry["offset"]) == entry["head"]):
+            start = entry["offset"]
+        else:
+            index.drop(out_dir, path)
+            start = 0
+        jobs.append((kind, path, start, stat))
+
+    if not jobs:
+        print("✅ Dataset is up to date.")
+        return
+
+    seen = set()
+    for entry in index.sources.values(): seen.update(entry["hashes"])
+
+    print(f"⏳ Scanning {len(jobs)} changed source(s) of {len(sources)}...")
+    args = [(kind, path, start, base_dir, include_pending) for kind, path, start, _ in jobs]
+    stats = {"sft": 0, "dpo": 0, "duplicates": 0}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for (kind, path, start, stat), result in zip(jobs, pool.map(scan_source, *zip(*args))):
+            entry = index.sources.get(path) or {"parts": [], "hashes": []}
+            for split in ("sft", "dpo"):
+                rows = []
+                for row in result[split]:
+                    if row["hash"] in seen:
+                        stats["duplicates"] += 1
+                        continue
+                    seen.add(row["hash"])
+                    rows.append(row)
+                if not rows: continue
+                part = os.path.join(split, part_name(kind, path, len(entry["parts"])))
+                write_arrow(os.path.join(out_dir, part), rows, kind)
+                entry["parts"].append(part)
+                entry["hashes"].extend(r["hash"] for r in rows)
+                stats[split] += len(rows)
+            entry.update({
+                "kind": kind, "size": stat.st_size, "mtime": stat.st_mtime,
+                "offset": result["offset"], "head": head_hash(path, result["offset"])
+            })
+            index.sources[path] = entry
+
+    index.save()
+    total_sft = sum(1 for e in index.sources.values() for p in e["parts"] if p.startswith("sft"))
+    print(f"🎉 +{stats['sft']} SFT / +{stats['dpo']} DPO samples ({stats['duplicates']} duplicates dropped). "
+          f"{total_sft} SFT part(s) in {out_dir}/")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build deduplicated SFT/DPO Arrow datasets from all recordings.")
+    parser.add_argument("--log-file", default=LOG_FILE)
+    parser.add_argument("--base-dir", default=BASE_DIR)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--full", action="store_true", help="Ignore the index and rebuild everything")
+    parser.add_argument("--include-pending", action="store_true", help="Also emit DPO pairs not yet reviewed")
+    args = parser.parse_args()
+    build(args.log_file, args.base_dir, args.output_dir, args.workers, args.full, args.include_pending)
@@ -35,7 +35,8 @@ class DatasetRecorder:
         meta = {
             "session_id": folder_name,
             "goal": task_goal,
-            "start_time": timestamp
+            "start_time": timestamp,
+            "sent_markers": True # trajectory.jsonl marks the attempt actually sent (see mark_sent)
         }
         self._append_jsonl("session_info.jsonl", meta)
         print(f"📼 Recording started: {self.current_session_dir}")
@@ -100,6 +101,14 @@ class DatasetRecorder:
         self._append_jsonl("trajectory.jsonl", entry)
         print(f"💾 Step {step_index} saved to dataset.")
 
+    def mark_sent(self, step_index, attempt):
+        """
+        Marks the attempt the server sent to the frontend. record_step logs every
+        attempt before validation, so rejected retries are in the trajectory too.
+        """
+        if not self.current_session_dir: return
+        self._append_jsonl("trajectory.jsonl", {"step": step_index, "attempt": attempt, "sent": True})
+
     def _save_image(self, b64_str, filename):
         """Decodes and saves base64 image to current session dir."""
         if not b64_str: return None
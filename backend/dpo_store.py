@@ -0,0 +1,99 @@
+import os
+import json
+import glob
+import time
+import sqlite3
+import hashlib
+
+JOURNAL_FILE = "dpo_review.sqlite"   # Inside base_dir: pending decisions until compaction
+
+def pair_key(pair):
+    """Content hash of a pair without its review status (so it survives status updates)."""
+    if pair.get("pair_id"): return str(pair["pair_id"])
+    content = {k: v for k, v in pair.items() if k != "verification_status"}
+    raw = json.dumps(content, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:16]
+
+def iter_pairs(filepath):
+    """
+    Streams (pair_id, pair, raw line) from one dpo_pairs.jsonl (unparsable lines: id None).
+    Identical lines get distinct ids (#1, #2, ...) by their order in the file.
+    """
+    seen = {}
+    with open(filepath, 'rb') as f:
+        for line in f:
+            try:
+                pair = json.loads(line)
+            except json.JSONDecodeError:
+                yield None, None, line
+                continue
+            key = pair_key(pair)
+            n = seen.get(key, 0)
+            seen[key] = n + 1
+            yield (f"{key}#{n}" if n else key), pair, line
+
+class DPOReviewStore:
+    """
+    Review decisions for agent_datasets/session_*/dpo_pairs.jsonl.
+    A decision is one SQLite row (instant, crash-safe); the JSONL files are only
+    rewritten by compact(), once per touched file.
+    """
+    def __init__(self, base_dir="agent_datasets", journal_file=JOURNAL_FILE):
+        self.base_dir = base_dir
+        self.db = sqlite3.connect(os.path.join(base_dir, journal_file))
+        self.db.execute("""CREATE TABLE IF NOT EXISTS decisions (
+            file TEXT NOT NULL, pair_id TEXT NOT NULL, status TEXT NOT NULL, decided_at REAL,
+            PRIMARY KEY (file, pair_id))""")
+        self.db.commit()
+
+    def files(self):
+        return sorted(glob.glob(os.path.join(self.base_dir, "session_*", "dpo_pairs.jsonl")))
+
+    def decisions(self, filepath):
+        rows = self.db.execute("SELECT pair_id, status FROM decisions WHERE file = ?", (filepath,))
+        return dict(rows.fetchall())
+
+    def iter_pending(self):
+        """Lazily yields (filepath, pair_id, pair) still awaiting review, one file at a time."""
+        for filepath in self.files():
+            decided = self.decisions(filepath)
+            for pair_id, pair, _ in iter_pairs(filepath):
+                if pair_id and pair.get("verification_status") == "pending" and pair_id not in decided:
+                    yield filepath, pair_id, pair
+
+    def set_status(self, filepath, pair_id, status):
+        """status: 'verified' or 'deleted' (the pair is dropped at compaction)."""
+        self.db.execute(
+            "INSERT OR REPLACE INTO decisions (file, pair_id, status, decided_at) VALUES (?, ?, ?, ?)",
+            (filepath, pair_id, status, time.time()))
+        self.db.commit()
+
+    def pending_decisions(self):
+        return self.db.execute("SELECT COUNT(*) FROM decisions").fetchone()[0]
+
+    def compact(self):
+        """Applies journaled decisions to their files (tmp + rename) and clears them."""
+        files = [row[0] for row in self.db.execute("SELECT DISTINCT file FROM decisions")]
+        applied = 0
+        for filepath in files:
+            decided = self.decisions(filepath)
+            if os.path.exists(filepath):
+                tmp = filepath + ".tmp"
+                with open(tmp, 'wb') as out:
+                    for pair_id, pair, line in iter_pairs(filepath):
+                        status = decided.get(pair_id)
+                        if status == "deleted":
+                            applied += 1
+                            continue
+                        if status:
+                            pair["verification_status"] = status
+                            line = (json.dumps(pair, ensure_ascii=False) + "\n").encode('utf-8')
+                            applied += 1
+                        out.write(line) # Untouched lines are copied byte for byte
+                os.replace(tmp, filepath)
+            self.db.execute("DELETE FROM decisions WHERE file = ?", (filepath,))
+            self.db.commit()
+        return applied
+
+    def close(self):
+        self.db.close()
@@ -2,6 +2,7 @@ import chromadb
 import json
 import sys
 from datetime import datetime
+from plan_cache import PlanCache
 
 # Initialize Client
 # Preserving your original path configuration
@@ -12,6 +13,7 @@ try:
     rl_coll = client.get_collection("rl_feedback")
 except:
     rl_coll = client.create_collection("rl_feedback")
+plan_cache = PlanCache()
 
 def list_all_demos():
     """List all saved skills/demonstrations"""
@@ -117,9 +119,41 @@ def delete_memory(doc_id):
     try:
         demo_coll.delete(ids=[doc_id])
         print(f"✅ Successfully deleted memory: {doc_id}")
+        dropped = plan_cache.invalidate_demo(doc_id)
+        if dropped: print(f"🧹 Dropped {dropped} cached plan(s) built from it.")
     except Exception as e:
         print(f"❌ Error deleting: {e}")
 
+def inspect_plan_cache():
+    """List cached planner outputs"""
+    print("\n🗂️  === Plan Cache ===")
+    entries = plan_cache.list_entries()
+    if not entries:
+        print("(Plan cache is empty)")
+        return
+
+    print(f"{'Key':<16} | {'Created':<16} | {'Hits':<4} | {'Steps':<5} | {'Sitemap':<10} | {'Goal'}")
+    print("-" * 90)
+    for key, entry in entries:
+        created = datetime.fromtimestamp(entry.get('created_at', 0)).strftime('%Y-%m-%d %H:%M')
+        expired = " (expired)" if plan_cache._is_expired(entry) else ""
+        print(f"{key:<16} | {created:<16} | {entry.get('hits', 0):<4} | {len(entry.get('plan', [])):<5} | {entry.get('sitemap_version', ''):<10} | {entry.get('goal')}{expired}")
+        print(f"{'':<16}   demos: {', '.join(entry.get('demo_ids', []))}")
+
+def purge_plan_cache():
+    """Purge cached plans (expired, by goal, or all)"""
+    mode = input("Purge [e]xpired, by [g]oal, or [a]ll? ").strip().lower()
+    if mode == 'e':
+        n = plan_cache.purge(expired_only=True)
+    elif mode == 'g':
+        n = plan_cache.invalidate_goal(input("Enter goal: "))
+    elif mode == 'a':
+        n = plan_cache.purge()
+    else:
+        print("Invalid option")
+        return
+    print(f"✅ Purged {n} cached plan(s).")
+
 def main():
     while True:
         print("\n🔧 Memory Management Tool")
@@ -128,6 +162,8 @@ def main():
         print("3. Delete a demo (by ID)")
         print("4. Clear ALL RL feedback (Reset bad habits)")
         print("5. Inspect demo details (List steps) [NEW]")
+        print("6. Inspect plan cache")
+        print("7. Purge plan cache")
         print("q. Quit")
         
         choice = input("\nSelect option: ").strip()
@@ -150,6 +186,10 @@ def main():
             # 🔥 New Option
             id_to_inspect = input("Enter Demo ID to inspect: ").strip()
             inspect_demo_steps(id_to_inspect)
+        elif choice == '6':
+            inspect_plan_cache()
+        elif choice == '7':
+            purge_plan_cache()
         elif choice == 'q':
             break
         else:
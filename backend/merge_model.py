@@ -4,42 +4,121 @@ import os
 # ==========================================
 # Use domestic mirror (hf-mirror.com)
 os.environ["HF_ENDPOINT"] = "https://hf-mirror.com"
+import json
+import glob
+import math
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 import torch
-from peft import PeftModel
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from safetensors import safe_open
+from safetensors.torch import save_file, load_file
 
 
 # ================= Configuration =================
 BASE_MODEL_ID = "deepseek-ai/DeepSeek-R1-Distill-Qwen-14B"
 ADAPTER_DIR = "universal_adapter"  # Output directory from previous training
 OUTPUT_DIR = "merged_model_14b"    # Directory to save merged model
+MERGE_WORKERS = 2                  # Shards merged in parallel (peak RAM ~ workers x one shard)
 
-def merge():
-    print(f"⏳ Loading base model: {BASE_MODEL_ID} (This may take a few minutes)...")
-    
-    # Note: To ensure merge precision, use float16 and force CPU loading to prevent VRAM OOM.
-    # If you have 4090/A100, you can set device_map="auto".
-    base_model = AutoModelForCausalLM.from_pretrained(
-        BASE_MODEL_ID,
-        torch_dtype=torch.float16,
-        device_map="cpu", 
-        trust_remote_code=True
-    )
-
-    print(f"🔗 Loading LoRA adapter: {ADAPTER_DIR}...")
-    model = PeftModel.from_pretrained(base_model, ADAPTER_DIR)
-
-    print("🧩 Merging weights (Merge and Unload)...")
-    model = model.merge_and_unload()
-
-    print("💾 Saving complete model...")
-    model.save_pretrained(OUTPUT_DIR)
-    
-    # Remember to save Tokenizer as well
-    tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL_ID)
-    tokenizer.save_pretrained(OUTPUT_DIR)
-    
-    print(f"✅ Merge complete! Full model saved to: {OUTPUT_DIR}")
+def resolve_base_dir(model_id):
+    """Local checkout, or the HF cache snapshot (weights, config and tokenizer only)."""
+    if os.path.isdir(model_id): return model_id
+    from huggingface_hub import snapshot_download
+    return snapshot_download(model_id, allow_patterns=["*.safetensors", "*.json", "*.txt", "*.model", "*.tiktoken"])
+
+def load_lora(adapter_dir):
+    """
+    Returns (scale, fan_in_fan_out, {base weight name: (A, B)}) from a PEFT LoRA adapter.
+    PEFT names look like base_model.model.<module>.lora_A.weight.
+    """
+    with open(os.path.join(adapter_dir, "adapter_config.json"), 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    r, alpha = config["r"], config.get("lora_alpha", config["r"])
+    scale = alpha / math.sqrt(r) if config.get("use_rslora") else alpha / r
+
+    weights_path = os.path.join(adapter_dir, "adapter_model.safetensors")
+    if os.path.exists(weights_path):
+        state = load_file(weights_path)
+    else:
+        state = torch.load(os.path.join(adapter_dir, "adapter_model.bin"), map_location="cpu")
+
+    pairs = {}
+    for name, tensor in state.items():
+        for part in ("lora_A", "lora_B"):
+            marker = f".{part}."
+            if marker not in name: continue
+            module = name.split(marker)[0].removeprefix("base_model.model.")
+            pairs.setdefault(f"{module}.weight", {})[part] = tensor
+    lora = {k: (v["lora_A"], v["lora_B"]) for k, v in pairs.items() if "lora_A" in v and "lora_B" in v}
+    return scale, config.get("fan_in_fan_out", False), lora
+
+def merge_shard(shard_path, out_path, lora, scale, fan_in_fan_out, threads):
+    """Merges one memory-mapped shard: W += scale * B @ A on the targeted tensors only."""
+    torch.set_num_threads(threads)
+    merged, applied = {}, []
+    with safe_open(shard_path, framework="pt") as f:
+        metadata = f.metadata() or {}
+        for name in f.keys():
+            tensor = f.get_tensor(name)
+            if name in lora:
+                lora_a, lora_b = lora[name]
+                delta = lora_b.float() @ lora_a.float()
+                if fan_in_fan_out: delta = delta.T
+                tensor = (tensor.float() + delta * scale).to(tensor.dtype)
+                applied.append(name)
+            merged[name] = tensor
+    tmp = out_path + ".tmp"
+    save_file(merged, tmp, metadata={"format": "pt", **metadata})
+    os.replace(tmp, out_path)
+    return os.path.basename(shard_path), applied
+
+def merge(base_model_id=BASE_MODEL_ID, adapter_dir=ADAPTER_DIR, output_dir=OUTPUT_DIR, workers=MERGE_WORKERS):
+    """
+    Streaming merge: each base shard is memory-mapped, patched and written on its own,
+    so peak memory is about one shard per worker instead of the whole fp16 model.
+    """
+    print(f"⏳ Resolving base model: {base_model_id}")
+    base_dir = resolve_base_dir(base_model_id)
+    shards = sorted(glob.glob(os.path.join(base_dir, "*.safetensors")))
+    if not shards:
+        print(f"❌ No safetensors shards in {base_dir}")
+        return
+
+    print(f"🔗 Loading LoRA adapter: {adapter_dir}...")
+    scale, fan_in_fan_out, lora = load_lora(adapter_dir)
+    print(f"🧩 {len(lora)} LoRA-targeted tensors, scale {scale:g}, {len(shards)} shard(s), {workers} worker(s)")
+
+    os.makedirs(output_dir, exist_ok=True)
+    # Tensor names don't change, so config, tokenizer and the shard index are copied as-is
+    for path in glob.glob(os.path.join(base_dir, "*")):
+        if os.path.isfile(path) and not path.endswith(".safetensors"):
+            shutil.copy(path, output_dir)
+
+    threads = max(1, (os.cpu_count() or 1) // max(1, workers))
+    applied = set()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        for shard in shards:
+            with safe_open(shard, framework="pt") as f:
+                shard_lora = {k: lora[k] for k in f.keys() if k in lora} # Only ship this shard's LoRA pairs
+            futures.append(pool.submit(merge_shard, shard, os.path.join(output_dir, os.path.basename(shard)),
+                                       shard_lora, scale, fan_in_fan_out, threads))
+        for future in futures:
+            name, names = future.result()
+            applied.update(names)
+            print(f"💾 {name}: {len(names)} tensor(s) merged")
+
+    missing = set(lora) - applied
+    if missing:
+        print(f"⚠️ {len(missing)} LoRA tensor(s) had no matching base weight, e.g. {sorted(missing)[0]}")
+    print(f"✅ Merge complete! Full model saved to: {output_dir}")
 
 if __name__ == "__main__":
-    merge()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Merge the LoRA adapter into the base model shard by shard.")
+    parser.add_argument("--base", default=BASE_MODEL_ID)
+    parser.add_argument("--adapter", default=ADAPTER_DIR)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--workers", type=int, default=MERGE_WORKERS)
+    args = parser.parse_args()
+    merge(args.base, args.adapter, args.output_dir, args.workers)
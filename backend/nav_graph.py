@@ -0,0 +1,77 @@
+import re
+import heapq
+
+class NavGraph:
+    """
+    Click graph over sitemap pages.
+    Edges come from:
+      - global_nav: the sidebar is reachable from every page, so each nav item
+        is an edge ANYWHERE -> page with clicks [*parents, item]
+      - observed transitions: clicking `label` on page A landed on page B
+    Route titles from sync_skeleton resolve nav items to page URLs.
+    """
+    ANYWHERE = "*"
+
+    def __init__(self, data):
+        self.edges = {} # src -> {dst: clicks}
+        self._build(data)
+
+    def add_edge(self, src, dst, clicks):
+        if src == dst or not clicks: return
+        current = self.edges.setdefault(src, {}).get(dst)
+        if current is None or len(clicks) < len(current):
+            self.edges[src][dst] = list(clicks)
+
+    @staticmethod
+    def _slug(text):
+        return re.sub(r'[^a-z0-9]+', '-', text.lower()).strip('-')
+
+    def _build(self, data):
+        pages = data.get("pages", {})
+        by_title, by_slug = {}, {}
+        for url, info in pages.items():
+            title = (info.get("title") or "").strip().lower()
+            if title: by_title.setdefault(title, url)
+            last = url.rstrip('/').split('/')[-1]
+            if last: by_slug.setdefault(self._slug(last), url)
+
+        self.nav_targets = {} # nav text -> url
+        for text, parents in data.get("global_nav", {}).items():
+            url = by_title.get(text.strip().lower()) or by_slug.get(self._slug(text))
+            if not url: continue
+            self.nav_targets[text] = url
+            parents = parents if isinstance(parents, list) else []
+            self.add_edge(self.ANYWHERE, url, parents + [text])
+
+        for src, targets in data.get("transitions", {}).items():
+            for dst, info in targets.items():
+                self.add_edge(src, dst, [info["label"]])
+
+    def shortest_path(self, src, dst):
+        """
+        Dijkstra on click count.
+        Returns: list of click labels from src to dst ([] if already there), or None.
+        """
+        if src == dst: return []
+        dist = {src: 0}
+        prev = {} # node -> (previous node, clicks)
+        heap = [(0, src)]
+        anywhere_edges = self.edges.get(self.ANYWHERE, {})
+        while heap:
+            d, node = heapq.heappop(heap)
+            if node == dst: break
+            if d > dist.get(node, float('inf')): continue
+            for edges in (self.edges.get(node, {}), anywhere_edges):
+                for nxt, clicks in edges.items():
+                    nd = d + len(clicks)
+                    if nd < dist.get(nxt, float('inf')):
+                        dist[nxt] = nd
+                        prev[nxt] = (node, clicks)
+                        heapq.heappush(heap, (nd, nxt))
+        if dst not in prev: return None
+
+        path, node = [], dst
+        while node != src:
+            node, clicks = prev[node]
+            path = clicks + path
+        return path
@@ -0,0 +1,96 @@
+import os
+import json
+import time
+import atexit
+import threading
+
+def atomic_write_json(filepath, data, indent=None, keep_backup=True):
+    """
+    Crash-safe JSON write: tmp file + fsync + os.replace.
+    The previous version is kept as `<file>.bak` so a torn disk still has a fallback.
+    `data` may be a ready-made JSON string.
+    """
+    payload = data if isinstance(data, str) else json.dumps(data, indent=indent, ensure_ascii=False)
+    directory = os.path.dirname(os.path.abspath(filepath))
+    tmp_path = f"{filepath}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    if keep_backup and os.path.exists(filepath):
+        os.replace(filepath, f"{filepath}.bak")
+    os.replace(tmp_path, filepath)
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try: os.fsync(dir_fd)
+        finally: os.close(dir_fd)
+    except OSError:
+        pass # Directory fsync is not supported everywhere (e.g. Windows)
+
+def load_json_safely(filepath):
+    """
+    Loads JSON written by atomic_write_json.
+    A corrupted file is moved aside (never silently dropped) and the backup is tried.
+    Returns: parsed data, or None if neither file exists / is readable.
+    """
+    for path in (filepath, f"{filepath}.bak"):
+        if not os.path.exists(path): continue
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if path != filepath:
+                print(f"♻️ Recovered {filepath} from backup.")
+            return data
+        except Exception as e:
+            quarantine = f"{path}.corrupt-{int(time.time())}"
+            os.replace(path, quarantine)
+            print(f"⚠️ {path} corrupted ({e}), moved to {quarantine}.")
+    return None
+
+class DebouncedWriter:
+    """
+    Write-behind persistence. `mark_dirty()` is cheap; the snapshot is
+    serialized and written atomically on a background timer once writes
+    settle for `delay` seconds (but at least every `max_delay` seconds).
+    Pending writes are flushed at interpreter exit.
+    """
+    def __init__(self, filepath, snapshot_fn, delay=2.0, max_delay=10.0):
+        self.filepath = filepath
+        self.snapshot_fn = snapshot_fn # Returns a JSON string (called off the caller's thread)
+        self.delay = delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock() # Guards the dirty/timer state only; never held while writing
+        self._write_lock = threading.Lock() # Serializes snapshot + write so files land in order
+        self._timer = None
+        self._dirty_since = None
+        self.stats = {"requested": 0, "written": 0, "failed": 0}
+        atexit.register(self.flush)
+
+    def mark_dirty(self):
+        with self._lock:
+            self.stats["requested"] += 1
+            now = time.monotonic()
+            if self._dirty_since is None: self._dirty_since = now
+            if self._timer: self._timer.cancel()
+            wait = max(0.0, min(self.delay, self.max_delay - (now - self._dirty_since)))
+            self._timer = threading.Timer(wait, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Writes pending changes now (no-op if nothing is dirty)."""
+        with self._write_lock:
+            with self._lock:
+                if self._timer:
+                    self._timer.cancel()
+                    self._timer = None
+                if self._dirty_since is None: return
+                self._dirty_since = None
+            # Snapshot after clearing the flag: a change made meanwhile is either in it or re-marks dirty.
+            # snapshot_fn may take the owner's lock, so _lock must not be held here (lock order).
+            try:
+                atomic_write_json(self.filepath, self.snapshot_fn())
+                self.stats["written"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                print(f"❌ Failed to persist {self.filepath}: {e}")
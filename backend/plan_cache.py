@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import hashlib
+from persistence import atomic_write_json, load_json_safely
+
+class PlanCache:
+    """
+    Persistent cache of planner outputs.
+    Key: (normalized goal, IDs of the top-k retrieved demos, sitemap version).
+    A plan is only reused when the planner would see the same inputs again.
+    """
+    def __init__(self, filepath="plan_cache.json", ttl_seconds=None):
+        self.filepath = filepath
+        if ttl_seconds is None:
+            ttl_seconds = float(os.environ.get("PLAN_CACHE_TTL", 7 * 24 * 3600))
+        self.ttl_seconds = ttl_seconds
+        self.entries = {} # Key: hash, Value: {goal, demo_ids, sitemap_version, plan, created_at, hits}
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "invalidated": 0}
+        self._mtime = None
+        self.load()
+
+    @staticmethod
+    def normalize_goal(user_goal):
+        return " ".join(user_goal.lower().split())
+
+    def make_key(self, user_goal, demo_ids, sitemap_version):
+        raw = json.dumps([self.normalize_goal(user_goal), sorted(demo_ids), sitemap_version or ""])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:16]
+
+    def load(self):
+        """Loads entries from disk (other processes, e.g. manage_memory, may have edited them)."""
+        self.entries = load_json_safely(self.filepath) or {}
+        self._mtime = os.path.getmtime(self.filepath) if os.path.exists(self.filepath) else None
+
+    def _refresh(self):
+        mtime = os.path.getmtime(self.filepath) if os.path.exists(self.filepath) else None
+        if mtime != self._mtime: self.load()
+
+    def save(self):
+        try:
+            atomic_write_json(self.filepath, self.entries, indent=2, keep_backup=False)
+            self._mtime = os.path.getmtime(self.filepath)
+        except Exception as e:
+            print(f"❌ Failed to save plan cache: {e}")
+
+    def _is_expired(self, entry, now=None):
+        if self.ttl_seconds <= 0: return False
+        return (now or time.time()) - entry.get("created_at", 0) > self.ttl_seconds
+
+    def get(self, user_goal, demo_ids, sitemap_version):
+        """Returns the cached plan or None."""
+        self._refresh()
+        key = self.make_key(user_goal, demo_ids, sitemap_version)
+        entry = self.entries.get(key)
+        if entry and self._is_expired(entry):
+            del self.entries[key]
+            self.stats["expired"] += 1
+            self.save()
+            entry = None
+        if not entry:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        entry["hits"] = entry.get("hits", 0) + 1
+        return entry["plan"]
+
+    def put(self, user_goal, demo_ids, sitemap_version, plan):
+        self._refresh()
+        key = self.make_key(user_goal, demo_ids, sitemap_version)
+        self.entries[key] = {
+            "goal": self.normalize_goal(user_goal),
+            "demo_ids": sorted(demo_ids),
+            "sitemap_version": sitemap_version or "",
+            "plan": plan,
+            "created_at": time.time(),
+            "hits": 0
+        }
+        self.save()
+
+    def _drop(self, predicate):
+        self._refresh()
+        doomed = [k for k, e in self.entries.items() if predicate(e)]
+        for k in doomed: del self.entries[k]
+        if doomed: self.save()
+        return len(doomed)
+
+    def invalidate_demo(self, demo_id):
+        """Drops every plan that was built from this demo."""
+        n = self._drop(lambda e: demo_id in e.get("demo_ids", []))
+        self.stats["invalidated"] += n
+        return n
+
+    def invalidate_goal(self, user_goal):
+        """Drops plans for this goal (a new demo may now be retrieved for it)."""
+        goal = self.normalize_goal(user_goal)
+        n = self._drop(lambda e: e.get("goal") == goal)
+        self.stats["invalidated"] += n
+        return n
+
+    def purge(self, expired_only=False):
+        now = time.time()
+        if expired_only:
+            return self._drop(lambda e: self._is_expired(e, now))
+        return self._drop(lambda e: True)
+
+    def list_entries(self):
+        self._refresh()
+        return sorted(self.entries.items(), key=lambda kv: kv[1].get("created_at", 0), reverse=True)
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        stats["entries"] = len(self.entries)
+        return stats
@@ -0,0 +1,61 @@
+import asyncio
+import hashlib
+import json
+
+class RequestCoalescer:
+    """
+    Single-flight wrapper around `client.chat.completions.create`.
+    Deterministic requests (temperature == 0) with the same
+    (model, messages, format) key share one upstream call.
+    """
+    def __init__(self, client):
+        self.client = client
+        self._inflight = {}  # Key: request hash, Value: asyncio.Task
+        self.stats = {
+            "requests": 0,        # every call routed through the coalescer
+            "upstream_calls": 0,  # calls actually sent to the model server
+            "coalesced": 0        # calls answered by an in-flight twin (= calls saved)
+        }
+
+    def _make_key(self, kwargs):
+        """Returns a stable hash for deterministic requests, None otherwise."""
+        if kwargs.get("temperature", 1.0) != 0:
+            return None
+        extra_body = kwargs.get("extra_body") or {}
+        key_src = {
+            "model": kwargs.get("model"),
+            "messages": kwargs.get("messages"),
+            "format": extra_body.get("format")
+        }
+        try:
+            raw = json.dumps(key_src, sort_keys=True, ensure_ascii=False)
+        except (TypeError, ValueError):
+            return None
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    async def create(self, **kwargs):
+        """Drop-in replacement for `client.chat.completions.create(**kwargs)`."""
+        self.stats["requests"] += 1
+        key = self._make_key(kwargs)
+
+        if key is None:
+            self.stats["upstream_calls"] += 1
+            return await self.client.chat.completions.create(**kwargs)
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+            print(f"🔗 [Coalescer] Joined in-flight call ({self.stats['coalesced']} saved so far)")
+        else:
+            self.stats["upstream_calls"] += 1
+            task = asyncio.ensure_future(self.client.chat.completions.create(**kwargs))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _t, k=key: self._inflight.pop(k, None))
+
+        # Shield: one waiter disconnecting must not cancel the call for the others
+        return await asyncio.shield(task)
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["inflight"] = len(self._inflight)
+        return stats
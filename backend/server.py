@@ -9,6 +9,7 @@ import hashlib
 import uvicorn
 import uuid
 import base64
+import asyncio
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from openai import AsyncOpenAI
 import chromadb
@@ -16,6 +17,7 @@ from sitemap_manager import SitemapManager
 from image_utils import draw_grounding_marks
 from dataset_recorder import DatasetRecorder
 from brain_planner import PlannerBrain
+from request_coalescer import RequestCoalescer
 
 # Ensure directories exist
 CROP_DIR = "crop_screenshots"
@@ -38,6 +40,7 @@ print(f"🧠 Text Model: {TEXT_MODEL_NAME}")
 print(f"👁️ Vision Model: {VISION_MODEL_NAME}")
 
 client = AsyncOpenAI(api_key=API_KEY, base_url=OLLAMA_HOST)
+llm = RequestCoalescer(client)  # Single-flight dedup for identical deterministic calls
 chroma_client = chromadb.PersistentClient(path="./agent_brain_db")
 demo_collection = chroma_client.get_or_create_collection(name="demonstrations")
 rl_collection = chroma_client.get_or_create_collection(name="rl_feedback")
@@ -53,9 +56,20 @@ planner = PlannerBrain()
 current_recording_session = [] 
 last_context_cache = {}        
 session_step_history = {}      
+session_step_actions = {} # session_id -> [(action_type, element text, value)] the model executed this task
 chat_history_cache = {}
 session_blacklists = {}
 session_plans = {}
+session_plan_tasks = {} # session_id -> background planner task
+session_nav_state = {} # session_id -> {last_click, auto_clicks, tried, navigated, visited, model_steps, steps_saved}
+MAX_AUTO_NAV_CLICKS = 6
+NAVIGATE_MIN_SCORE = int(os.environ.get("NAVIGATE_MIN_SCORE", 8)) # Sitemap score needed to jump by URL
+nav_metrics = {
+    "navigate_actions": 0,  # direct URL jumps emitted
+    "route_clicks": 0,      # nav-graph clicks emitted without a model call
+    "steps_saved": 0,       # sidebar clicks skipped by direct jumps
+    "recent_tasks": []      # last tasks: {goal, steps_saved, model_calls_saved}
+}
 
 # ==========================================
 # [Level 1] JSON Schema Definition (The "Cage")
@@ -65,7 +79,7 @@ AGENT_OUTPUT_SCHEMA = {
     "properties": {
         "action": {
             "type": "string",
-            "enum": ["click", "type", "select", "scroll", "finish", "error", "message"],
+            "enum": ["click", "type", "select", "scroll", "navigate", "finish", "error", "message"],
             "description": "The type of action to perform."
         },
         "id": {
@@ -74,7 +88,7 @@ AGENT_OUTPUT_SCHEMA = {
         },
         "value": {
             "type": "string",
-            "description": "The value to type, select, or scroll direction (e.g., 'down')."
+            "description": "The value to type, select, scroll direction (e.g., 'down'), or the URL to navigate to (e.g., '#/base/cards')."
         },
         "thought": {
             "type": "string",
@@ -203,6 +217,139 @@ def is_target_active_or_selected(desc, target_val, dom_str):
     except: pass
     return False
 
+def get_nav_state(session_id):
+    return session_nav_state.setdefault(session_id, {
+        "last_click": None, "auto_clicks": 0, "tried": set(),
+        "goal": None, "navigated": set(), "visited": set(), "model_steps": 0,
+        "steps_saved": 0, "model_calls_saved": 0
+    })
+
+def close_nav_state(session_id):
+    """Drops per-task nav state, keeping its savings in the metrics."""
+    state = session_nav_state.pop(session_id, None)
+    if state and state["model_calls_saved"]:
+        nav_metrics["recent_tasks"] = (nav_metrics["recent_tasks"] + [{
+            "goal": state["goal"],
+            "steps_saved": state["steps_saved"],
+            "model_calls_saved": state["model_calls_saved"]
+        }])[-50:]
+
+def confident_page(user_goal):
+    """Best sitemap page if its score is high and unambiguous, else None."""
+    ranked = sitemap.rank_pages(user_goal, limit=2)
+    if not ranked or ranked[0][1] < NAVIGATE_MIN_SCORE: return None
+    if len(ranked) > 1 and ranked[1][1] == ranked[0][1]: return None
+    return ranked[0][0]
+
+def observe_navigation(session_id, current_url):
+    """Feeds the nav graph: if the last click changed the URL, remember that transition."""
+    state = get_nav_state(session_id)
+    if state["last_click"] and current_url:
+        from_url, label = state["last_click"]
+        if from_url != current_url:
+            sitemap.record_transition(from_url, current_url, label)
+    state["last_click"] = None
+
+def plan_step_names_page(step_text, url):
+    """True if a plan step mentions the page (its title or last URL segment)."""
+    if not step_text or url not in sitemap.data["pages"]: return False
+    text = step_text.lower()
+    title = (sitemap.data["pages"][url].get("title") or "").lower()
+    segment = url.rstrip("/").rsplit("/", 1)[-1].lower()
+    return bool(title and title in text) or bool(segment and segment != "#" and segment in text)
+
+def next_nav_action(session_id, user_goal, current_url, dom_str, plan_step=None):
+    """
+    Deterministic navigation toward the sitemap's best page (no model call).
+    Jumps by URL when the sitemap is confident, otherwise clicks the furthest
+    element of the shortest click route that is already on screen.
+    Only steers before the model's first action, or when the current plan step
+    names the page, and never once the page has been reached (the agent may
+    have moved on from it on purpose, e.g. after a form submit redirect).
+    """
+    state = get_nav_state(session_id)
+    if current_url: state["visited"].add(current_url)
+    map_url, _ = sitemap.find_best_page(user_goal)
+    if not map_url or not current_url or map_url in state["visited"]: return None
+    if state["model_steps"] and not plan_step_names_page(plan_step, map_url): return None
+    state["goal"] = user_goal
+    route = sitemap.route_to(current_url, map_url)
+
+    # 1. High confidence: jump straight to the URL (once per target)
+    if confident_page(user_goal) == map_url and map_url not in state["navigated"]:
+        state["navigated"].add(map_url)
+        saved = max(len(route) - 1, 0) if route else 0
+        state["steps_saved"] += saved
+        state["model_calls_saved"] += 1
+        nav_metrics["navigate_actions"] += 1
+        nav_metrics["steps_saved"] += saved
+        print(f"🧭 [Navigate] {current_url} -> {map_url} (saves {saved} click(s))")
+        return {"action": "navigate", "id": "", "value": map_url, "thought": f"Sitemap is confident the goal is at {map_url}."}
+
+    # 2. Otherwise follow the click route
+    if state["auto_clicks"] >= MAX_AUTO_NAV_CLICKS: return None
+    if not route: return None
+    for label in reversed(route):
+        target_id = find_id_by_desc(label, dom_str)
+        if target_id and (current_url, target_id) not in state["tried"]:
+            state["tried"].add((current_url, target_id))
+            state["auto_clicks"] += 1
+            state["model_calls_saved"] += 1
+            nav_metrics["route_clicks"] += 1
+            print(f"🧭 [Nav Graph] {current_url} -> {map_url}: {' -> '.join(route)} (clicking '{label}')")
+            return {"action": "click", "id": target_id, "value": "", "thought": f"Sitemap route to {map_url}: {' -> '.join(route)}"}
+    return None
+
+def format_plan(plan_data):
+    return "\n".join([f"{i+1}. {s['text']} {'(Has Image)' if s['image'] else ''}" for i, s in enumerate(plan_data)])
+
+def action_matches_step(step_text, element_text, value):
+    """True if an executed action is the one a plan step asks for (its element text or value is named)."""
+    text = (step_text or "").lower()
+    for needle in (element_text, value):
+        needle = (needle or "").replace("[Sidebar]", "").replace("[Header]", "").replace("[Active]", "").strip().lower()
+        if len(needle) > 1 and needle in text: return True
+    return False
+
+def attach_plan(session_id, plan_data):
+    """
+    Attaches a plan to the session. Model actions executed before the plan
+    arrived count as progress only if they match the plan steps in order;
+    navigation jumps, nav-graph clicks, scrolls and errors never do.
+    """
+    done_steps = 0
+    for action_type, element_text, value in session_step_actions.get(session_id, []):
+        if done_steps < len(plan_data) and action_matches_step(plan_data[done_steps]['text'], element_text, value):
+            done_steps += 1
+    session_plans[session_id] = {
+        "steps": plan_data,
+        "current_idx": done_steps
+    }
+
+def cancel_background_plan(session_id):
+    task = session_plan_tasks.pop(session_id, None)
+    if task and not task.done():
+        task.cancel()
+
+async def plan_in_background(websocket, session_id, user_goal, sitemap_context, sitemap_version=""):
+    """Runs the planner off the step path and attaches the plan once ready (cache already missed)."""
+    plan_data = await planner.generate_plan(user_goal, sitemap_context=sitemap_context, sitemap_version=sitemap_version, use_cache=False)
+
+    # A newer task (or a disconnect) superseded this plan
+    if session_plan_tasks.get(session_id) is not asyncio.current_task(): return
+    session_plan_tasks.pop(session_id, None)
+
+    if not plan_data:
+        print(f"⚠️ [System 2] No plan for: {user_goal}. Continuing with demo guidance.")
+        return
+
+    attach_plan(session_id, plan_data)
+    plan_str = format_plan(plan_data)
+    print(f"✅ Plan Generated with Visuals (attached at step {session_plans[session_id]['current_idx'] + 1}):\n{plan_str}")
+    try:
+        await websocket.send_text(json.dumps({"action": "message", "value": f"Plan:\n{plan_str}"}))
+    except Exception: pass
+
 # ==========================================
 # 4. Core Brain A: Task Execution
 # ==========================================
@@ -232,7 +379,7 @@ async def ask_brain_task(user_goal, dom_state, session_id, history_logs, instant
 
         # Sitemap
         map_url, map_reason = sitemap.find_best_page(user_goal)
-        map_hint = f"🗺️ SITEMAP: Goal likely at {map_url} ({map_reason}). Navigate via Sidebar." if map_url else ""
+        map_hint = f"🗺️ SITEMAP: Goal likely at {map_url} ({map_reason}). Navigate via Sidebar, or use action 'navigate' with value '{map_url}'." if map_url else ""
 
         # RAG Logic
         demo_info = ""
@@ -412,7 +559,7 @@ async def ask_brain_task(user_goal, dom_state, session_id, history_logs, instant
 
         try:
             # 🔥 [Level 1] Enforce Strict Schema
-            response = await client.chat.completions.create(
+            response = await llm.create(
                 model=used_model,
                 messages=messages_payload,
                 temperature=0.0,
@@ -439,8 +586,18 @@ async def ask_brain_task(user_goal, dom_state, session_id, history_logs, instant
                 
                 # 🔥 Pass through SCROLL actions immediately
                 if res_json.get('action') == 'scroll':
+                    recorder.mark_sent(len(history_logs) + 1, attempt)
                     return json.dumps(res_json)
 
+                # 🧭 Pass through NAVIGATE to known routes only
+                if res_json.get('action') == 'navigate':
+                    if res_json.get('value') in sitemap.data["pages"]:
+                        recorder.mark_sent(len(history_logs) + 1, attempt)
+                        return json.dumps(res_json)
+                    print(f"⚠️ Unknown navigate target. Retrying...")
+                    last_error_context = f"'{res_json.get('value')}' is not a known URL. Use the URL from the SITEMAP hint."
+                    continue
+
                 target_id = str(res_json.get('id', ''))
                 target_id = resolve_dom_id(target_id, dom_state)
                 res_json['id'] = target_id 
@@ -477,6 +634,7 @@ async def ask_brain_task(user_goal, dom_state, session_id, history_logs, instant
                         last_error_context = f"Action on ID {target_id} had no effect. It is BANNED."
                         continue 
                 
+                recorder.mark_sent(len(history_logs) + 1, attempt) # Only validated actions become SFT samples
                 return json.dumps(res_json)
 
             except: pass
@@ -491,13 +649,26 @@ async def ask_brain_chat(user_msg, dom_state, session_id):
     history = chat_history_cache[session_id]
     history.append({"role": "user", "content": f"Context:\n{dom_state[:500]}\nQ: {user_msg}"})
     try:
-        res = await client.chat.completions.create(model=TEXT_MODEL_NAME, messages=history, temperature=0.7)
+        res = await llm.create(model=TEXT_MODEL_NAME, messages=history, temperature=0.7)
         reply = res.choices[0].message.content
         if "<think>" in reply: reply = reply.split("</think>")[-1].strip()
         history.append({"role": "assistant", "content": reply})
         return json.dumps({"action": "message", "value": reply})
     except Exception as e: return json.dumps({"action": "message", "value": f"Chat Error: {str(e)}"})
 
+@app.on_event("shutdown")
+def flush_state():
+    sitemap.flush()
+
+@app.get("/metrics")
+async def metrics():
+    return {
+        "llm": llm.get_stats(),
+        "plan_cache": planner.plan_cache.get_stats(),
+        "sitemap_writes": sitemap.writer.stats,
+        "navigation": nav_metrics
+    }
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
@@ -529,6 +700,10 @@ async def websocket_endpoint(websocket: WebSocket):
                         payload['full_image_path'] = recorder.save_demo_image(full_b64, filename_full)
                         print(f"📸 Full Screen saved: {filename_full}")
 
+                    if current_recording_session and payload.get('url'):
+                        prev_event = current_recording_session[-1]
+                        sitemap.record_transition(prev_event.get('url'), payload['url'], prev_event.get('element_desc'))
+
                     current_recording_session.append(payload)
                     save_raw_log(payload)
                     continue
@@ -546,6 +721,7 @@ async def websocket_endpoint(websocket: WebSocket):
                             ids=[f"demo_{datetime.datetime.now().timestamp()}"]
                         )
                         save_raw_log({"type": "demo_saved", "name": task_name})
+                        planner.plan_cache.invalidate_goal(task_name)
                         await websocket.send_text(json.dumps({"action": "message", "value": f"Skill Saved: {task_name}"}))
                         current_recording_session = [] 
                     continue
@@ -661,6 +837,8 @@ async def websocket_endpoint(websocket: WebSocket):
                     page_structure = payload.get("page_structure")
                     if page_structure: sitemap.update_flesh(page_structure)
                     
+                    current_url = payload.get("url") or (page_structure or {}).get("url")
+                    
                     mode = payload.get("mode", "task")
                     is_new_task = payload.get("is_new_task", False)
                     if not dom_tree: await websocket.send_text(json.dumps({"action": "message", "value": "UI Error"})); continue
@@ -670,7 +848,10 @@ async def websocket_endpoint(websocket: WebSocket):
                     else:
                         if is_new_task:
                             session_step_history[session_id] = []
+                            session_step_actions[session_id] = []
                             session_blacklists[session_id] = {} 
+                            cancel_background_plan(session_id)
+                            close_nav_state(session_id)
                             print("🔄 New Task Started")
                             recorder.start_new_session(user_msg)
                             
@@ -678,21 +859,22 @@ async def websocket_endpoint(websocket: WebSocket):
                             # 🔥 FIX: Skip Planning for '_find' mode
                             # ==========================================
                             if not find_match:
-                                print(f"🧠 [System 2] Generating Plan for: {user_msg}")
-                                await websocket.send_text(json.dumps({"action": "message", "value": "🧠 Thinking & Planning..."}))
-                                skeleton = sitemap.get_skeleton()
-                                plan_data = await planner.generate_plan(user_msg, sitemap_context=str(skeleton[:2000]))
-                                
-                                if plan_data:
-                                    session_plans[session_id] = {
-                                        "steps": plan_data, 
-                                        "current_idx": 0
-                                    }
-                                    plan_str = "\n".join([f"{i+1}. {s['text']} {'(Has Image)' if s['image'] else ''}" for i, s in enumerate(plan_data)])
-                                    print(f"✅ Plan Generated with Visuals:\n{plan_str}")
+                                sitemap_version = sitemap.data.get("version", "")
+                                cached_plan = planner.lookup_plan(user_msg, sitemap_version)
+                                if cached_plan:
+                                    attach_plan(session_id, cached_plan)
+                                    plan_str = format_plan(cached_plan)
+                                    print(f"♻️ [System 2] Reusing cached plan:\n{plan_str}")
                                     await websocket.send_text(json.dumps({"action": "message", "value": f"Plan:\n{plan_str}"}))
                                 else:
+                                    # Plan in the background; the first step runs on demo guidance meanwhile
+                                    print(f"🧠 [System 2] Generating Plan for: {user_msg} (background)")
+                                    await websocket.send_text(json.dumps({"action": "message", "value": "🧠 Planning in background..."}))
                                     session_plans[session_id] = None
+                                    sitemap_context = sitemap.get_planner_context(user_msg)
+                                    session_plan_tasks[session_id] = asyncio.create_task(
+                                        plan_in_background(websocket, session_id, user_msg, sitemap_context, sitemap_version)
+                                    )
                             else:
                                 print(f"⏩ Visual Search Mode: Skipping Plan Generation.")
                                 session_plans[session_id] = None 
@@ -720,20 +902,30 @@ async def websocket_endpoint(websocket: WebSocket):
                                     final_ref_image = encode_image(step_obj['image'])
                                     print(f"🖼️ Using Visual Reference from Plan Step {idx+1}")
 
+                        # ==========================================
+                        # 🧭 Deterministic Navigation (Nav Graph)
+                        # ==========================================
+                        observe_navigation(session_id, current_url)
+                        nav_action = None if find_match else next_nav_action(session_id, user_msg, current_url, dom_tree, forced_plan_text)
+
                         # ==========================================
                         # 🚀 Execute Brain
                         # ==========================================
-                        action_json_str = await ask_brain_task(
-                            user_msg, 
-                            dom_tree, 
-                            session_id, 
-                            session_step_history[session_id], 
-                            session_blacklists[session_id],
-                            marked_screenshot=marked_screenshot_b64, 
-                            raw_screenshot=raw_screenshot,
-                            forced_plan=forced_plan_text, 
-                            reference_image=final_ref_image 
-                        )
+                        if nav_action:
+                            action_json_str = json.dumps(nav_action)
+                        else:
+                            get_nav_state(session_id)["model_steps"] += 1 # The model now drives; nav only follows the plan
+                            action_json_str = await ask_brain_task(
+                                user_msg, 
+                                dom_tree, 
+                                session_id, 
+                                session_step_history[session_id], 
+                                session_blacklists[session_id],
+                                marked_screenshot=marked_screenshot_b64, 
+                                raw_screenshot=raw_screenshot,
+                                forced_plan=forced_plan_text, 
+                                reference_image=final_ref_image 
+                            )
 
                         # ==============================================================
                         # 0. Unified Parsing
@@ -780,10 +972,11 @@ async def websocket_endpoint(websocket: WebSocket):
                                     idx = current_plan_data['current_idx'] + 1 if current_plan_data else '?'
                                     print(f"⏳ Step {idx} Pending: Scrolling to find target...")
                                 
-                                # B. Action = Advance Plan
-                                elif action_type in ['click', 'type', 'select']:
+                                # B. Action = Advance Plan (only the model's action for the step it was given;
+                                #    server-routed nav clicks never use up plan steps, as in attach_plan)
+                                elif action_type in ['click', 'type', 'select'] and not nav_action:
                                     if target_id or act_data.get('x'):
-                                        if current_plan_data: 
+                                        if current_plan_data and forced_plan_text: 
                                             current_plan_data['current_idx'] += 1
                                             print(f"✅ Step {current_plan_data['current_idx']} Action Generated. Advancing Plan.")
                                             
@@ -797,8 +990,14 @@ async def websocket_endpoint(websocket: WebSocket):
                             if action_type in ['click', 'type', 'select'] and str(target_id).isdigit():
                                 val = act_data.get('value', '')
                                 session_step_history[session_id].append(f"{action_type} ID {target_id} (Val: {val})")
+                                _, element_text = verify_id_in_dom(target_id, dom_tree)
+                                if not nav_action: session_step_actions.setdefault(session_id, []).append((action_type, element_text, val))
+                                if action_type == 'click':
+                                    get_nav_state(session_id)["last_click"] = (current_url, element_text)
                             elif action_type == 'scroll':
                                 session_step_history[session_id].append(f"scroll {act_data.get('value', 'down')}")
+                            elif action_type == 'navigate':
+                                session_step_history[session_id].append(f"navigate {act_data.get('value')}")
                         except: pass
                         
                         print(f"🤖 Action: {action_json_str}")
@@ -827,6 +1026,9 @@ async def websocket_endpoint(websocket: WebSocket):
             except json.JSONDecodeError: pass
     except WebSocketDisconnect: pass
     except Exception as e: print(f"❌ Error: {e}")
+    finally:
+        cancel_background_plan(session_id)
+        close_nav_state(session_id)
 
 if __name__ == "__main__":
     print("🚀 Server Starting...")
@@ -0,0 +1,213 @@
+import re
+import math
+from collections import Counter
+
+TOKEN_RE = re.compile(r'\w+')
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or "").lower())
+
+class SitemapIndex:
+    """
+    Inverted index over sitemap pages and global nav.
+
+    A goal word matches a field iff it is a substring of one of the field's
+    \\w+ tokens, so each goal word is expanded against the vocabulary once
+    (cached) and scoring only touches the postings of the expanded tokens.
+    This reproduces the original linear-scan scores exactly:
+    url +3, title +5, +1 per matching element (max 10).
+    BM25 over all page tokens is kept as a secondary relevance signal.
+    """
+    BM25_K1 = 1.2
+    BM25_B = 0.75
+    MAX_EXPANSIONS = 4096 # Cached goal words (the cache is dropped when full)
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.url_postings = {}     # token -> set(url)
+        self.title_postings = {}   # token -> set(url)
+        self.elem_postings = {}    # token -> {url: set(element index)}
+        self.nav_postings = {}     # token -> set(nav_text)
+        self.page_terms = {}       # url -> (url_toks, title_toks, {token: elem idxs}, Counter)
+        self.nav_terms = {}        # nav_text -> set(token)
+        self.doc_freq = Counter()  # token -> number of pages containing it
+        self.total_len = 0
+        self.page_seq = {}         # url -> insertion order (ties go to the earliest page)
+        self.nav_seq = {}
+        self._next_seq = 0
+        self._vocab = Counter()    # token -> number of postings lists referencing it
+        self._expansions = {}      # goal word -> set(vocab tokens containing it), at most MAX_EXPANSIONS
+
+    def rebuild(self, data):
+        self.clear()
+        for url, page in data.get("pages", {}).items():
+            self.index_page(url, page)
+        for nav_text in data.get("global_nav", {}):
+            self.index_nav(nav_text)
+
+    # --- Vocabulary ---
+
+    def _vocab_add(self, token):
+        self._vocab[token] += 1
+        if self._vocab[token] == 1:
+            for word, toks in self._expansions.items():
+                if word in token: toks.add(token)
+
+    def _vocab_remove(self, token):
+        self._vocab[token] -= 1
+        if self._vocab[token] <= 0:
+            del self._vocab[token]
+            for toks in self._expansions.values():
+                toks.discard(token)
+
+    def expand(self, word):
+        toks = self._expansions.get(word)
+        if toks is None:
+            # Cached expansions are kept current by _vocab_add/_vocab_remove, so bound their number
+            if len(self._expansions) >= self.MAX_EXPANSIONS: self._expansions.clear()
+            toks = {t for t in self._vocab if word in t}
+            self._expansions[word] = toks
+        return toks
+
+    # --- Pages ---
+
+    def index_page(self, url, page):
+        self.remove_page(url)
+        url_toks = set(tokenize(url))
+        title_toks = set(tokenize(page.get("title")))
+        elem_toks = {}
+        for idx, elem in enumerate(page.get("elements", [])):
+            for t in tokenize(elem):
+                elem_toks.setdefault(t, set()).add(idx)
+
+        tf = Counter(tokenize(url)) + Counter(tokenize(page.get("title")))
+        for elem in page.get("elements", []):
+            tf.update(tokenize(elem))
+
+        for t in url_toks:
+            self.url_postings.setdefault(t, set()).add(url)
+        for t in title_toks:
+            self.title_postings.setdefault(t, set()).add(url)
+        for t, idxs in elem_toks.items():
+            self.elem_postings.setdefault(t, {})[url] = idxs
+        for t in tf:
+            self.doc_freq[t] += 1
+            self._vocab_add(t)
+
+        self.page_terms[url] = (url_toks, title_toks, elem_toks, tf)
+        self.total_len += sum(tf.values())
+        if url not in self.page_seq:
+            self.page_seq[url] = self._next_seq
+            self._next_seq += 1
+
+    def remove_page(self, url):
+        terms = self.page_terms.pop(url, None)
+        if terms is None: return
+        url_toks, title_toks, elem_toks, tf = terms
+        for t in url_toks: self._discard(self.url_postings, t, url)
+        for t in title_toks: self._discard(self.title_postings, t, url)
+        for t in elem_toks: self._discard(self.elem_postings, t, url)
+        for t in tf:
+            self.doc_freq[t] -= 1
+            if self.doc_freq[t] <= 0: del self.doc_freq[t]
+            self._vocab_remove(t)
+        self.total_len -= sum(tf.values())
+
+    def forget_page(self, url):
+        """Removes a deleted page entirely (a re-added page goes to the end, like a dict)."""
+        self.remove_page(url)
+        self.page_seq.pop(url, None)
+
+    @staticmethod
+    def _discard(postings, token, key):
+        entry = postings.get(token)
+        if entry is None: return
+        if isinstance(entry, dict): entry.pop(key, None)
+        else: entry.discard(key)
+        if not entry: del postings[token]
+
+    # --- Global Nav ---
+
+    def index_nav(self, nav_text):
+        old = self.nav_terms.pop(nav_text, None)
+        if old:
+            for t in old:
+                self._discard(self.nav_postings, t, nav_text)
+                self._vocab_remove(t)
+        toks = set(tokenize(nav_text))
+        for t in toks:
+            self.nav_postings.setdefault(t, set()).add(nav_text)
+            self._vocab_add(t)
+        self.nav_terms[nav_text] = toks
+        if nav_text not in self.nav_seq:
+            self.nav_seq[nav_text] = self._next_seq
+            self._next_seq += 1
+
+    # --- Queries ---
+
+    def _expand_goal(self, goal_words):
+        tokens = set()
+        for w in goal_words: tokens |= self.expand(w)
+        return tokens
+
+    def score_pages(self, goal_words):
+        """Returns {url: legacy score} for every page with a non-zero score."""
+        tokens = self._expand_goal(goal_words)
+        scores = Counter()
+        url_hits, title_hits, elem_hits = set(), set(), {}
+        for t in tokens:
+            url_hits |= self.url_postings.get(t, set())
+            title_hits |= self.title_postings.get(t, set())
+            for url, idxs in self.elem_postings.get(t, {}).items():
+                elem_hits.setdefault(url, set()).update(idxs)
+        for url in url_hits: scores[url] += 3
+        for url in title_hits: scores[url] += 5
+        for url, idxs in elem_hits.items(): scores[url] += min(len(idxs), 10)
+        return scores
+
+    def idf(self, goal_words):
+        """{goal word: (expanded tokens, idf)} for the words present in the index, computed once per query."""
+        n_docs = len(self.page_terms)
+        terms = {}
+        for w in goal_words:
+            toks = self.expand(w)
+            if not toks: continue
+            # Substring-expanded tokens of one goal word count as one term
+            df = len(set().union(*(self._pages_with(t) for t in toks)))
+            terms[w] = (toks, math.log(1 + (n_docs - df + 0.5) / (df + 0.5)))
+        return terms
+
+    def bm25(self, url, goal_words, idf=None):
+        """BM25 of one page; pass idf=self.idf(goal_words) when scoring many pages for one query."""
+        terms = self.page_terms.get(url)
+        if not terms: return 0.0
+        if idf is None: idf = self.idf(goal_words)
+        tf = terms[3]
+        avg_len = (self.total_len / len(self.page_terms)) or 1.0
+        doc_len = sum(tf.values())
+        score = 0.0
+        for toks, weight in idf.values():
+            freq = sum(tf[t] for t in toks if t in tf)
+            if not freq: continue
+            norm = freq + self.BM25_K1 * (1 - self.BM25_B + self.BM25_B * doc_len / avg_len)
+            score += weight * freq * (self.BM25_K1 + 1) / norm
+        return score
+
+    def _pages_with(self, token):
+        pages = set(self.url_postings.get(token, ())) | self.title_postings.get(token, set())
+        pages.update(self.elem_postings.get(token, {}).keys())
+        return pages
+
+    def match_nav(self, goal_words):
+        """Nav entries matching any goal word, in insertion order."""
+        candidates = set()
+        for t in self._expand_goal(goal_words):
+            candidates |= self.nav_postings.get(t, set())
+        return sorted(candidates, key=lambda text: self.nav_seq[text])
+
+    def best_nav(self, goal_words):
+        """First nav entry (in insertion order) matching any goal word, or None."""
+        matches = self.match_nav(goal_words)
+        return matches[0] if matches else None
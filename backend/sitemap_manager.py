@@ -2,42 +2,89 @@ import json
 import os
 import datetime
 import re
+import threading
+import functools
+from sitemap_index import SitemapIndex
+from persistence import DebouncedWriter, load_json_safely
+from nav_graph import NavGraph
+
+def synchronized(method):
+    """
+    Serializes mutations with the background writer's snapshot.
+    A save() requested inside is handed to the writer after the lock is released
+    (the writer's snapshot takes this lock, so never wait on the writer while holding it).
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            self._mutating += 1
+            try:
+                result = method(self, *args, **kwargs)
+            finally:
+                self._mutating -= 1
+            dirty = self._save_pending and not self._mutating
+            if dirty: self._save_pending = False
+        if dirty: self.writer.mark_dirty()
+        return result
+    return wrapper
 
 class SitemapManager:
-    def __init__(self, filepath="sitemap_knowledge.json"):
+    def __init__(self, filepath="sitemap_knowledge.json", save_delay=2.0):
         self.filepath = filepath
         self.data = {
             "version": "",
             # Key: Button Text (e.g. "CoreUI Flags")
             # Value: List of Parents (e.g. ["Sidebar", "Icons"]) -> NOW: ["Icons"]
             "global_nav": {}, 
-            "pages": {} # URL -> {title, elements[], last_visited}
+            "pages": {}, # URL -> {title, elements[], last_visited}
+            "transitions": {} # From URL -> {To URL: {label, count}} (observed clicks)
         }
+        self.index = SitemapIndex() # Inverted index for find_best_page
+        self.lock = threading.RLock()
+        self.revision = 0 # Bumped when routes, titles, nav or elements change; invalidates skeleton/context
+        self._skeleton_cache = None # (revision, text)
+        self._context_cache = {} # (revision, goal, budget) -> text
+        self.graph_version = 0 # Bumped when anything NavGraph reads changes (routes, titles, nav, transition edges)
+        self._nav_graph = None # (graph_version, NavGraph)
+        self._mutating = 0 # Depth of @synchronized calls holding the lock
+        self._save_pending = False # save() called inside a mutator, handed over on the way out
+        self.writer = DebouncedWriter(filepath, self._snapshot, delay=save_delay)
         self.load()
 
     def load(self):
-        """Loads the sitemap from disk."""
-        if os.path.exists(self.filepath):
-            try:
-                with open(self.filepath, 'r', encoding='utf-8') as f:
-                    self.data = json.load(f)
-                
-                # Backward compatibility check
-                if "global_nav" not in self.data:
-                    self.data["global_nav"] = {}
-                
-                print(f"🗺️  Sitemap Loaded: {len(self.data['pages'])} pages known.")
-            except Exception as e:
-                print(f"⚠️ Sitemap corrupted ({e}), starting fresh.")
+        """Loads the sitemap from disk (falls back to the backup if the file is corrupted)."""
+        data = load_json_safely(self.filepath)
+        if data is None: return # Missing, or corrupted copies were moved aside (logged)
+
+        self.data = data
+        self.revision += 1
+        self.graph_version += 1
+        # Backward compatibility check
+        if "global_nav" not in self.data:
+            self.data["global_nav"] = {}
+        if "transitions" not in self.data:
+            self.data["transitions"] = {}
+        
+        self.index.rebuild(self.data)
+        print(f"🗺️  Sitemap Loaded: {len(self.data['pages'])} pages known.")
+
+    def _snapshot(self):
+        with self.lock:
+            return json.dumps(self.data, ensure_ascii=False, separators=(',', ':'))
 
     def save(self):
-        """Saves the current sitemap to disk."""
-        try:
-            with open(self.filepath, 'w', encoding='utf-8') as f:
-                json.dump(self.data, f, indent=2, ensure_ascii=False)
-        except Exception as e:
-            print(f"❌ Failed to save sitemap: {e}")
+        """Schedules a write-behind save (debounced, atomic, off the step path)."""
+        with self.lock:
+            if self._mutating:
+                self._save_pending = True # Handed to the writer once the outermost mutator releases the lock
+                return
+        self.writer.mark_dirty()
+
+    def flush(self):
+        """Writes pending changes immediately (shutdown)."""
+        self.writer.flush()
 
+    @synchronized
     def sync_skeleton(self, frontend_routes, frontend_version):
         """
         Syncs skeleton. Force save if file is missing even if version matches.
@@ -69,6 +116,7 @@ class SitemapManager:
             # Update title for existing
             else:
                 self.data["pages"][path]["title"] = r['title']
+            self.index.index_page(path, self.data["pages"][path])
 
         # Clean up dead pages
         current_urls = list(self.data["pages"].keys())
@@ -76,12 +124,25 @@ class SitemapManager:
         for url in current_urls:
             if url not in new_urls:
                 del self.data["pages"][url]
+                self.index.forget_page(url)
                 deleted += 1
 
+        # Drop transitions touching dead pages
+        transitions = self.data.setdefault("transitions", {})
+        for src in list(transitions):
+            if src not in new_urls:
+                del transitions[src]
+                continue
+            for dst in list(transitions[src]):
+                if dst not in new_urls: del transitions[src][dst]
+
         self.data["version"] = frontend_version
+        self.revision += 1
+        self.graph_version += 1
         self.save()
         print(f"🗺️  Sitemap Synced & Saved: {len(new_urls)} active pages.")
 
+    @synchronized
     def update_flesh(self, structure_data):
         """
         Updates content and Global Nav with HIERARCHY LIST.
@@ -90,6 +151,8 @@ class SitemapManager:
         url = structure_data.get('url')
         new_title = structure_data.get('title')
         if not url: return
+        nav_before = dict(self.data["global_nav"])
+        page_before = self._page_content(self.data["pages"].get(url))
 
         # Auto-add runtime discovered pages
         if url not in self.data["pages"]:
@@ -127,6 +190,7 @@ class SitemapManager:
                         self.data["global_nav"][text] = meaningful_path
                     else:
                         self.data["global_nav"][text] = [] # Root level item
+                    self.index.index_nav(text)
             else:
                 # Main Content: flatten for search
                 if len(text) > 2 and len(text) < 50:
@@ -135,10 +199,66 @@ class SitemapManager:
                     if p not in ignored_regions: keywords.add(p)
 
         # Only update if content was found (prevent wiping data on partial scans)
+        page = self.data["pages"][url]
         if keywords:
-            self.data["pages"][url]["elements"] = list(keywords)
-            self.data["pages"][url]["last_visited"] = datetime.datetime.now().isoformat()
+            if set(page.get("elements", [])) != keywords: page["elements"] = list(keywords)
+            page["last_visited"] = datetime.datetime.now().isoformat()
             self.save()
+        if self._page_content(page) != page_before:
+            self.index.index_page(url, page)
+            self.revision += 1
+        elif self.data["global_nav"] != nav_before:
+            self.revision += 1 # A re-visit of an unchanged page (only last_visited moved) keeps the caches
+        if self.data["global_nav"] != nav_before or (page_before or (None,))[0] != page.get("title"):
+            self.graph_version += 1 # New page, title or nav item (elements don't affect routes)
+
+    @staticmethod
+    def _page_content(page):
+        """What the skeleton, planner context and index see of a page (not last_visited)."""
+        if page is None: return None
+        return page.get("title"), frozenset(page.get("elements", []))
+
+    @synchronized
+    def record_transition(self, from_url, to_url, label):
+        """Remembers that clicking `label` on from_url landed on to_url."""
+        if not from_url or not to_url or from_url == to_url or not label: return
+        label = label.replace("[Sidebar]", "").replace("[Header]", "").replace("[Active]", "").strip()
+        if not label: return
+        edge = self.data.setdefault("transitions", {}).setdefault(from_url, {}).get(to_url)
+        if edge and edge["label"] == label:
+            edge["count"] += 1 # Counters are persisted but don't change any route
+        else:
+            self.data["transitions"][from_url][to_url] = {"label": label, "count": 1}
+            self.graph_version += 1 # Transitions only feed the nav graph, not the skeleton/context
+        self.save()
+
+    def get_nav_graph(self):
+        graph = self._nav_graph
+        if not graph or graph[0] != self.graph_version:
+            with self.lock:
+                graph = self._nav_graph = (self.graph_version, NavGraph(self.data))
+        return graph[1]
+
+    def route_to(self, current_url, target_url):
+        """
+        Exact click sequence from current_url to target_url.
+        Returns: list of element labels to click ([] if already there), or None if unknown.
+        """
+        if not target_url: return None
+        return self.get_nav_graph().shortest_path(current_url or NavGraph.ANYWHERE, target_url)
+
+    def rank_pages(self, user_goal, limit=5):
+        """
+        Ranks pages for a goal using the inverted index.
+        Returns: list of (URL, score, bm25) sorted by score, then BM25, then page order.
+        """
+        goal_words = set(re.findall(r'\w+', user_goal.lower()))
+        if not goal_words: return []
+        scores = self.index.score_pages(goal_words)
+        idf = self.index.idf(goal_words)
+        ranked = [(url, score, self.index.bm25(url, goal_words, idf)) for url, score in scores.items()]
+        ranked.sort(key=lambda r: (-r[1], -r[2], self.index.page_seq[r[0]]))
+        return ranked[:limit]
 
     def find_best_page(self, user_goal):
         """
@@ -152,47 +272,46 @@ class SitemapManager:
         goal_words = set(re.findall(r'\w+', user_goal.lower()))
         if not goal_words: return None, ""
 
-        # 1. Search Pages (Direct URL match)
-        for url, data in self.data["pages"].items():
-            score = 0
-            if any(w in url.lower() for w in goal_words): score += 3
-            
-            title = data.get('title', '').lower()
-            if any(w in title for w in goal_words): score += 5
-            
-            hits = 0
-            for elem in data.get('elements', []):
-                if any(w in elem.lower() for w in goal_words): hits += 1
-            score += min(hits, 10)
-            
-            if score > max_score:
-                max_score = score
-                best_url = url
-                reason = f"Matched page '{data.get('title')}'."
+        # 1. Search Pages (Direct URL match) - via inverted index, earliest page wins ties
+        scores = self.index.score_pages(goal_words)
+        if scores:
+            best_url = min(scores, key=lambda url: (-scores[url], self.index.page_seq[url]))
+            max_score = scores[best_url]
+            reason = f"Matched page '{self.data['pages'][best_url].get('title')}'."
 
         # 2. 🔥 Search Global Nav (Sidebar) - Fallback
         # If no specific page found, check if it's a sidebar item
         if max_score < 2:
-            for nav_text, nav_path_list in self.data["global_nav"].items():
-                if any(w in nav_text.lower() for w in goal_words):
+            nav_text = self.index.best_nav(goal_words)
+            if nav_text is not None:
+                nav_path_list = self.data["global_nav"][nav_text]
                     
-                    # 🔥🔥 GENERATE CHAINED INSTRUCTION
-                    if isinstance(nav_path_list, list) and nav_path_list:
-                        # Construct: "Click 'Parent' -> Click 'Child'"
-                        steps = " -> ".join([f"Click '{p}'" for p in nav_path_list])
-                        return None, f"Found '{nav_text}' in Sidebar. Navigation Path: {steps} -> Click '{nav_text}'."
-                    else:
-                        return None, f"Found '{nav_text}' in Sidebar (Root Level). Click it directly."
+                # 🔥🔥 GENERATE CHAINED INSTRUCTION
+                if isinstance(nav_path_list, list) and nav_path_list:
+                    # Construct: "Click 'Parent' -> Click 'Child'"
+                    steps = " -> ".join([f"Click '{p}'" for p in nav_path_list])
+                    return None, f"Found '{nav_text}' in Sidebar. Navigation Path: {steps} -> Click '{nav_text}'."
+                else:
+                    return None, f"Found '{nav_text}' in Sidebar (Root Level). Click it directly."
 
         if max_score > 2:
             return best_url, reason
         return None, ""
-# [NEW] Insert this method into SitemapManager class
+
+    def _nav_line(self, item, parents):
+        # e.g. "Buttons -> Button Groups -> Click Me"
+        if parents: return f"{' -> '.join(parents)} -> {item}"
+        return f"{item}"
+
     def get_skeleton(self):
         """
         Returns a compressed text representation of the site structure 
         (Global Nav + Known Pages) for the AI Planner.
+        Cached until the sitemap revision changes.
         """
+        if self._skeleton_cache and self._skeleton_cache[0] == self.revision:
+            return self._skeleton_cache[1]
+
         lines = []
         
         # 1. Summarize Global Navigation (Sidebar)
@@ -202,12 +321,7 @@ class SitemapManager:
             lines.append("--- GLOBAL NAVIGATION (SIDEBAR) ---")
             # Sort to make it deterministic
             for item, parents in sorted(nav_data.items()):
-                if parents:
-                    # e.g. "Buttons -> Button Groups -> Click Me"
-                    path = " -> ".join(parents)
-                    lines.append(f"{path} -> {item}")
-                else:
-                    lines.append(f"{item}")
+                lines.append(self._nav_line(item, parents))
 
         # 2. Summarize Known Pages
         # Format: "#/dashboard (Dashboard)"
@@ -216,41 +330,66 @@ class SitemapManager:
             lines.append("\n--- KNOWN URLS ---")
             for url, info in sorted(pages_data.items()):
                 title = info.get("title", "Untitled")
-                # Only show relevant pages (skip overly generic ones if list is huge)
                 lines.append(f"{url} | {title}")
         
-        return "\n".join(lines)
+        skeleton = "\n".join(lines)
+        self._skeleton_cache = (self.revision, skeleton)
+        return skeleton
 
-    # [NEW] Insert this method into SitemapManager class
-    def get_skeleton(self):
+    def get_planner_context(self, user_goal, budget_tokens=500):
         """
-        Returns a compressed text representation of the site structure 
-        (Global Nav + Known Pages) for the AI Planner.
+        Goal-relevant sitemap summary for the planner, capped at ~budget_tokens
+        (estimated as 4 chars/token). Relevant pages and nav paths come first,
+        the rest of the skeleton fills whatever budget is left.
+        Cached per (revision, goal, budget).
         """
-        lines = []
-        
-        # 1. Summarize Global Navigation (Sidebar)
-        # Format: "Sidebar: Parent -> Child -> Item"
+        key = (self.revision, " ".join(user_goal.lower().split()), budget_tokens)
+        if key in self._context_cache:
+            return self._context_cache[key]
+
+        budget_chars = budget_tokens * 4
+        lines, used, seen = [], 0, set()
+        listed = set() # Bare "url | title" lines already covered by the relevant section
+
+        def add(line):
+            nonlocal used
+            if line in seen or used + len(line) + 1 > budget_chars: return False
+            seen.add(line)
+            lines.append(line)
+            used += len(line) + 1
+            return True
+
+        goal_words = set(re.findall(r'\w+', user_goal.lower()))
+        ranked = self.rank_pages(user_goal, limit=10)
+        if ranked:
+            add("--- RELEVANT PAGES ---")
+            for url, _score, _bm25 in ranked:
+                info = self.data["pages"][url]
+                hits = [e for e in info.get("elements", []) if any(w in e.lower() for w in goal_words)][:5]
+                line = f"{url} | {info.get('title', 'Untitled')}"
+                bare = line
+                if hits: line += f" | contains: {', '.join(hits)}"
+                if add(line): listed.add(bare) # Don't repeat it in the generic listing
+
         nav_data = self.data.get("global_nav", {})
-        if nav_data:
-            lines.append("--- GLOBAL NAVIGATION (SIDEBAR) ---")
-            # Sort to make it deterministic
-            for item, parents in sorted(nav_data.items()):
-                if parents:
-                    # e.g. "Buttons -> Button Groups -> Click Me"
-                    path = " -> ".join(parents)
-                    lines.append(f"{path} -> {item}")
-                else:
-                    lines.append(f"{item}")
+        nav_hits = self.index.match_nav(goal_words) if goal_words else []
+        if nav_hits:
+            add("--- RELEVANT NAVIGATION (SIDEBAR) ---")
+            for item in nav_hits[:10]:
+                add(self._nav_line(item, nav_data[item]))
 
-        # 2. Summarize Known Pages
-        # Format: "#/dashboard (Dashboard)"
-        pages_data = self.data.get("pages", {})
-        if pages_data:
-            lines.append("\n--- KNOWN URLS ---")
-            for url, info in sorted(pages_data.items()):
-                title = info.get("title", "Untitled")
-                # Only show relevant pages (skip overly generic ones if list is huge)
-                lines.append(f"{url} | {title}")
-        
-        return "\n".join(lines)
\ No newline at end of file
+        # Fill the remaining budget with the generic skeleton
+        header = None
+        for line in self.get_skeleton().split("\n"):
+            if not line.strip() or line in seen or line in listed: continue
+            if line.startswith("---"):
+                header = line
+                continue
+            if header and not add(header): break
+            header = None
+            if not add(line) and used + 32 > budget_chars: break
+
+        context = "\n".join(lines)
+        if len(self._context_cache) > 256: self._context_cache.clear()
+        self._context_cache[key] = context
+        return context
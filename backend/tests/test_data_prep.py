@@ -0,0 +1,44 @@
+import glob
+import json
+import os
+
+import data_prep
+
+def task(name, *target_ids):
+    lines = [{"type": "record_event", "element_desc": f"[{t}] <button>", "action": {"type": "click", "target_id": t}} for t in target_ids]
+    return lines + [{"type": "demo_saved", "name": name}]
+
+def write_log(path, entries):
+    path.write_text("".join(json.dumps(e) + "\n" for e in entries))
+
+def samples(out_dir):
+    rows = []
+    for part in sorted(glob.glob(os.path.join(out_dir, "part-*.jsonl"))):
+        with open(part, encoding="utf-8") as f:
+            rows += [json.loads(line)["instruction"] for line in f]
+    return sorted(rows)
+
+def test_replaced_log_rebuilds_instead_of_duplicating(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_prep, "STATE_FILE", str(tmp_path / "state.json"))
+    log, out = tmp_path / "log.jsonl", str(tmp_path / "out")
+    write_log(log, task("first", "1", "2"))
+    data_prep.process_logs(str(log), out)
+    assert samples(out) == ["USER GOAL: first"] * 2
+
+    # Appended: only the new task is processed
+    with open(log, "a") as f:
+        f.write("".join(json.dumps(e) + "\n" for e in task("second", "3")))
+    data_prep.process_logs(str(log), out)
+    assert samples(out) == ["USER GOAL: first"] * 2 + ["USER GOAL: second"]
+
+    # Rotated: a new log, already longer than the checkpoint offset
+    rotated = tmp_path / "rotated.jsonl"
+    write_log(rotated, task("third", "4", "5", "6", "7", "8", "9"))
+    os.replace(rotated, log)
+    data_prep.process_logs(str(log), out)
+    assert samples(out) == ["USER GOAL: third"] * 6
+
+    # Truncated
+    write_log(log, task("fourth", "1"))
+    data_prep.process_logs(str(log), out)
+    assert samples(out) == ["USER GOAL: fourth"]
@@ -0,0 +1,65 @@
+import json
+
+from dataset_builder import _scan_session
+
+DOM = '[12] <button> "Save"\n[13] <input> "Name"'
+
+def attempt(step, action, attempt=0, model="agent-vl"):
+    return {"step": step, "attempt": attempt, "model": model, "images": {},
+            "context": {"dom": DOM}, "llm_output": {"parsed_action": action}}
+
+def write_session(tmp_path, entries, sent_markers=False):
+    session = tmp_path / "session_1"
+    session.mkdir()
+    info = {"goal": "save the form", "sent_markers": sent_markers} if sent_markers else {"goal": "save the form"}
+    (session / "session_info.jsonl").write_text(json.dumps(info) + "\n")
+    path = session / "trajectory.jsonl"
+    path.write_text("".join(json.dumps(e) + "\n" for e in entries))
+    return str(path)
+
+def outputs(result):
+    return [json.loads(r["output"]) for r in result["sft"]]
+
+def test_legacy_sessions_use_the_final_accepted_attempts(tmp_path):
+    path = write_session(tmp_path, [
+        attempt(1, {"action": "click", "id": "99"}),                       # ID not in the DOM (retried)
+        attempt(1, {"action": "navigate", "value": "nowhere"}, 1),         # Unknown URL (retried)
+        attempt(1, {"action": "type", "id": "13", "value": "Ann"}, 2),     # Sent
+        attempt(2, {"action": "click", "id": "12"}),                       # Sent, then rejected by the frontend
+        attempt(3, {"action": "error", "value": "Element hidden"}, model="Frontend Guard"),
+        attempt(3, {"action": "scroll", "value": "down"}),                 # Correction
+        attempt(4, {"action": "message", "value": "Done"}),
+        attempt(5, {"action": "navigate", "value": "#/forms"}),            # Trailing step: may still be retried
+    ])
+    result = _scan_session(path, 0, str(tmp_path))
+    assert outputs(result) == [
+        {"action": "type", "id": "13", "value": "Ann"},
+        {"action": "scroll", "id": "", "value": "down"},
+    ]
+
+    # The next scan resumes at the trailing step and emits it once a later step exists
+    with open(path, "a") as f:
+        f.write(json.dumps(attempt(6, {"action": "click", "id": "12"})) + "\n")
+    assert outputs(_scan_session(path, result["offset"], str(tmp_path))) == [
+        {"action": "navigate", "id": "", "value": "#/forms"},
+    ]
+
+def sent(step, attempt=0):
+    return {"step": step, "attempt": attempt, "sent": True}
+
+def test_sent_markers_select_exactly_the_sent_attempt(tmp_path):
+    path = write_session(tmp_path, [
+        attempt(1, {"action": "click", "id": "12"}),                       # Banned (retried)
+        attempt(1, {"action": "type", "id": "13", "value": "Ann"}, 1),     # Sent
+        sent(1, 1),
+        attempt(2, {"action": "click", "id": "12"}),                       # Loop detected (retried)
+        attempt(2, {"action": "click", "id": "12"}, 1),                    # ... until retries ran out: never sent
+        attempt(3, {"action": "select", "id": "13", "value": "Ann"}),      # State satisfied: a message was sent instead
+        attempt(4, {"action": "scroll", "value": "down"}),
+        sent(4),
+        attempt(5, {"action": "click", "id": "12"}),
+    ], sent_markers=True)
+    assert outputs(_scan_session(path, 0, str(tmp_path))) == [
+        {"action": "type", "id": "13", "value": "Ann"},
+        {"action": "scroll", "id": "", "value": "down"},
+    ]
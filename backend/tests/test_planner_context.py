@@ -0,0 +1,72 @@
+from sitemap_manager import SitemapManager
+
+ROUTES = [
+    {"path": "/dashboard", "title": "Dashboard"},
+    {"path": "/base/accordion", "title": "Accordion"},
+    {"path": "/base/cards", "title": "Cards"},
+    {"path": "/forms/select", "title": "Select"},
+]
+
+def make_sitemap(tmp_path):
+    sitemap = SitemapManager(str(tmp_path / "sitemap.json"), save_delay=60.0)
+    sitemap.sync_skeleton(ROUTES, "v1")
+    return sitemap
+
+def test_relevant_page_without_element_hits_is_listed(tmp_path):
+    sitemap = make_sitemap(tmp_path)
+    assert sitemap.rank_pages("open the cards page")[0][0] == "#/base/cards"
+
+    lines = sitemap.get_planner_context("open the cards page").split("\n")
+    assert lines[0] == "--- RELEVANT PAGES ---"
+    assert lines[1] == "#/base/cards | Cards"
+    assert lines.count("#/base/cards | Cards") == 1 # Not repeated in the generic listing
+
+def test_relevant_page_with_element_hits_is_not_repeated(tmp_path):
+    sitemap = make_sitemap(tmp_path)
+    sitemap.update_flesh({"url": "#/base/cards", "title": "Cards", "sections": [
+        {"tag": "h5", "text": "Card title", "path": ["Cards"]},
+    ]})
+
+    context = sitemap.get_planner_context("open the cards page")
+    assert "#/base/cards | Cards | contains: " in context
+    assert "#/base/cards | Cards\n" not in context + "\n"
+
+def visit(sitemap, sections):
+    sitemap.update_flesh({"url": "#/base/cards", "title": "Cards", "sections": sections})
+
+def test_repeat_visit_hits_the_context_cache(tmp_path):
+    sitemap = make_sitemap(tmp_path)
+    sections = [{"tag": "h5", "text": "Card title", "path": ["Cards"]},
+                {"tag": "a", "text": "Cards", "path": ["Sidebar", "Base"]}]
+    visit(sitemap, sections)
+    context = sitemap.get_planner_context("open the cards page")
+    revision = sitemap.revision
+
+    visit(sitemap, list(reversed(sections))) # Same page again: only last_visited moves
+    sitemap.record_transition("#/dashboard", "#/base/cards", "Cards")
+    sitemap.record_transition("#/dashboard", "#/base/cards", "Cards") # Counter only
+    assert sitemap.revision == revision # Neither the visit nor transitions change the context
+    sitemap.record_transition("#/dashboard", "#/base/cards", "Cards")
+    visit(sitemap, sections)
+    assert sitemap.revision == revision
+    key = (revision, "open the cards page", 500)
+    assert sitemap.get_planner_context("open the cards page") is sitemap._context_cache[key]
+    assert sitemap.get_planner_context("open the cards page") == context
+
+    visit(sitemap, sections + [{"tag": "button", "text": "Add card", "path": ["Cards"]}])
+    assert sitemap.revision == revision + 1 # New content invalidates
+
+def test_nav_graph_is_rebuilt_only_for_route_changes(tmp_path):
+    sitemap = make_sitemap(tmp_path)
+    sections = [{"tag": "h5", "text": "Card title", "path": ["Cards"]}]
+    visit(sitemap, sections)
+    graph = sitemap.get_nav_graph()
+
+    visit(sitemap, sections + [{"tag": "button", "text": "Add card", "path": ["Cards"]}]) # Elements only
+    assert sitemap.get_nav_graph() is graph
+
+    sitemap.record_transition("#/dashboard", "#/base/cards", "Cards")
+    assert sitemap.route_to("#/dashboard", "#/base/cards") == ["Cards"] # New edge: rebuilt
+    graph = sitemap.get_nav_graph()
+    sitemap.record_transition("#/dashboard", "#/base/cards", "Cards") # Counter only
+    assert sitemap.get_nav_graph() is graph
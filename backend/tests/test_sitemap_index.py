@@ -0,0 +1,65 @@
+import json
+import random
+import re
+
+from sitemap_index import SitemapIndex
+from sitemap_manager import SitemapManager
+
+WORDS = ["card", "cards", "button", "buttons", "form", "select", "user", "users", "list",
+         "chart", "icon", "flag", "base", "modal", "table", "settings", "save", "profile"]
+
+def legacy_find_best_page(data, user_goal):
+    """find_best_page before the inverted index: a linear scan with substring matching."""
+    best_url, max_score, reason = None, 0, ""
+    goal_words = set(re.findall(r'\w+', user_goal.lower()))
+    if not goal_words: return None, ""
+    for url, page in data["pages"].items():
+        score = 0
+        if any(w in url.lower() for w in goal_words): score += 3
+        if any(w in page.get('title', '').lower() for w in goal_words): score += 5
+        hits = sum(1 for elem in page.get('elements', []) if any(w in elem.lower() for w in goal_words))
+        score += min(hits, 10)
+        if score > max_score:
+            max_score, best_url, reason = score, url, f"Matched page '{page.get('title')}'."
+    if max_score < 2:
+        for nav_text, parents in data["global_nav"].items():
+            if any(w in nav_text.lower() for w in goal_words):
+                if isinstance(parents, list) and parents:
+                    steps = " -> ".join([f"Click '{p}'" for p in parents])
+                    return None, f"Found '{nav_text}' in Sidebar. Navigation Path: {steps} -> Click '{nav_text}'."
+                return None, f"Found '{nav_text}' in Sidebar (Root Level). Click it directly."
+    if max_score > 2: return best_url, reason
+    return None, ""
+
+def fixture_sitemap(seed=0, n_pages=200):
+    rnd = random.Random(seed)
+    pages = {}
+    for i in range(n_pages):
+        url = f"#/{rnd.choice(WORDS)}/{rnd.choice(WORDS)}-{i}"
+        pages[url] = {
+            "title": " ".join(w.title() for w in rnd.sample(WORDS, rnd.randint(1, 2))),
+            "elements": [" ".join(rnd.sample(WORDS, rnd.randint(1, 3))) for _ in range(rnd.randint(0, 12))],
+            "last_visited": None
+        }
+    global_nav = {f"{w.title()} {i}": rnd.sample(["Base", "Forms", "Icons"], rnd.randint(0, 2)) for i, w in enumerate(WORDS)}
+    global_nav.update({"Widgets": ["Base"], "Dashboard": []}) # Only reachable through the nav fallback
+    return {"version": "v1", "pages": pages, "global_nav": global_nav, "transitions": {}}
+
+def test_find_best_page_matches_the_linear_scan(tmp_path):
+    path = tmp_path / "sitemap.json"
+    path.write_text(json.dumps(fixture_sitemap()))
+    sitemap = SitemapManager(str(path), save_delay=60.0)
+
+    rnd = random.Random(1)
+    goals = ["open the cards page", "change user settings", "zzz", "go to ic", "a", "open widgets", "dashboard"]
+    goals += [" ".join(rnd.sample(WORDS + ["ca", "tt", "xyz", "set"], rnd.randint(1, 4))) for _ in range(300)]
+    for goal in goals:
+        assert sitemap.find_best_page(goal) == legacy_find_best_page(sitemap.data, goal), goal
+
+def test_expansion_cache_is_bounded():
+    index = SitemapIndex()
+    index.rebuild(fixture_sitemap(n_pages=20))
+    for i in range(SitemapIndex.MAX_EXPANSIONS + 10):
+        index.expand(f"w{i}")
+    assert len(index._expansions) <= SitemapIndex.MAX_EXPANSIONS
+    assert index.expand("card") == {t for t in index._vocab if "card" in t}
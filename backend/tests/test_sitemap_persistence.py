@@ -0,0 +1,62 @@
+import threading
+import time
+
+import persistence
+from sitemap_manager import SitemapManager
+
+TIMEOUT = 5.0
+
+def run_with_timeout(fn):
+    """Runs fn on a daemon thread; returns False if it is still blocked after TIMEOUT (deadlock)."""
+    t = threading.Thread(target=fn, daemon=True)
+    t.start()
+    t.join(TIMEOUT)
+    return not t.is_alive()
+
+def make_sitemap(tmp_path):
+    sitemap = SitemapManager(str(tmp_path / "sitemap.json"), save_delay=60.0)
+    sitemap.sync_skeleton([{"path": "/a", "title": "A"}, {"path": "/b", "title": "B"}], "v1")
+    return sitemap
+
+def test_save_from_mutator_while_flush_waits_for_snapshot(tmp_path):
+    sitemap = make_sitemap(tmp_path)
+    flushed = threading.Event()
+
+    def flush():
+        sitemap.flush()
+        flushed.set()
+
+    def mutate():
+        # Hold the sitemap lock (as an outer mutator would) while the writer's flush
+        # is blocked in the snapshot, then save from a mutator inside it.
+        with sitemap.lock:
+            threading.Thread(target=flush, daemon=True).start()
+            time.sleep(0.2)
+            sitemap.record_transition("#/a", "#/b", "Go to B")
+
+    assert run_with_timeout(mutate)
+    assert flushed.wait(TIMEOUT)
+    assert run_with_timeout(sitemap.flush)
+    assert SitemapManager(sitemap.filepath).data["transitions"]["#/a"]["#/b"]["count"] == 1
+
+def test_save_does_not_wait_for_write_in_progress(tmp_path, monkeypatch):
+    sitemap = make_sitemap(tmp_path)
+    writing, release = threading.Event(), threading.Event()
+    real_write = persistence.atomic_write_json
+
+    def slow_write(*args, **kwargs):
+        writing.set()
+        release.wait(TIMEOUT)
+        real_write(*args, **kwargs)
+
+    monkeypatch.setattr(persistence, "atomic_write_json", slow_write)
+    flusher = threading.Thread(target=sitemap.flush, daemon=True)
+    flusher.start()
+    assert writing.wait(TIMEOUT)
+    # The mutator (and its save) must not block on the write in flight
+    assert run_with_timeout(lambda: sitemap.record_transition("#/a", "#/b", "Go to B"))
+    release.set()
+    flusher.join(TIMEOUT)
+    assert run_with_timeout(sitemap.flush)
+    assert sitemap.writer.stats["written"] == 2
+    assert SitemapManager(sitemap.filepath).data["transitions"]["#/a"]["#/b"]["count"] == 1
@@ -0,0 +1,122 @@
+import os
+
+# Precision presets:
+#   nf4  - 4-bit NF4 base weights (bitsandbytes, CUDA only), fp16 compute
+#   fp16 / bf16 - half-precision base weights and mixed-precision training
+#   fp32 - full precision (CPU: no fast half-precision matmuls)
+PROFILES = {
+    "14b-cuda": {
+        "description": "Production adapter: 14B distill, 4-bit base on an NVIDIA GPU",
+        "model_id": "deepseek-ai/DeepSeek-R1-Distill-Qwen-14B",
+        "output_dir": "universal_adapter",
+        "precision": "nf4",
+        "lora_r": 8,
+        "lora_alpha": 32,
+        "target_modules": ["q_proj", "v_proj"],
+        "max_length": 2048, # Packed rows (flash-attn packing only)
+        "max_length_unpacked": 512, # Padded samples: the pre-packing length, so one 14B sample fits per step
+        "batch_size": 4, # Samples (packed rows) per optimizer step
+        "per_device_batch_size": None, # None: 1, the rest is gradient accumulation
+        "gradient_accumulation_steps": None, # None: batch_size / per-device batch
+        "epochs": 3,
+        "learning_rate": 2e-4,
+        "gradient_checkpointing": True,
+        "max_samples": None,
+    },
+    "14b-mps": {
+        "description": "Production adapter on Apple Silicon (bf16 base)",
+        "model_id": "deepseek-ai/DeepSeek-R1-Distill-Qwen-14B",
+        "output_dir": "universal_adapter",
+        "precision": "bf16",
+        "lora_r": 8,
+        "lora_alpha": 32,
+        "target_modules": ["q_proj", "v_proj"],
+        "max_length": 2048,
+        "max_length_unpacked": 512,
+        "batch_size": 4,
+        "per_device_batch_size": None,
+        "gradient_accumulation_steps": None,
+        "epochs": 3,
+        "learning_rate": 2e-4,
+        "gradient_checkpointing": True,
+        "max_samples": None,
+    },
+    "1.5b-gpu": {
+        "description": "Same model family at 1.5B: quick end-to-end runs on a small GPU",
+        "model_id": "deepseek-ai/DeepSeek-R1-Distill-Qwen-1.5B",
+        "output_dir": "universal_adapter_1.5b",
+        "precision": "fp16",
+        "lora_r": 8,
+        "lora_alpha": 32,
+        "target_modules": ["q_proj", "v_proj"],
+        "max_length": 2048,
+        "max_length_unpacked": 512,
+        "batch_size": 4,
+        "per_device_batch_size": None,
+        "gradient_accumulation_steps": None,
+        "epochs": 1,
+        "learning_rate": 2e-4,
+        "gradient_checkpointing": False,
+        "max_samples": None,
+    },
+    "cpu-small": {
+        "description": "Fast iteration loop on CPU: validates data and pipeline changes in minutes",
+        "model_id": "Qwen/Qwen2.5-0.5B-Instruct", # Same tokenizer/chat template as the Qwen distills
+        "output_dir": "universal_adapter_cpu_small",
+        "precision": "fp32",
+        "lora_r": 4,
+        "lora_alpha": 16,
+        "target_modules": ["q_proj", "v_proj"],
+        "max_length": 1024,
+        "max_length_unpacked": 1024,
+        "batch_size": 2,
+        "per_device_batch_size": 2, # A 0.5B model fits both samples in one step
+        "gradient_accumulation_steps": None,
+        "epochs": 1,
+        "learning_rate": 5e-4,
+        "gradient_checkpointing": False, # Recompute costs more than it saves at this size
+        "max_samples": 256,
+    },
+}
+
+def default_profile(has_cuda, has_mps):
+    if has_cuda: return "14b-cuda"
+    if has_mps: return "14b-mps"
+    return "cpu-small"
+
+def resolve_profile(name=None, has_cuda=False, has_mps=False):
+    """
+    Picks a profile by name (or TRAIN_PROFILE, or the hardware default).
+    Single fields can be overridden with TRAIN_<FIELD>, e.g. TRAIN_MAX_SAMPLES=64.
+    """
+    name = name or os.getenv("TRAIN_PROFILE") or default_profile(has_cuda, has_mps)
+    if name not in PROFILES:
+        raise SystemExit(f"❌ Unknown training profile '{name}'. Available: {', '.join(PROFILES)}")
+    profile = dict(PROFILES[name], name=name)
+
+    for key, value in list(profile.items()):
+        raw = os.getenv(f"TRAIN_{key.upper()}")
+        if raw is None or key == "name": continue
+        if key == "target_modules":
+            profile[key] = [m.strip() for m in raw.split(",") if m.strip()]
+        elif isinstance(value, bool):
+            profile[key] = raw.lower() in ("1", "true", "yes")
+        elif isinstance(value, int) or key in ("max_samples", "per_device_batch_size", "gradient_accumulation_steps"):
+            profile[key] = int(raw) if raw else None
+        elif isinstance(value, float):
+            profile[key] = float(raw)
+        else:
+            profile[key] = raw
+
+    if profile["precision"] == "nf4" and not has_cuda:
+        print("⚠️ nf4 needs CUDA (bitsandbytes). Falling back to fp32.")
+        profile["precision"] = "fp32"
+    if profile["precision"] == "fp16" and not (has_cuda or has_mps):
+        print("⚠️ fp16 training is not supported on CPU. Falling back to fp32.")
+        profile["precision"] = "fp32"
+    return profile
+
+def describe(profile):
+    return (f"{profile['name']}: {profile['model_id']} | {profile['precision']} | "
+            f"LoRA r={profile['lora_r']} on {','.join(profile['target_modules'])} | "
+            f"seq {profile['max_length']} packed / {profile['max_length_unpacked']} unpacked | batch {profile['batch_size']}")
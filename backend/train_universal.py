@@ -3,49 +3,90 @@ import os
 # 🛑 0. Network Config
 # ==========================================
 os.environ["HF_ENDPOINT"] = "https://hf-mirror.com"
-os.environ["TOKENIZERS_PARALLELISM"] = "false"
+os.environ["TOKENIZERS_PARALLELISM"] = "false" # Parallelism comes from dataset.map(num_proc) workers instead
 import os
+import sys
+import glob
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import resource
+import importlib.util
 import torch
-from datasets import load_dataset
+from datasets import load_dataset, load_from_disk, Dataset
 from transformers import (
     AutoModelForCausalLM,
     AutoTokenizer,
     BitsAndBytesConfig,
     TrainingArguments,
     Trainer,
+    TrainerCallback,
     DataCollatorForSeq2Seq
 )
 from peft import LoraConfig, get_peft_model, TaskType
+from train_profiles import PROFILES, resolve_profile, describe
 
 # ================= Configuration =================
-MODEL_ID = "deepseek-ai/DeepSeek-R1-Distill-Qwen-14B"
-OUTPUT_DIR = "universal_adapter"
-DATA_FILE = "train_dataset.json"
+BUILD_DIR = "dataset_build"         # Output of dataset_builder.py (all sources, deduplicated)
+DATA_DIR = "train_dataset"          # Sharded output of data_prep.py
+LEGACY_DATA_FILE = "train_dataset.json"
+LEGACY_MAX_LENGTH = 512             # Old fixed padding length (for the padding report)
+TOKENIZE_NUM_PROC = max(1, (os.cpu_count() or 1) - 1)
+TOKENIZED_CACHE_DIR = "tokenized_cache"
+PREPROCESS_VERSION = 1              # Bump when preprocess() changes (invalidates the cache)
+
+parser = argparse.ArgumentParser(description="LoRA fine-tuning of the universal web agent adapter.")
+parser.add_argument("--profile", default=None, help=f"Training profile ({', '.join(PROFILES)}). Default: TRAIN_PROFILE or by hardware")
+parser.add_argument("--list-profiles", action="store_true")
+cli = parser.parse_args()
+if cli.list_profiles:
+    for name, preset in PROFILES.items(): print(f"{name:10s} {preset['description']}")
+    sys.exit(0)
 
 # ================= 1. Hardware Adaptation =================
+has_cuda = torch.cuda.is_available()
+has_mps = torch.backends.mps.is_available()
+profile = resolve_profile(cli.profile, has_cuda, has_mps)
+print(f"🧩 Profile {describe(profile)}")
+
+MODEL_ID = profile["model_id"]
+OUTPUT_DIR = profile["output_dir"]
+BATCH_SIZE = profile["batch_size"]  # Samples (packed rows) per optimizer step
+
+precision = profile["precision"]
 bnb_config = None
-use_fp16 = False
-use_bf16 = False
-optimizer_type = "adamw_torch"
-device_map_config = None 
+use_fp16 = precision in ("fp16", "nf4")
+use_bf16 = precision == "bf16"
+optimizer_type = "adamw_8bit" if precision == "nf4" else "adamw_torch"
+torch_dtype = {"bf16": torch.bfloat16, "fp32": torch.float32}.get(precision, torch.float16)
 
-if torch.cuda.is_available():
+if has_cuda:
     print("🚀 Using NVIDIA CUDA")
-    bnb_config = BitsAndBytesConfig(
-        load_in_4bit=True,
-        bnb_4bit_quant_type="nf4",
-        bnb_4bit_compute_dtype=torch.float16
-    )
-    use_fp16 = True
-    optimizer_type = "adamw_8bit"
+    if precision == "nf4":
+        bnb_config = BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_quant_type="nf4",
+            bnb_4bit_compute_dtype=torch.float16
+        )
     device_map_config = "auto"
-elif torch.backends.mps.is_available():
+elif has_mps:
     print("🍎 Using Apple Metal (MPS)")
-    use_bf16 = True
-    device_map_config = None 
+    device_map_config = None
 else:
     print("🐢 Using CPU")
     device_map_config = "cpu"
+    torch.set_num_threads(os.cpu_count() or 1)
+
+# Packing needs varlen attention so packed samples cannot attend to each other
+use_packing = has_cuda and importlib.util.find_spec("flash_attn") is not None
+print(f"📦 Batching: {'sequence packing (flash_attention_2)' if use_packing else 'length-grouped dynamic padding'}")
+# Long sequences only with packing: padded batches of long samples multiply the activation memory
+MAX_LENGTH = profile["max_length"] if use_packing else profile["max_length_unpacked"] # DOM cut in the middle, never the answer
+PER_DEVICE_BATCH = 1 if use_packing else (profile["per_device_batch_size"] or 1)
+GRAD_ACCUM = profile["gradient_accumulation_steps"] or max(1, BATCH_SIZE // PER_DEVICE_BATCH)
+print(f"🧮 Effective batch: {PER_DEVICE_BATCH} x {GRAD_ACCUM} accumulation step(s) = {PER_DEVICE_BATCH * GRAD_ACCUM}")
 
 # ================= 2. Load Model =================
 print("⏳ Loading model...")
@@ -54,16 +95,18 @@ model = AutoModelForCausalLM.from_pretrained(
     MODEL_ID,
     quantization_config=bnb_config,
     device_map=device_map_config,
-    torch_dtype=torch.bfloat16 if use_bf16 else torch.float16,
+    torch_dtype=torch_dtype,
+    attn_implementation="flash_attention_2" if use_packing else None,
     trust_remote_code=True
 )
 
-if torch.backends.mps.is_available():
+if has_mps:
     print("🔄 Moving model to MPS device...")
     model.to("mps")
 
-# 🔥 Fix: Enable input gradients for gradient checkpointing
-model.enable_input_require_grads()
+if profile["gradient_checkpointing"]:
+    # 🔥 Fix: Enable input gradients for gradient checkpointing
+    model.enable_input_require_grads()
 model.config.use_cache = False 
 
 tokenizer = AutoTokenizer.from_pretrained(MODEL_ID)
@@ -73,10 +116,10 @@ tokenizer.pad_token = tokenizer.eos_token
 peft_config = LoraConfig(
     task_type=TaskType.CAUSAL_LM,
     inference_mode=False,
-    r=8,
-    lora_alpha=32,
+    r=profile["lora_r"],
+    lora_alpha=profile["lora_alpha"],
     lora_dropout=0.1,
-    target_modules=["q_proj", "v_proj"] 
+    target_modules=profile["target_modules"]
 )
 model = get_peft_model(model, peft_config)
 model.print_trainable_parameters()
@@ -85,49 +128,242 @@ model.print_trainable_parameters()
 def format_prompt(sample):
     return f"<|im_start|>user\n{sample['instruction']}\n{sample['input']}<|im_end|>\n<|im_start|>assistant\n{sample['output']}<|im_end|>"
 
-def preprocess(example):
-    model_inputs = tokenizer(
-        format_prompt(example),
-        padding="max_length",
-        truncation=True,
-        max_length=512
-    )
-    # 🔥 Fix: Ensure labels exist
-    model_inputs["labels"] = model_inputs["input_ids"].copy()
-    return model_inputs
+def preprocess(batch):
+    """
+    Batched tokenization without padding. Labels cover only the assistant JSON (prompt = -100).
+    Over-long prompts lose the middle of the DOM, keeping the goal and the answer.
+    """
+    heads = tokenizer([f"<|im_start|>user\n{instr}\n" for instr in batch['instruction']])["input_ids"]
+    bodies = tokenizer(batch['input'], add_special_tokens=False)["input_ids"]
+    tail = tokenizer("<|im_end|>\n<|im_start|>assistant\n", add_special_tokens=False)["input_ids"]
+    answers = tokenizer([f"{out}<|im_end|>" for out in batch['output']], add_special_tokens=False)["input_ids"]
+
+    out = {"input_ids": [], "attention_mask": [], "labels": [], "length": [], "truncated": []}
+    for head, body, answer in zip(heads, bodies, answers):
+        room = MAX_LENGTH - len(head) - len(tail) - len(answer)
+        truncated = len(body) > room
+        if truncated:
+            keep = max(room, 0)
+            body = body[:keep // 2] + body[len(body) - (keep - keep // 2):] if keep else []
+
+        prompt_ids = head + body + tail
+        input_ids = (prompt_ids + answer)[:MAX_LENGTH]
+        out["input_ids"].append(input_ids)
+        out["attention_mask"].append([1] * len(input_ids))
+        out["labels"].append(([-100] * len(prompt_ids) + answer)[:MAX_LENGTH])
+        out["length"].append(len(input_ids))
+        out["truncated"].append(truncated)
+    return out
+
+def tokenizer_hash(tok):
+    try:
+        raw = tok.backend_tokenizer.to_str()
+    except AttributeError:
+        raw = json.dumps(sorted(tok.get_vocab().items()))
+    raw += json.dumps(tok.special_tokens_map, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:16]
+
+def files_hash(paths):
+    """Content hash of the dataset files (names and mtimes don't matter)."""
+    h = hashlib.sha256()
+    for path in sorted(paths):
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    return h.hexdigest()[:16]
+
+def pack_sequences(dataset, max_length):
+    """
+    First-fit-decreasing packing into rows of <= max_length tokens.
+    position_ids restart at 0 for each sample, which flash_attention_2 uses as sequence boundaries.
+    """
+    all_ids, all_labels, lengths = list(dataset["input_ids"]), list(dataset["labels"]), list(dataset["length"])
+    bins, space = [], [] # bins: list of sample indices, space: free tokens per bin
+    for i in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+        n = lengths[i]
+        for b in range(max(0, len(bins) - 64), len(bins)): # Only scan recently opened bins
+            if space[b] >= n:
+                bins[b].append(i)
+                space[b] -= n
+                break
+        else:
+            bins.append([i])
+            space.append(max_length - n)
+
+    packed = {"input_ids": [], "labels": [], "position_ids": []}
+    for b in bins:
+        packed["input_ids"].append([t for i in b for t in all_ids[i]])
+        packed["labels"].append([t for i in b for t in all_labels[i]])
+        packed["position_ids"].append([p for i in b for p in range(lengths[i])])
+    return Dataset.from_dict(packed)
+
+def collate_packed(features):
+    # One packed row per step: no padding and no attention_mask (boundaries come from position_ids)
+    return {k: torch.tensor([f[k] for f in features]) for k in ("input_ids", "labels", "position_ids")}
+
+def padding_report(lengths, packed_rows=None):
+    real = sum(lengths)
+    legacy = 1 - sum(min(n, LEGACY_MAX_LENGTH) for n in lengths) / (len(lengths) * LEGACY_MAX_LENGTH)
+    if packed_rows is not None:
+        after, detail = 0.0, f"{len(lengths)} samples in {packed_rows} packed rows, {real / (packed_rows * MAX_LENGTH):.0%} full"
+    else:
+        # Length-grouped batches hold samples of similar length
+        ordered = sorted(lengths)
+        step = PER_DEVICE_BATCH
+        padded = sum(max(ordered[i:i + step]) * len(ordered[i:i + step]) for i in range(0, len(ordered), step))
+        after, detail = 1 - real / padded, f"batches of {step}"
+    print(f"📏 Padding fraction: {legacy:.1%} (max_length={LEGACY_MAX_LENGTH}) -> {after:.1%} ({detail})")
+
+mps_peak_bytes = 0 # MPS only reports current allocation: keep the maximum seen at step ends
+
+def peak_memory_gb():
+    """Peak accelerator memory on GPU/MPS, else the process peak RSS."""
+    global mps_peak_bytes
+    if has_cuda:
+        return torch.cuda.max_memory_allocated() / 1e9, "cuda"
+    if has_mps:
+        mps_peak_bytes = max(mps_peak_bytes, torch.mps.driver_allocated_memory())
+        return mps_peak_bytes / 1e9, "mps"
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # KB on Linux, bytes on macOS
+    return rss / (1e9 if sys.platform == "darwin" else 1e6), "rss"
+
+class CountingCollator:
+    """Wraps a collator to count the real (non-pad) tokens of every batch."""
+    def __init__(self, collator):
+        self.collator = collator
+        self.tokens = 0
+
+    def __call__(self, features):
+        self.tokens += sum(len(f["input_ids"]) for f in features)
+        return self.collator(features)
+
+class StepTelemetry(TrainerCallback):
+    """Per-step wall time, throughput and peak memory (printed and added to the trainer logs)."""
+    def __init__(self, counter):
+        self.counter = counter
+        self.step_start = None
+        self.tokens_at_start = 0
+        self.last = {}
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        self.step_start = time.perf_counter()
+        self.tokens_at_start = self.counter.tokens
+
+    def on_step_end(self, args, state, control, **kwargs):
+        if self.step_start is None: return
+        elapsed = time.perf_counter() - self.step_start
+        tokens = self.counter.tokens - self.tokens_at_start
+        memory, kind = peak_memory_gb()
+        self.last = {
+            "step_time": round(elapsed, 3),
+            "tokens_per_sec": round(tokens / elapsed, 1) if elapsed else 0.0,
+            f"peak_mem_gb_{kind}": round(memory, 2)
+        }
+        print(f"⏱️  step {state.global_step}/{state.max_steps} | {elapsed:.2f}s | "
+              f"{self.last['tokens_per_sec']:.0f} tok/s | peak {kind} {memory:.2f} GB")
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        if logs is not None and "loss" in logs: logs.update(self.last)
 
 print("📂 Processing dataset...")
-dataset = load_dataset("json", data_files=DATA_FILE, split="train")
-tokenized_dataset = dataset.map(preprocess, remove_columns=dataset.column_names)
+arrow_parts = sorted(glob.glob(os.path.join(BUILD_DIR, "sft", "*.arrow")))
+parquet_shards = sorted(glob.glob(os.path.join(DATA_DIR, "*.parquet")))
+jsonl_shards = sorted(glob.glob(os.path.join(DATA_DIR, "*.jsonl")))
+if arrow_parts:
+    data_format, data_files = "arrow", arrow_parts
+elif parquet_shards:
+    data_format, data_files = "parquet", parquet_shards
+elif jsonl_shards:
+    data_format, data_files = "json", jsonl_shards
+else:
+    data_format, data_files = "json", [LEGACY_DATA_FILE]
+
+# Tokenized datasets are cached by (tokenizer, data content, preprocessing settings, profile subset)
+max_samples = profile["max_samples"]
+cache_key = hashlib.sha256(json.dumps([
+    tokenizer_hash(tokenizer), files_hash(data_files), MAX_LENGTH, PREPROCESS_VERSION, max_samples
+]).encode('utf-8')).hexdigest()[:16]
+cache_path = os.path.join(TOKENIZED_CACHE_DIR, cache_key)
+
+if os.path.exists(cache_path):
+    print(f"⚡ Tokenized cache hit: {cache_path}")
+    tokenized_dataset = load_from_disk(cache_path)
+else:
+    dataset = load_dataset(data_format, data_files=data_files, split="train")
+    if max_samples and len(dataset) > max_samples:
+        # Subset before tokenizing: the fast profiles shouldn't pay for the whole dataset
+        print(f"✂️  Profile subset: {max_samples} of {len(dataset)} samples")
+        dataset = dataset.shuffle(seed=42).select(range(max_samples))
+    print(f"📊 {len(dataset)} samples, tokenizing with {TOKENIZE_NUM_PROC} worker(s)...")
+    tokenized_dataset = dataset.map(
+        preprocess,
+        batched=True,
+        batch_size=256,
+        num_proc=min(TOKENIZE_NUM_PROC, max(1, len(dataset) // 256)),
+        remove_columns=dataset.column_names
+    )
+    tmp_path = cache_path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tokenized_dataset.save_to_disk(tmp_path)
+    os.replace(tmp_path, cache_path)
+    tokenized_dataset = load_from_disk(cache_path)
+    print(f"💾 Tokenized dataset cached: {cache_path}")
+print(f"📊 {len(tokenized_dataset)} samples")
+
+lengths = list(tokenized_dataset["length"])
+n_truncated = sum(tokenized_dataset["truncated"])
+if n_truncated:
+    print(f"✂️  {n_truncated} prompt(s) longer than {MAX_LENGTH} tokens had their DOM shortened")
+tokenized_dataset = tokenized_dataset.remove_columns(["truncated"])
+
+if use_packing:
+    train_dataset = pack_sequences(tokenized_dataset, MAX_LENGTH)
+    data_collator = collate_packed
+    padding_report(lengths, packed_rows=len(train_dataset))
+else:
+    train_dataset = tokenized_dataset
+    data_collator = DataCollatorForSeq2Seq(tokenizer, padding=True, label_pad_token_id=-100)
+    padding_report(lengths)
+data_collator = CountingCollator(data_collator)
 
 # ================= 5. Training =================
 print(f"⚙️ Optimizer: {optimizer_type}")
 
 training_args = TrainingArguments(
     output_dir=OUTPUT_DIR,
-    per_device_train_batch_size=1, 
-    gradient_accumulation_steps=4,
-    learning_rate=2e-4,
+    per_device_train_batch_size=PER_DEVICE_BATCH, 
+    gradient_accumulation_steps=GRAD_ACCUM,
+    group_by_length=not use_packing,
+    length_column_name="length",
+    learning_rate=profile["learning_rate"],
     logging_steps=1,
-    num_train_epochs=3,
+    num_train_epochs=profile["epochs"],
     save_steps=50,
     fp16=use_fp16,
     bf16=use_bf16,
     optim=optimizer_type,
     use_cpu=False,
     ddp_find_unused_parameters=False,
-    gradient_checkpointing=True 
+    gradient_checkpointing=profile["gradient_checkpointing"]
 )
 
 trainer = Trainer(
     model=model,
-    train_dataset=tokenized_dataset,
+    train_dataset=train_dataset,
     args=training_args,
-    data_collator=DataCollatorForSeq2Seq(tokenizer, padding=True)
+    data_collator=data_collator,
+    callbacks=[StepTelemetry(data_collator)]
 )
 
 print("🚀 Starting training...")
-trainer.train()
+train_result = trainer.train()
+
+runtime = train_result.metrics.get("train_runtime") or 0
+if runtime:
+    trained_tokens = sum(lengths) * training_args.num_train_epochs
+    print(f"📈 Throughput: {trained_tokens / runtime:.0f} tokens/s (non-pad, {runtime:.0f}s)")
+memory, kind = peak_memory_gb()
+print(f"🧠 Peak memory ({kind}): {memory:.2f} GB")
 
 # ================= 6. Save =================
 print(f"💾 Saving adapter to {OUTPUT_DIR}")
@@ -144,7 +144,7 @@ handleIncomingMessage(jsonStr: string) {
         }
       } 
       // 👇 [UPDATED] Add 'crop' to the allowed actions list
-      else if (['click', 'type', 'select', 'scroll', 'crop'].includes(cmd.action)) {
+      else if (['click', 'type', 'select', 'scroll', 'navigate', 'crop'].includes(cmd.action)) {
           
           // [NEW] Special handling for 'crop' which is not in executeCommand (or add it there)
           // Since executeCommand returns a string, we can implement crop inside AgentService 
@@ -570,6 +570,14 @@ export class AgentService {
         return `✅ Scrolled ${containerName} ${isUp ? 'Up' : 'Down'} (Start: ${Math.round(startTop)})`;
     }
 
+    // 🧭 Direct URL navigation (hash routes like '#/base/cards')
+    if (action === 'navigate') {
+        const path = value.trim().replace(/^#/, '');
+        if (!path.startsWith('/')) return `❌ Error: Invalid navigation target "${value}"`;
+        this.router.navigateByUrl(path);
+        return `✅ Navigated to ${value}`;
+    }
+
     const el = document.querySelector(`[data-agent-id="${id}"]`) as HTMLElement;
     if (!el) return `❌ ID [${id}] not found`;
     this.highlightElement(el);
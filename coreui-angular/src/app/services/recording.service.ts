@@ -85,6 +85,8 @@ export class RecordingService implements OnDestroy {
     if (!this.socket || this.socket.readyState !== WebSocket.OPEN) return;
 
     const desc = this.agentService.getElementDescription(el);
+    // Read the URL before awaiting: the click may navigate away
+    const url = window.location.hash || window.location.pathname;
     
     // Parallel Execution for performance
     const [context, cropBase64] = await Promise.all([
@@ -99,6 +101,7 @@ export class RecordingService implements OnDestroy {
         value: value
       },
       element_desc: desc,
+      url: url,
       timestamp: Date.now(),
       
       // Full Data for SFT
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Wall-clock scaling of the GGUF tensor writer (convert_hf_to_gguf.py --threads).
+#
+# Builds a synthetic model of lazy f16 tensors (shapes of a 14B Qwen2 layer by default),
+# converts it with 1..N worker processes (or --pipeline stages) and checks that every output
+# is byte-identical.
+#
+#   python bench_convert.py --layers 4 --outtype q8_0 --threads 1,2,4,8
+#   python bench_convert.py --pipeline --memory-budget 2000000000 --threads 1,4
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+import gguf
+import gguf_kquants  # noqa: F401  (registers the K-quant encoders)
+import quant_kernels
+from tensor_writer import write_tensors
+
+
+# (name, shape) of one transformer block of DeepSeek-R1-Distill-Qwen-14B
+LAYER_SHAPES = [
+    ("attn_q.weight", (5120, 5120)),
+    ("attn_k.weight", (1024, 5120)),
+    ("attn_v.weight", (1024, 5120)),
+    ("attn_output.weight", (5120, 5120)),
+    ("ffn_gate.weight", (13824, 5120)),
+    ("ffn_up.weight", (13824, 5120)),
+    ("ffn_down.weight", (5120, 13824)),
+    ("attn_norm.weight", (5120,)),
+]
+
+OUTTYPES = {
+    "f32": gguf.GGMLQuantizationType.F32,
+    "f16": gguf.GGMLQuantizationType.F16,
+    "bf16": gguf.GGMLQuantizationType.BF16,
+    "q8_0": gguf.GGMLQuantizationType.Q8_0,
+    "q4_k": gguf.GGMLQuantizationType.Q4_K,
+    "q5_k": gguf.GGMLQuantizationType.Q5_K,
+    "q6_k": gguf.GGMLQuantizationType.Q6_K,
+}
+
+
+def make_sources(n_layers: int, scale: float, path: Path, seed: int = 0) -> list[tuple[str, int, tuple[int, ...]]]:
+    """Writes random f16 weights to one flat file (stand-in for a safetensors shard)."""
+    rng = np.random.default_rng(seed)
+    sources = []
+    offset = 0
+    with open(path, "wb") as f:
+        for bid in range(n_layers):
+            for name, shape in LAYER_SHAPES:
+                shape = tuple(max(256, int(n * scale) // 256 * 256) for n in shape)  # K-quant blocks
+                array = (rng.standard_normal(shape, dtype=np.float32) * 0.02).astype(np.float16)
+                array.tofile(f)
+                sources.append((f"blk.{bid}.{name}", offset, shape))
+                offset += array.nbytes
+    return sources
+
+
+def mmap_leaf(path: Path, offset: int, shape: tuple[int, ...]) -> gguf.LazyNumpyTensor:
+    meta = gguf.LazyNumpyTensor.meta_with_dtype_and_shape(np.float16, shape)
+    return gguf.LazyNumpyTensor(meta=meta, args=(str(path), offset, shape),
+                                func=lambda p, o, s: np.memmap(p, dtype=np.float16, mode="r", offset=o, shape=s))
+
+
+def convert(sources: list[tuple[str, int, tuple[int, ...]]], weights: Path, qtype: gguf.GGMLQuantizationType, path: Path, threads: int,
+            pipeline: bool = False, memory_budget: int = 0) -> float:
+    writer = gguf.GGUFWriter(path=None, arch="qwen2")
+    for name, offset, shape in sources:
+        # same lazy chain as prepare_tensors for an untransformed tensor: mmap read, then
+        # chunked up-cast + quantization on materialization
+        data = mmap_leaf(weights, offset, shape)
+        dtype = gguf.GGMLQuantizationType.F32 if len(shape) == 1 else qtype
+        writer.add_tensor(name, quant_kernels.quantize(data, dtype), raw_dtype=dtype)
+
+    start = time.perf_counter()
+    writer.write_header_to_file(path=path)
+    writer.write_kv_data_to_file()
+    write_tensors(writer, threads, pipeline=pipeline, memory_budget=memory_budget)
+    writer.close()
+    return time.perf_counter() - start
+
+
+def file_hash(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 24), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark parallel GGUF tensor conversion")
+    parser.add_argument("--layers", type=int, default=2, help="number of synthetic transformer blocks")
+    parser.add_argument("--scale", type=float, default=1.0, help="shrink factor for the tensor shapes")
+    parser.add_argument("--outtype", choices=list(OUTTYPES), default="q8_0")
+    parser.add_argument("--threads", type=str, default=f"1,2,4,{os.cpu_count() or 1}", help="comma-separated worker counts")
+    parser.add_argument("--pipeline", action="store_true", help="use the staged pipeline instead of worker processes")
+    parser.add_argument("--memory-budget", type=int, default=0, help="pipeline bytes in flight (0: unlimited)")
+    parser.add_argument("--tmpdir", type=Path, default=None, help="where to write the outputs (use the target disk)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.pipeline else logging.WARNING, format="%(message)s")
+
+    thread_counts = sorted({int(t) for t in args.threads.split(",")})
+    baseline = None
+    reference = None
+    with tempfile.TemporaryDirectory(dir=args.tmpdir) as tmp:
+        weights = Path(tmp) / "weights.bin"
+        sources = make_sources(args.layers, args.scale, weights)
+        n_bytes = weights.stat().st_size
+        print(f"{len(sources)} tensors, {n_bytes / 1e9:.2f} GB f16 -> {args.outtype}, {os.cpu_count()} CPU(s)")
+
+        # untimed warm-up: numba JIT / cache load and the page cache would otherwise be
+        # charged to the first (threads=1) run and inflate every speedup
+        warmup = Path(tmp) / "warmup.gguf"
+        convert(sources[:len(LAYER_SHAPES)], weights, OUTTYPES[args.outtype], warmup, 1)
+        warmup.unlink()
+        with open(weights, "rb") as f:
+            while f.read(1 << 24):
+                pass
+
+        for threads in thread_counts:
+            path = Path(tmp) / f"bench-{threads}.gguf"
+            elapsed = convert(sources, weights, OUTTYPES[args.outtype], path, threads, args.pipeline, args.memory_budget)
+            digest = file_hash(path)
+            reference = reference or digest
+            baseline = baseline or elapsed
+            same = "identical" if digest == reference else "MISMATCH"
+            print(f"threads={threads:3d}  {elapsed:7.2f} s  {n_bytes / elapsed / 1e9:6.2f} GB/s in  x{baseline / elapsed:5.2f}  {same}")
+            path.unlink()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Bit-for-bit check, throughput and peak memory of the chunked dequantization kernels.
+#
+# For every pre-quantized format ModelBase.dequant_model() handles (FP8 / int8 block and
+# channel scales, GPTQ 2/4/8-bit, compressed-tensors pack-quantized with and without zero
+# points) random packed inputs of a 14B Qwen2 layer shape are dequantized by
+#   reference  the former whole-tensor functions (dequant_kernels.*_reference)
+#   chunked    the row-block kernels, at each --chunks size
+# each in a forked child (see bench_quant.py). The outputs must be bit-identical; the script
+# exits with status 1 otherwise, so it doubles as the test of the kernels.
+#
+#   python bench_dequant.py --scale 0.25
+#   python bench_dequant.py --shape 300x1000 --chunks 1,777,1048576   # odd shapes, tiny blocks
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import sys
+import time
+from typing import Any, Callable
+
+import torch
+
+import dequant_kernels
+from bench_quant import SHAPES, rss_kb, run_isolated
+
+
+def make_inputs(case: str, rows: int, cols: int, seed: int = 0) -> tuple[Callable[..., torch.Tensor], Callable[..., torch.Tensor], tuple[Any, ...]]:
+    """(reference, chunked, args) for one format, with a (rows, cols) dequantized weight."""
+    g = torch.Generator().manual_seed(seed)
+
+    def randint(shape: tuple[int, ...], dtype: torch.dtype) -> torch.Tensor:
+        return torch.randint(-(2 ** 31), 2 ** 31 - 1, shape, generator=g, dtype=torch.int64).to(dtype)
+
+    if case in ("fp8_block", "int8_channel"):
+        if case == "fp8_block":
+            weight = (torch.randn((rows, cols), generator=g) * 100).to(torch.float8_e4m3fn)
+            block_size: list[int] | None = [128, 128]
+            scale = torch.rand(((rows + 127) // 128, (cols + 127) // 128), generator=g).to(torch.bfloat16)
+        else:
+            weight = torch.randint(-128, 128, (rows, cols), generator=g, dtype=torch.int8)
+            block_size = None
+            scale = torch.rand((rows, 1), generator=g).to(torch.float16)
+        return (dequant_kernels.dequant_simple_reference, dequant_kernels.dequant_simple, (weight, scale, block_size))
+
+    if case.startswith("gptq"):
+        bits = int(case.split("_")[1].removesuffix("bit"))
+        checkpoint_format = "gptq_v2" if case.endswith("v2") else "gptq"
+        pack_factor = 32 // bits
+        n_in, n_out, group_size = cols, rows, 128  # the output is transposed: (out_features, in_features)
+        n_in, n_out = n_in // pack_factor * pack_factor, n_out // pack_factor * pack_factor  # zeros are packed along out
+        n_groups = (n_in + group_size - 1) // group_size
+        qweight = randint((n_in // pack_factor, n_out), torch.int32)
+        qzeros = randint((n_groups, n_out // pack_factor), torch.int32)
+        scales = torch.rand((n_groups, n_out), generator=g).to(torch.float16)
+        g_idx = (torch.arange(n_in, dtype=torch.int32) // group_size)[torch.randperm(n_in, generator=g)]  # act-order
+        return (dequant_kernels.dequant_gptq_reference, dequant_kernels.dequant_gptq, (g_idx, qweight, qzeros, scales, bits, checkpoint_format))
+
+    # compressed-tensors pack-quantized (4 bits, group 128)
+    num_bits, group_size = 4, 128
+    cols = cols // group_size * group_size
+    per_word = 32 // num_bits
+    w = randint((rows, (cols + per_word - 1) // per_word), torch.int32)
+    scale = torch.rand((rows, cols // group_size), generator=g).to(torch.bfloat16)
+    zero_point = randint(((rows + per_word - 1) // per_word, cols // group_size), torch.int32) if case == "packed_zp" else None
+    return (dequant_kernels.dequant_packed_reference, dequant_kernels.dequant_packed, (w, scale, (rows, cols), zero_point, num_bits, group_size))
+
+
+CASES = ["fp8_block", "int8_channel", "gptq_2bit", "gptq_4bit", "gptq_4bit_v2", "gptq_8bit", "packed", "packed_zp"]
+
+
+def measure(case: str, rows: int, cols: int, chunk: int | None) -> dict[str, Any]:
+    def run() -> dict[str, Any]:
+        reference, chunked, args = make_inputs(case, rows, cols)
+        fn = reference if chunk is None else (lambda *a: chunked(*a, chunk_elements=chunk))
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")  # reset the peak RSS to the current RSS
+        except OSError:
+            pass
+        base = rss_kb("VmRSS")
+        start = time.perf_counter()
+        out = fn(*args)
+        elapsed = time.perf_counter() - start
+        peak = rss_kb("VmHWM") - base
+        raw = out.contiguous().view(torch.int32).numpy()  # bits, not values (NaN != NaN)
+        return {"elapsed": elapsed, "peak_kb": peak, "nbytes": out.numel() * 4, "shape": tuple(out.shape),
+                "digest": hashlib.sha256(raw.tobytes()).hexdigest()}
+    return run_isolated(run)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Check and benchmark the chunked dequantization kernels")
+    parser.add_argument("--cases", type=str, default=",".join(CASES))
+    parser.add_argument("--shape", type=str, default="ffn_down", help=f"one of {','.join(SHAPES)}, or ROWSxCOLS")
+    parser.add_argument("--scale", type=float, default=0.25, help="fraction of the rows to keep (named shapes only)")
+    parser.add_argument("--chunks", type=str, default=str(dequant_kernels.CHUNK_ELEMENTS), help="comma-separated chunk sizes (elements)")
+    args = parser.parse_args()
+    torch.set_num_threads(1)
+
+    if args.shape in SHAPES:
+        rows, cols = SHAPES[args.shape]
+        rows = max(128, int(rows * args.scale))
+    else:
+        rows, cols = (int(n) for n in args.shape.split("x"))
+    chunks = [int(c) for c in args.chunks.split(",")]
+
+    failed = False
+    print(f"{'case':13s} {'method':16s} {'shape':>12s} {'time':>8s} {'GB/s out':>8s} {'peak RSS':>10s}")
+    for case in args.cases.split(","):
+        reference = measure(case, rows, cols, None)
+        if "error" in reference:
+            print(f"{case:13s} reference failed: {reference['error']}")
+            failed = True
+            continue
+        for chunk, r in [(None, reference)] + [(c, measure(case, rows, cols, c)) for c in chunks]:
+            method = "reference" if chunk is None else f"chunked {chunk}"
+            if "error" in r:
+                print(f"{case:13s} {method:16s} failed: {r['error']}")
+                failed = True
+                continue
+            same = r["digest"] == reference["digest"] and r["shape"] == reference["shape"]
+            failed |= not same
+            print(f"{case:13s} {method:16s} {'x'.join(map(str, r['shape'])):>12s} {r['elapsed']:7.2f}s "
+                  f"{r['nbytes'] / r['elapsed'] / 1e9:8.2f} {r['peak_kb'] / 1024:7.0f} MB  {'identical' if same else 'MISMATCH'}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Throughput and peak memory of the quantization kernels, per GGML type.
+#
+# For every type and tensor shape (a 14B Qwen2 layer by default) the source is memory-mapped
+# from disk and quantized by
+#   reference  the converter's former path: whole-tensor float32 up-cast + gguf.quants.quantize()
+#   chunked    quant_kernels.quantize_array() with the NumPy kernels
+#   numba      quant_kernels.quantize_array() with the numba kernels (if numba is installed)
+# each in a forked child, so the reported peak RSS (above the child's starting RSS) belongs to
+# that run alone. Every output is checked to be byte-identical to the reference.
+#
+#   python bench_quant.py --types q8_0,tq2_0,q4_k --scale 0.25
+#   python bench_quant.py --src f16 --shapes ffn_down
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import os
+import pickle
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+import numpy as np
+
+import gguf
+import gguf_kquants  # noqa: F401  (registers the K-quant encoders)
+import quant_kernels
+
+
+SHAPES = {
+    "attn_q": (5120, 5120),
+    "attn_k": (1024, 5120),
+    "ffn_up": (13824, 5120),
+    "ffn_down": (5120, 13824),
+    "token_embd": (152064, 5120),
+}
+
+TYPES = {
+    "f32": gguf.GGMLQuantizationType.F32,
+    "f16": gguf.GGMLQuantizationType.F16,
+    "bf16": gguf.GGMLQuantizationType.BF16,
+    "q8_0": gguf.GGMLQuantizationType.Q8_0,
+    "q4_0": gguf.GGMLQuantizationType.Q4_0,
+    "q4_1": gguf.GGMLQuantizationType.Q4_1,
+    "q5_0": gguf.GGMLQuantizationType.Q5_0,
+    "q5_1": gguf.GGMLQuantizationType.Q5_1,
+    "tq1_0": gguf.GGMLQuantizationType.TQ1_0,
+    "tq2_0": gguf.GGMLQuantizationType.TQ2_0,
+    "q4_k": gguf.GGMLQuantizationType.Q4_K,
+    "q5_k": gguf.GGMLQuantizationType.Q5_K,
+    "q6_k": gguf.GGMLQuantizationType.Q6_K,
+}
+
+
+def make_source(path: Path, shape: tuple[int, ...], src: str, seed: int = 0) -> None:
+    rng = np.random.default_rng(seed)
+    with open(path, "wb") as f:
+        for start in range(0, shape[0], 1024):
+            rows = (rng.standard_normal((min(1024, shape[0] - start), shape[1]), dtype=np.float32) * 0.02)
+            if src == "bf16":
+                rows = (rows.view(np.uint32) >> 16).astype(np.uint16)  # truncated, fine for a benchmark
+            elif src == "f16":
+                rows = rows.astype(np.float16)
+            rows.tofile(f)
+
+
+def load_source(path: Path, shape: tuple[int, ...], src: str) -> Any:
+    if src == "bf16":
+        import torch
+        # copy-on-write map: torch wants a writable buffer, the pages are never written
+        return torch.from_numpy(np.memmap(path, dtype=np.int16, mode="c", shape=shape)).view(torch.bfloat16)
+    return np.memmap(path, dtype=np.float16 if src == "f16" else np.float32, mode="r", shape=shape)
+
+
+def to_float32(source: Any) -> np.ndarray:
+    # what prepare_tensors did before quantizing: data_torch.to(torch.float32).numpy()
+    if isinstance(source, np.ndarray):
+        return source.astype(np.float32)
+    import torch
+    return source.to(torch.float32).numpy()
+
+
+METHODS: dict[str, Callable[[Any, gguf.GGMLQuantizationType], np.ndarray]] = {
+    "reference": lambda source, qtype: gguf.quants.quantize(to_float32(source), qtype),
+    "chunked": lambda source, qtype: quant_kernels.quantize_array(source, qtype, use_numba=False),
+}
+if quant_kernels.numba is not None:
+    METHODS["numba"] = lambda source, qtype: quant_kernels.quantize_array(source, qtype, use_numba=True)
+
+
+def rss_kb(field: str) -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+def run_isolated(fn: Callable[[], dict[str, Any]]) -> dict[str, Any]:
+    """Runs fn in a forked child (own peak RSS); falls back to in-process without fork."""
+    if not hasattr(os, "fork"):
+        return fn()
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            result = fn()
+        except BaseException as e:
+            result = {"error": repr(e)}
+        with os.fdopen(w, "wb") as f:
+            pickle.dump(result, f)
+        os._exit(0)
+    os.close(w)
+    with os.fdopen(r, "rb") as f:
+        result = pickle.load(f)
+    os.waitpid(pid, 0)
+    return result
+
+
+def measure(method: str, path: Path, shape: tuple[int, ...], src: str, qtype: gguf.GGMLQuantizationType) -> dict[str, Any]:
+    def run() -> dict[str, Any]:
+        source = load_source(path, shape, src)
+        if method == "numba":  # compile outside the timed region
+            quant_kernels.quantize_array(np.zeros((1, shape[1]), dtype=np.float32), qtype, use_numba=True)
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")  # reset the peak RSS to the current RSS
+        except OSError:
+            pass
+        base = rss_kb("VmRSS")
+        start = time.perf_counter()
+        out = METHODS[method](source, qtype)
+        elapsed = time.perf_counter() - start
+        peak = rss_kb("VmHWM") - base
+        return {"elapsed": elapsed, "peak_kb": peak, "digest": hashlib.sha256(np.ascontiguousarray(out).view(np.uint8)).hexdigest()}
+    return run_isolated(run)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the GGUF quantization kernels")
+    parser.add_argument("--types", type=str, default=",".join(TYPES), help="comma-separated GGML types")
+    parser.add_argument("--shapes", type=str, default="attn_q,attn_k,ffn_down", help=f"comma-separated, from {','.join(SHAPES)}")
+    parser.add_argument("--scale", type=float, default=0.25, help="fraction of the rows to keep (row length is unchanged)")
+    parser.add_argument("--src", choices=["bf16", "f16", "f32"], default="bf16", help="source dtype (bf16 needs torch)")
+    parser.add_argument("--methods", type=str, default=",".join(METHODS))
+    parser.add_argument("--tmpdir", type=Path, default=None)
+    args = parser.parse_args()
+
+    methods = [m for m in args.methods.split(",") if m in METHODS]
+    print(f"numba: {'yes' if quant_kernels.numba is not None else 'no'}, chunk: {quant_kernels.CHUNK_ELEMENTS} elements, {os.cpu_count()} CPU(s)")
+    print(f"{'type':6s} {'tensor':10s} {'shape':>13s} {'method':9s} {'time':>8s} {'GB/s in':>8s} {'peak RSS':>10s}")
+    with tempfile.TemporaryDirectory(dir=args.tmpdir) as tmp:
+        for shape_name in args.shapes.split(","):
+            rows, cols = SHAPES[shape_name]
+            shape = (max(1, int(rows * args.scale)), cols)
+            path = Path(tmp) / f"{shape_name}.bin"
+            make_source(path, shape, args.src)
+            n_bytes = path.stat().st_size
+            for type_name in args.types.split(","):
+                qtype = TYPES[type_name]
+                reference = None
+                for method in methods:
+                    r = measure(method, path, shape, args.src, qtype)
+                    if "error" in r:
+                        print(f"{type_name:6s} {shape_name:10s} {str(shape):>13s} {method:9s} failed: {r['error']}")
+                        continue
+                    reference = reference or r["digest"]
+                    same = "identical" if r["digest"] == reference else "MISMATCH"
+                    print(f"{type_name:6s} {shape_name:10s} {f'{shape[0]}x{shape[1]}':>13s} {method:9s} {r['elapsed']:7.2f}s "
+                          f"{n_bytes / r['elapsed'] / 1e9:8.2f} {r['peak_kb'] / 1024:7.0f} MB  {same}")
+            path.unlink()
+
+
+if __name__ == "__main__":
+    main()
@@ -29,6 +29,11 @@ if 'NO_LOCAL_GGUF' not in os.environ:
     sys.path.insert(1, str(Path(__file__).parent / 'gguf-py'))
 import gguf
 from gguf.vocab import MistralTokenizerType, MistralVocab
+from tensor_cache import TensorCache, code_version
+from tensor_writer import FileRangeTensor, StackedTensor, open_resumable, write_tensors
+from gguf_kquants import KQUANT_FTYPES, kquant_tensor_type
+import quant_kernels
+import dequant_kernels
 
 try:
     from mistral_common.tokens.tokenizers.base import TokenizerVersion # pyright: ignore[reportMissingImports]
@@ -90,6 +95,11 @@ class ModelBase:
     use_temp_file: bool
     lazy: bool
     dry_run: bool
+    threads: int
+    pipeline: bool
+    memory_budget: int
+    resume: bool
+    tensor_cache: TensorCache | None
     hparams: dict[str, Any]
     model_tensors: dict[str, Callable[[], Tensor]]
     gguf_writer: gguf.GGUFWriter
@@ -116,7 +126,8 @@ class ModelBase:
                  split_max_tensors: int = 0, split_max_size: int = 0, dry_run: bool = False,
                  small_first_shard: bool = False, hparams: dict[str, Any] | None = None, remote_hf_model_id: str | None = None,
                  disable_mistral_community_chat_template: bool = False,
-                 sentence_transformers_dense_modules: bool = False):
+                 sentence_transformers_dense_modules: bool = False, threads: int = 1,
+                 pipeline: bool = False, memory_budget: int = 0, resume: bool = False, cache_dir: Path | None = None):
         if type(self) is ModelBase or \
                 type(self) is TextModel or \
                 type(self) is MmprojModel:
@@ -133,6 +144,10 @@ class ModelBase:
         self.use_temp_file = use_temp_file
         self.lazy = not eager or (remote_hf_model_id is not None)
         self.dry_run = dry_run
+        self.threads = threads
+        self.pipeline = pipeline
+        self.memory_budget = memory_budget
+        self.resume = resume
         self.remote_hf_model_id = remote_hf_model_id
         self.sentence_transformers_dense_modules = sentence_transformers_dense_modules
         self.hparams = ModelBase.load_hparams(self.dir_model, self.is_mistral_format) if hparams is None else hparams
@@ -154,6 +169,21 @@ class ModelBase:
 
         self.dequant_model()
 
+        # lazy torch.stack() outputs of stack_experts(), by id, with their expert inputs
+        self._expert_stacks: dict[int, tuple[Tensor, list[Tensor]]] = {}
+
+        self.tensor_cache = None
+        if cache_dir is not None:
+            if not self.lazy or is_big_endian:
+                logger.warning("--cache-dir is ignored with --no-lazy and --bigendian")
+            else:
+                self.tensor_cache = TensorCache(cache_dir, {
+                    "model": type(self).__name__,
+                    # not where the checkpoint lives: a re-merged fine-tune is usually a new directory
+                    "hparams": {k: v for k, v in self.hparams.items() if k not in ("_name_or_path", "transformers_version")},
+                    "transform": code_version(sys.modules[__name__], sys.modules["gguf_kquants"], quant_kernels, dequant_kernels, gguf.quants, gguf.lazy),
+                })
+
         # Configure GGUF Writer
         self.gguf_writer = gguf.GGUFWriter(path=None, arch=gguf.MODEL_ARCH_NAMES[self.model_arch], endianess=self.endianess, use_temp_file=self.use_temp_file,
                                            split_max_tensors=split_max_tensors, split_max_size=split_max_size, dry_run=dry_run, small_first_shard=small_first_shard)
@@ -215,7 +245,8 @@ class ModelBase:
         else:
             weight_map = {}
 
-        for part_name in part_names:
+        # sorted: the output tensor order (and so the file layout) must not depend on the hash seed
+        for part_name in sorted(part_names):
             logger.info(f"gguf: indexing model part '{part_name}'")
             ctx: ContextManager[Any]
             if is_safetensors:
@@ -278,93 +309,33 @@ class ModelBase:
                 # The scale is inverted
                 return data / scale.float()
 
-            def dequant_simple(weight: Tensor, scale: Tensor, block_size: Sequence[int] | None = None) -> Tensor:
-                scale = scale.float()
-
-                if block_size is not None:
-                    for i, size in enumerate(block_size):
-                        scale = scale.repeat_interleave(size, i)
-                    # unpad the scale (e.g. when the tensor size isn't a multiple of the block size)
-                    scale = scale[tuple(slice(0, size) for size in weight.shape)]
+            def dequant_chunked(func: Callable[..., Tensor], shape: Sequence[int], *args: Any) -> Tensor:
+                # one lazy node: the packed inputs are read, then dequantized a block of rows at a time
+                if self.lazy:
+                    meta = LazyTorchTensor.meta_with_dtype_and_shape(torch.float32, tuple(shape))
+                    return cast(torch.Tensor, LazyTorchTensor(meta=meta, args=args, func=func))
+                return func(*args)
 
-                return weight.float() * scale
+            def dequant_simple(weight: Tensor, scale: Tensor, block_size: Sequence[int] | None = None) -> Tensor:
+                return dequant_chunked(lambda w, s: dequant_kernels.dequant_simple(w, s, block_size), weight.shape, weight, scale)
 
-            # ref: https://github.com/ModelCloud/GPTQModel/blob/037c5c0f6c9e33c500d975b038d02e7ca437546d/gptqmodel/nn_modules/qlinear/__init__.py#L437-L476
             def dequant_gptq(g_idx: Tensor, qweight: Tensor, qzeros: Tensor, scales: Tensor) -> Tensor:
                 bits = quant_config["bits"]
                 assert bits in (2, 3, 4, 8)
-                assert qweight.dtype == qzeros.dtype
-                maxq = (2 ** bits) - 1
-                weight = None
-                zeros = None
-                pack_dtype_bits = qweight.dtype.itemsize * 8
-
-                if bits in [2, 4, 8]:
-                    pack_factor = pack_dtype_bits // bits
-                    wf = torch.tensor(list(range(0, pack_dtype_bits, bits)), dtype=torch.int32).unsqueeze(0)
-                    if self.lazy:
-                        wf = LazyTorchTensor.from_eager(wf)
-
-                    zeros = torch.bitwise_right_shift(
-                        qzeros.unsqueeze(2).expand(-1, -1, pack_factor),
-                        wf.unsqueeze(0)
-                    ).to(torch.int16 if bits == 8 else torch.int8)
-                    zeros = torch.bitwise_and(zeros, maxq).reshape(scales.shape)
-
-                    weight = torch.bitwise_and(
-                        torch.bitwise_right_shift(
-                            qweight.unsqueeze(1).expand(-1, pack_factor, -1),
-                            wf.unsqueeze(-1)
-                        ).to(torch.int16 if bits == 8 else torch.int8),
-                        maxq
-                    )
-                elif bits == 3:
+                if bits == 3:
                     raise NotImplementedError("3-bit gptq dequantization is not yet implemented")
-
-                assert weight is not None
-                assert zeros is not None
-
-                weight = weight.reshape(weight.shape[0] * weight.shape[1], weight.shape[2])
-
-                # gptq_v2 doesn't need to offset zeros
-                if quant_config.get("checkpoint_format", "gptq") == "gptq":
-                    zeros += 1
-
-                return (scales[g_idx].float() * (weight - zeros[g_idx]).float()).T
+                checkpoint_format = quant_config.get("checkpoint_format", "gptq")
+                return dequant_chunked(
+                    lambda g, w, z, s: dequant_kernels.dequant_gptq(g, w, z, s, bits, checkpoint_format),
+                    dequant_kernels.gptq_shape(qweight.shape, qweight.dtype, bits), g_idx, qweight, qzeros, scales,
+                )
 
             def dequant_packed(w: Tensor, scale: Tensor, shape_tensor: Tensor, zero_point: Tensor | None, num_bits: int, group_size: int):
-                assert w.dtype == torch.int32
                 shape = tuple(shape_tensor.tolist())
-                assert len(shape) == 2
-                mask = (1 << num_bits) - 1
-
-                shifts = torch.arange(0, 32 - (num_bits - 1), num_bits, dtype=torch.int32)
-                if self.lazy:
-                    shifts = LazyTorchTensor.from_eager(shifts)
-
-                if zero_point is None:
-                    offset = 1 << (num_bits - 1)
-                else:
-                    assert len(zero_point.shape) == 2
-                    offset = (zero_point.unsqueeze(1) >> shifts.reshape(1, -1, 1)) & mask
-                    offset = offset.reshape(-1, zero_point.shape[1])
-                    # trim padding, and prepare for broadcast
-                    # NOTE: the zero-point is packed along dim 0
-                    offset = offset[:shape[0], :].unsqueeze(-1)
-
-                # extract values
-                # NOTE: the weights are packed along dim 1
-                unpacked = (w.unsqueeze(-1) >> shifts.reshape(1, 1, -1)) & mask
-                unpacked = unpacked.reshape(shape[0], -1)
-
-                # trim padding
-                unpacked = unpacked[:, :shape[1]]
-
-                # prepare for broadcast of the scale
-                unpacked = unpacked.reshape(shape[0], (unpacked.shape[-1] + group_size - 1) // group_size, group_size)
-                unpacked = unpacked - offset
-
-                return (unpacked * scale.unsqueeze(-1).float()).reshape(shape)
+                return dequant_chunked(
+                    lambda w, s, z: dequant_kernels.dequant_packed(w, s, shape, z, num_bits, group_size),
+                    shape, w, scale, zero_point,
+                )
 
             if quant_method == "bitnet":
                 for name in self.model_tensors.keys():
@@ -516,10 +487,12 @@ class ModelBase:
                 continue
 
             old_dtype = data_torch.dtype
+            source = data_torch
 
             # convert any unsupported data types to float32
             if data_torch.dtype not in (torch.float16, torch.float32):
                 data_torch = data_torch.to(torch.float32)
+            modify_input = data_torch
 
             # use the first number-like part of the tensor name as the block id
             bid = None
@@ -601,15 +574,33 @@ class ModelBase:
                         data_qtype = gguf.GGMLQuantizationType.TQ1_0
                     elif self.ftype == gguf.LlamaFileType.MOSTLY_TQ2_0:
                         data_qtype = gguf.GGMLQuantizationType.TQ2_0
+                    elif self.ftype in KQUANT_FTYPES:
+                        # per-tensor mixture, as llama-quantize would pick it
+                        data_qtype = kquant_tensor_type(
+                            self.ftype, new_name, data.shape, bid, self.block_count,
+                            n_expert=self.find_hparam(["num_local_experts", "num_experts", "n_routed_experts"], optional=True) or 0,
+                            has_output=not self.hparams.get("tie_word_embeddings", False),
+                        )
                     else:
                         raise ValueError(f"Unknown file type: {self.ftype.name}")
 
+                if (passthrough := self.passthrough_tensor(source, modify_input, data_torch, data_qtype)) is not None:
+                    shape_str = f"{{{', '.join(str(n) for n in reversed(data_torch.shape))}}}"
+                    logger.info(f"{f'%-{max_name_len}s' % f'{new_name},'} {old_dtype} --> {data_qtype.name}, shape = {shape_str} (passthrough)")
+                    self.gguf_writer.add_tensor(new_name, passthrough, raw_dtype=data_qtype)
+                    continue
+
+                # an untransformed tensor is quantized from its source dtype, one chunk of rows at a
+                # time, instead of from a whole-tensor float32 copy
+                quant_input = source if data_torch is modify_input else data
+                stack = self._expert_stacks.pop(id(data_torch), None)
+                experts = stack[1] if stack is not None and stack[0] is data_torch else None
                 try:
-                    data = gguf.quants.quantize(data, data_qtype)
+                    data = self.quantize_output(new_name, quant_input, data_qtype, experts)
                 except gguf.QuantError as e:
                     logger.warning("%s, %s", e, "falling back to F16")
                     data_qtype = gguf.GGMLQuantizationType.F16
-                    data = gguf.quants.quantize(data, data_qtype)
+                    data = self.quantize_output(new_name, quant_input, data_qtype, experts)
 
                 shape = gguf.quant_shape_from_byte_shape(data.shape, data_qtype) if data.dtype == np.uint8 else data.shape
 
@@ -617,10 +608,50 @@ class ModelBase:
                 shape_str = f"{{{', '.join(str(n) for n in reversed(shape))}}}"
 
                 # n_dims is implicit in the shape
-                logger.info(f"{f'%-{max_name_len}s' % f'{new_name},'} {old_dtype} --> {data_qtype.name}, shape = {shape_str}")
+                cached = " (cached)" if isinstance(data, FileRangeTensor) else ""
+                logger.info(f"{f'%-{max_name_len}s' % f'{new_name},'} {old_dtype} --> {data_qtype.name}, shape = {shape_str}{cached}")
 
                 self.gguf_writer.add_tensor(new_name, data, raw_dtype=data_qtype)
 
+        self._expert_stacks.clear()
+
+    def stack_experts(self, datas: list[Tensor]) -> Tensor:
+        """torch.stack(datas, dim=0) for merged expert weights, written one expert at a time when lazy."""
+        data_torch = torch.stack(datas, dim=0)
+        if self.lazy and not self.is_big_endian:
+            self._expert_stacks[id(data_torch)] = (data_torch, datas)
+        return data_torch
+
+    def quantize_output(self, name: str, data: Any, qtype: gguf.GGMLQuantizationType, experts: list[Tensor] | None = None) -> Any:
+        if experts is not None:
+            # quantization works on rows, so the stack of the quantized experts is the quantized stack
+            return StackedTensor([self.quantize_output(f"{name}.{i}", e, qtype) for i, e in enumerate(experts)])
+        if self.tensor_cache is not None:
+            return self.tensor_cache.quantize(name, data, qtype)
+        return quant_kernels.quantize(data, qtype)
+
+    _passthrough_dtypes: dict[str, gguf.GGMLQuantizationType] = {
+        "F32": gguf.GGMLQuantizationType.F32,
+        "F16": gguf.GGMLQuantizationType.F16,
+        "BF16": gguf.GGMLQuantizationType.BF16,
+    }
+
+    def passthrough_tensor(self, source: Tensor, modify_input: Tensor, output: Tensor, data_qtype: gguf.GGMLQuantizationType) -> FileRangeTensor | None:
+        # an output that is the untouched source tensor (renamed only) already in the target type
+        # is copied file-to-file by the writer instead of going through torch, numpy and quantize()
+        if output is not modify_input or not isinstance(source, LazyTorchTensor) or source._data is not None:
+            return None
+        if len(source._args) != 1 or not isinstance(local := source._args[0], gguf.utility.LocalTensor):
+            return None
+        if self.endianess != gguf.GGUFEndian.LITTLE or sys.byteorder != "little" or len(local.shape) == 0:
+            return None
+        if self._passthrough_dtypes.get(local.dtype) != data_qtype or tuple(output.shape) != local.shape:
+            return None
+        if data_qtype == gguf.GGMLQuantizationType.BF16:
+            # BF16 has no numpy dtype: raw bytes, like the output of gguf.quants.quantize
+            return FileRangeTensor(local.data_range, np.uint8, (*local.shape[:-1], local.shape[-1] * 2))
+        return FileRangeTensor(local.data_range, np.float16 if data_qtype == gguf.GGMLQuantizationType.F16 else np.float32, local.shape)
+
     def set_type(self):
         self.gguf_writer.add_type(gguf.GGUFType.MODEL)
 
@@ -659,10 +690,25 @@ class ModelBase:
     def write(self):
         self.prepare_tensors()
         self.prepare_metadata(vocab_only=False)
-        self.gguf_writer.write_header_to_file(path=self.fname_out)
-        self.gguf_writer.write_kv_data_to_file()
-        self.gguf_writer.write_tensors_to_file(progress=True)
+        journal = None
+        if self.resume:
+            # keeps a matching partial output of an earlier run and journals every written tensor
+            journal = open_resumable(self.gguf_writer, self.fname_out, self.source_fingerprint())
+        else:
+            self.gguf_writer.write_header_to_file(path=self.fname_out)
+            self.gguf_writer.write_kv_data_to_file()
+        # lazy tensors are materialized (transformed + quantized) here, in parallel with --threads / --pipeline
+        write_tensors(self.gguf_writer, self.threads, progress=True, pipeline=self.pipeline, memory_budget=self.memory_budget, journal=journal)
         self.gguf_writer.close()
+        if self.tensor_cache is not None:
+            self.tensor_cache.report()
+
+    def source_fingerprint(self) -> list[Any]:
+        # a changed checkpoint (or converter) with the same shapes must not be resumed into
+        if self.remote_hf_model_id is not None:
+            return [self.remote_hf_model_id]
+        files = [Path(__file__)] + sorted(p for p in self.dir_model.iterdir() if p.is_file())
+        return [(p.name, p.stat().st_size, p.stat().st_mtime_ns) for p in files]
 
     @staticmethod
     def get_model_part_names(dir_model: Path, prefix: str, suffix: str) -> list[str]:
@@ -2493,7 +2539,7 @@ class LlamaModel(TextModel):
                         datas.append(self._experts[bid][ename])
                         del self._experts[bid][ename]
 
-                    data_torch = torch.stack(datas, dim=0)
+                    data_torch = self.stack_experts(datas)
 
                     merged_name = f"layers.{bid}.feed_forward.experts.{wid}.weight"
 
@@ -2611,7 +2657,7 @@ class AfmoeModel(LlamaModel):
                         datas.append(self._experts[bid][ename_to_retrieve])
                         del self._experts[bid][ename_to_retrieve]
 
-                    data_torch = torch.stack(datas, dim=0)
+                    data_torch = self.stack_experts(datas)
                     merged_name = f"model.layers.{bid}.mlp.experts.{w_name}.weight"
                     new_name = self.map_tensor_name(merged_name)
                     tensors.append((new_name, data_torch))
@@ -3176,7 +3222,7 @@ class GrokModel(TextModel):
                             datas.append(torch.cat(tensor_list, dim=wid[2]) if len(tensor_list) > 1 else tensor_list[0])
                             del self._experts[bid][ename]
 
-                        data_torch = torch.stack(datas, dim=0)
+                        data_torch = self.stack_experts(datas)
 
                         merged_name = f"transformer.decoder_layer.{bid}.moe.{wid[0]}.weight"
 
@@ -3723,7 +3769,7 @@ class Ernie4_5MoeModel(Ernie4_5Model):
                         datas.append(self._experts[bid][ename_to_retrieve])
                         del self._experts[bid][ename_to_retrieve]
 
-                    data_torch = torch.stack(datas, dim=0)
+                    data_torch = self.stack_experts(datas)
                     merged_name = f"model.layers.{bid}.mlp.experts.{w_name}.weight"
                     new_name = self.map_tensor_name(merged_name)
                     tensors.append((new_name, data_torch))
@@ -4113,7 +4159,7 @@ class Qwen2MoeModel(TextModel):
                         datas.append(self._experts[bid][ename])
                         del self._experts[bid][ename]
 
-                    data_torch = torch.stack(datas, dim=0)
+                    data_torch = self.stack_experts(datas)
 
                     merged_name = f"model.layers.{bid}.mlp.experts.{w_name}.weight"
 
@@ -4731,7 +4777,7 @@ class PhiMoeModel(Phi3MiniModel):
                         datas.append(self._experts[bid][ename])
                         del self._experts[bid][ename]
 
-                    data_torch = torch.stack(datas, dim=0)
+                    data_torch = self.stack_experts(datas)
 
                     merged_name = f"model.layers.{bid}.block_sparse_moe.experts.{w_name}.weight"
 
@@ -6645,7 +6691,7 @@ class JambaModel(TextModel):
                         datas.append(self._experts[bid][ename])
                         del self._experts[bid][ename]
 
-                    data_torch = torch.stack(datas, dim=0)
+                    data_torch = self.stack_experts(datas)
 
                     # using the same merged name as qwen2moe
                     merged_name = f"model.layers.{bid}.mlp.experts.{wid}.weight"
@@ -6811,7 +6857,7 @@ class OlmoeModel(TextModel):
                         datas.append(self._experts[bid][ename])
                         del self._experts[bid][ename]
 
-                    data_torch = torch.stack(datas, dim=0)
+                    data_torch = self.stack_experts(datas)
 
                     merged_name = f"model.layers.{bid}.mlp.experts.{w_name}.weight"
 
@@ -7056,7 +7102,7 @@ class ArcticModel(TextModel):
                         datas.append(self._experts[bid][ename])
                         del self._experts[bid][ename]
 
-                    data_torch = torch.stack(datas, dim=0)
+                    data_torch = self.stack_experts(datas)
 
                     merged_name = f"layers.{bid}.feed_forward.experts.{wid}.weight"
 
@@ -7145,7 +7191,7 @@ class DeepseekModel(TextModel):
                         datas.append(self._experts[bid][ename])
                         del self._experts[bid][ename]
 
-                    data_torch = torch.stack(datas, dim=0)
+                    data_torch = self.stack_experts(datas)
 
                     merged_name = f"model.layers.{bid}.mlp.experts.{w_name}.weight"
 
@@ -7307,7 +7353,7 @@ class DeepseekV2Model(TextModel):
                         datas.append(self._experts[bid][ename])
                         del self._experts[bid][ename]
 
-                    data_torch = torch.stack(datas, dim=0)
+                    data_torch = self.stack_experts(datas)
 
                     merged_name = f"model.layers.{bid}.mlp.experts.{w_name}.weight"
 
@@ -7391,7 +7437,7 @@ class MiniMaxM2Model(TextModel):
                     datas.append(expert_cache[ename])
                     del expert_cache[ename]
 
-                data_torch = torch.stack(datas, dim=0)
+                data_torch = self.stack_experts(datas)
                 merged_name = f"model.layers.{bid}.block_sparse_moe.experts.{w_name}.weight"
                 new_name = self.map_tensor_name(merged_name)
                 tensors.append((new_name, data_torch))
@@ -7986,7 +8032,7 @@ class Glm4MoeModel(TextModel):
                         datas.append(self._experts[bid][ename])
                         del self._experts[bid][ename]
 
-                    data_torch = torch.stack(datas, dim=0)
+                    data_torch = self.stack_experts(datas)
 
                     merged_name = f"model.layers.{bid}.mlp.experts.{w_name}.weight"
 
@@ -8702,7 +8748,7 @@ class BailingMoeModel(TextModel):
                         datas.append(self._experts[bid][ename])
                         del self._experts[bid][ename]
 
-                    data_torch = torch.stack(datas, dim=0)
+                    data_torch = self.stack_experts(datas)
 
                     merged_name = f"model.layers.{bid}.mlp.experts.{w_name}.weight"
 
@@ -8793,7 +8839,7 @@ class BailingMoeV2Model(TextModel):
                         datas.append(self._experts[bid][ename])
                         del self._experts[bid][ename]
 
-                    data_torch = torch.stack(datas, dim=0)
+                    data_torch = self.stack_experts(datas)
 
                     merged_name = f"model.layers.{bid}.mlp.experts.{w_name}.weight"
 
@@ -8873,7 +8919,7 @@ class GroveMoeModel(TextModel):
                         datas.append(self._chunk_experts[bid][ename])
                         del self._chunk_experts[bid][ename]
 
-                    data_torch = torch.stack(datas, dim=0)
+                    data_torch = self.stack_experts(datas)
 
                     merged_name = f"model.layers.{bid}.mlp.chunk_experts.{w_name}.weight"
 
@@ -8904,7 +8950,7 @@ class GroveMoeModel(TextModel):
                         datas.append(self._experts[bid][ename])
                         del self._experts[bid][ename]
 
-                    data_torch = torch.stack(datas, dim=0)
+                    data_torch = self.stack_experts(datas)
 
                     merged_name = f"model.layers.{bid}.mlp.experts.{w_name}.weight"
 
@@ -9276,7 +9322,7 @@ class HunYuanMoEModel(TextModel):
                         datas.append(self._experts[bid][ename])
                         del self._experts[bid][ename]
 
-                    data_torch = torch.stack(datas, dim=0)
+                    data_torch = self.stack_experts(datas)
                     merged_name = f"model.layers.{bid}.mlp.experts.{w_name}.weight"
                     new_name = self.map_tensor_name(merged_name)
                     tensors.append((new_name, data_torch))
@@ -9341,7 +9387,7 @@ class LLaDAMoEModel(TextModel):
                         datas.append(self._experts[bid][ename])
                         del self._experts[bid][ename]
 
-                    data_torch = torch.stack(datas, dim=0)
+                    data_torch = self.stack_experts(datas)
 
                     merged_name = f"model.layers.{bid}.mlp.experts.{w_name}.weight"
 
@@ -9696,7 +9742,7 @@ class LFM2MoeModel(TextModel):
                     datas.append(expert_cache[ename])
                     del expert_cache[ename]
 
-                data_torch = torch.stack(datas, dim=0)
+                data_torch = self.stack_experts(datas)
                 merged_name = f"layers.{bid}.feed_forward.experts.{w_name}.weight"
                 new_name = self.map_tensor_name(merged_name)
                 tensors.append((new_name, data_torch))
@@ -9806,7 +9852,7 @@ class SmallThinkerModel(TextModel):
                         datas.append(self._experts[bid][ename])
                         del self._experts[bid][ename]
 
-                    data_torch = torch.stack(datas, dim=0)
+                    data_torch = self.stack_experts(datas)
 
                     merged_name = f"model.layers.{bid}.block_sparse_moe.experts.{w_name}.weight"
 
@@ -10287,8 +10333,8 @@ def parse_args() -> argparse.Namespace:
         help="path to write to; default: based on input. {ftype} will be replaced by the outtype.",
     )
     parser.add_argument(
-        "--outtype", type=str, choices=["f32", "f16", "bf16", "q8_0", "tq1_0", "tq2_0", "auto"], default="f16",
-        help="output format - use f32 for float32, f16 for float16, bf16 for bfloat16, q8_0 for Q8_0, tq1_0 or tq2_0 for ternary, and auto for the highest-fidelity 16-bit float type depending on the first loaded tensor type",
+        "--outtype", type=str, choices=["f32", "f16", "bf16", "q8_0", "q4_k_m", "q5_k_m", "q6_k", "tq1_0", "tq2_0", "auto"], default="f16",
+        help="output format - use f32 for float32, f16 for float16, bf16 for bfloat16, q8_0 for Q8_0, q4_k_m, q5_k_m or q6_k for llama.cpp's K-quant mixtures, tq1_0 or tq2_0 for ternary, and auto for the highest-fidelity 16-bit float type depending on the first loaded tensor type",
     )
     parser.add_argument(
         "--bigendian", action="store_true",
@@ -10307,6 +10353,26 @@ def parse_args() -> argparse.Namespace:
         "--no-lazy", action="store_true",
         help="use more RAM by computing all outputs before writing (use in case lazy evaluation is broken)",
     )
+    parser.add_argument(
+        "--threads", type=int, default=1,
+        help="number of worker processes that transform, quantize and write tensors in parallel (output is identical to --threads 1)",
+    )
+    parser.add_argument(
+        "--pipeline", action="store_true",
+        help="overlap reading, transforming, quantizing and writing in one process (--threads workers per compute stage) and report per-stage utilization",
+    )
+    parser.add_argument(
+        "--memory-budget", type=str, default="4G",
+        help="with --pipeline: max bytes of tensors in flight between the reader and the writer N(M|G), 0 for unlimited",
+    )
+    parser.add_argument(
+        "--cache-dir", type=Path, default=None,
+        help="reuse converted tensors whose source bytes, model, converter and type are unchanged since an earlier conversion (e.g. after re-merging a LoRA), and store the others there",
+    )
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="journal the written tensors (<outfile>.journal) and continue an interrupted conversion of the same model and options instead of starting over",
+    )
     parser.add_argument(
         "--model-name", type=str, default=None,
         help="name of the model",
@@ -10450,6 +10516,9 @@ def main() -> None:
         "f16": gguf.LlamaFileType.MOSTLY_F16,
         "bf16": gguf.LlamaFileType.MOSTLY_BF16,
         "q8_0": gguf.LlamaFileType.MOSTLY_Q8_0,
+        "q4_k_m": gguf.LlamaFileType.MOSTLY_Q4_K_M,
+        "q5_k_m": gguf.LlamaFileType.MOSTLY_Q5_K_M,
+        "q6_k": gguf.LlamaFileType.MOSTLY_Q6_K,
         "tq1_0": gguf.LlamaFileType.MOSTLY_TQ1_0,
         "tq2_0": gguf.LlamaFileType.MOSTLY_TQ2_0,
         "auto": gguf.LlamaFileType.GUESSED,
@@ -10460,6 +10529,10 @@ def main() -> None:
         logger.error("Error: Cannot use temp file when splitting")
         sys.exit(1)
 
+    if args.use_temp_file and args.resume:
+        logger.error("Error: Cannot use temp file when resuming")
+        sys.exit(1)
+
     if args.outfile is not None:
         fname_out = args.outfile
     elif hf_repo_id:
@@ -10501,7 +10574,12 @@ def main() -> None:
                                      split_max_size=split_str_to_n_bytes(args.split_max_size), dry_run=args.dry_run,
                                      small_first_shard=args.no_tensor_first_split,
                                      remote_hf_model_id=hf_repo_id, disable_mistral_community_chat_template=disable_mistral_community_chat_template,
-                                     sentence_transformers_dense_modules=args.sentence_transformers_dense_modules
+                                     sentence_transformers_dense_modules=args.sentence_transformers_dense_modules,
+                                     threads=args.threads,
+                                     pipeline=args.pipeline,
+                                     memory_budget=split_str_to_n_bytes(args.memory_budget),
+                                     resume=args.resume,
+                                     cache_dir=args.cache_dir,
                                      )
 
         if args.vocab_only:
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Converts a PEFT LoRA adapter (e.g. backend/universal_adapter) into a GGUF adapter
+# that llama.cpp / Ollama apply on top of an unchanged base GGUF (Modelfile: ADAPTER ...).
+# Only the lora_A/lora_B matrices are read and written, so an adapter iteration no
+# longer needs the merge + full 14B conversion + quantization round trip.
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import math
+import sys
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Iterable
+
+import torch
+
+if TYPE_CHECKING:
+    from torch import Tensor
+
+from convert_hf_to_gguf import ModelBase, ModelType, get_model_architecture, gguf
+
+
+logger = logging.getLogger("lora-to-gguf")
+
+
+def load_adapter(dir_lora: Path) -> tuple[dict[str, Any], dict[str, Tensor]]:
+    with open(dir_lora / "adapter_config.json", "r", encoding="utf-8") as f:
+        lparams: dict[str, Any] = json.load(f)
+
+    weights = dir_lora / "adapter_model.safetensors"
+    if weights.is_file():
+        from safetensors.torch import load_file
+        state = load_file(weights)
+    else:
+        state = torch.load(dir_lora / "adapter_model.bin", map_location="cpu", weights_only=True)
+    return lparams, state
+
+
+def split_lora_pairs(state: dict[str, Tensor]) -> dict[str, tuple[Tensor, Tensor]]:
+    """{base weight name: (lora_A, lora_B)}; PEFT names look like base_model.model.<module>.lora_A.weight"""
+    pairs: dict[str, dict[str, Tensor]] = {}
+    for name, tensor in state.items():
+        for part in ("lora_A", "lora_B"):
+            if f".{part}." not in name:
+                continue
+            module = name.split(f".{part}.")[0].removeprefix("base_model.model.")
+            pairs.setdefault(f"{module}.weight", {})[part] = tensor
+            break
+        else:
+            raise ValueError(f"Unexpected adapter tensor {name!r}: only plain LoRA layers can be exported (no modules_to_save)")
+
+    incomplete = sorted(k for k, v in pairs.items() if len(v) != 2)
+    if incomplete:
+        raise ValueError(f"LoRA tensors without a matching A/B pair: {incomplete}")
+    return {k: (v["lora_A"], v["lora_B"]) for k, v in pairs.items()}
+
+
+def load_base_hparams(base: str | None, base_model_id: str | None) -> dict[str, Any]:
+    if base is not None:
+        return ModelBase.load_hparams(Path(base), False)
+    # Only config.json is needed from the hub, not the weights
+    from huggingface_hub import hf_hub_download
+    config_path = hf_hub_download(repo_id=base_model_id, filename="config.json")
+    return ModelBase.load_hparams(Path(config_path).parent, False)
+
+
+def lora_model_class(model_class: type[ModelBase]) -> type[ModelBase]:
+    """Wraps the base architecture so its tensor-name mapping (and row transforms) apply to the adapter."""
+
+    class LoraModel(model_class):  # type: ignore[valid-type, misc]
+        model_arch = model_class.model_arch
+
+        lora_alpha: float
+        lora_a: dict[str, Tensor]
+
+        def __init__(self, *args, dir_lora_model: Path, lora_alpha: float, lora_pairs: dict[str, tuple[Tensor, Tensor]], **kwargs):
+            self.lora_pairs = lora_pairs
+            super().__init__(*args, **kwargs)
+            self.dir_model_card = dir_lora_model
+            self.lora_alpha = lora_alpha
+
+        def index_tensors(self, remote_hf_model_id: str | None = None) -> dict[str, Callable[[], Tensor]]:
+            del remote_hf_model_id  # unused
+            # Tensors are yielded under the base weight name (carrying lora_B), so the
+            # architecture's modify_tensors() maps it exactly like the merged weight.
+            self.lora_a = {name: a.float() for name, (a, _) in self.lora_pairs.items()}
+            return {name: (lambda b=b: b) for name, (_, b) in self.lora_pairs.items()}
+
+        def dequant_model(self):
+            pass  # The adapter is never quantized, whatever the base config says
+
+        def set_vocab(self):
+            pass
+
+        def set_type(self):
+            self.gguf_writer.add_type(gguf.GGUFType.ADAPTER)
+            self.gguf_writer.add_string(gguf.Keys.Adapter.TYPE, "lora")
+
+        def set_gguf_parameters(self):
+            self.gguf_writer.add_float32(gguf.Keys.Adapter.LORA_ALPHA, self.lora_alpha)
+
+        def generate_extra_tensors(self) -> Iterable[tuple[str, Tensor]]:
+            return ()
+
+        def modify_tensors(self, data_torch: Tensor, name: str, bid: int | None) -> Iterable[tuple[str, Tensor]]:
+            # W + B @ A: row permutes/splits of W act on B only, A is shared by every output part
+            lora_a = self.lora_a[name]
+            for new_name, lora_b in super().modify_tensors(data_torch, name, bid):
+                if lora_b.shape[-1] != lora_a.shape[0]:
+                    raise ValueError(f"{name!r}: transform of the base weight is not a row operation, can't apply it to LoRA")
+                yield new_name + ".lora_a", lora_a
+                yield new_name + ".lora_b", lora_b
+
+    return LoraModel
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Convert a huggingface PEFT LoRA adapter to a GGUF adapter")
+    parser.add_argument(
+        "--outfile", type=Path,
+        help="path to write to; default: <lora_path>/ggml-adapter-model-{ftype}.gguf",
+    )
+    parser.add_argument(
+        "--outtype", type=str, choices=["f32", "f16", "bf16", "q8_0"], default="f16",
+        help="output format for the lora_a/lora_b tensors",
+    )
+    parser.add_argument(
+        "--bigendian", action="store_true",
+        help="model is executed on big endian machine",
+    )
+    parser.add_argument(
+        "--base", type=str,
+        help="directory containing the base model config.json (weights are not needed)",
+    )
+    parser.add_argument(
+        "--base-model-id", type=str,
+        help="huggingface id of the base model (default: base_model_name_or_path from adapter_config.json)",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true",
+        help="only print out the tensor plan and exit, without writing any new files",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true",
+        help="increase output verbosity",
+    )
+    parser.add_argument(
+        "lora_path", type=Path,
+        help="directory containing the PEFT adapter (adapter_config.json + adapter_model.safetensors)",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+
+    ftype_map: dict[str, gguf.LlamaFileType] = {
+        "f32": gguf.LlamaFileType.ALL_F32,
+        "f16": gguf.LlamaFileType.MOSTLY_F16,
+        "bf16": gguf.LlamaFileType.MOSTLY_BF16,
+        "q8_0": gguf.LlamaFileType.MOSTLY_Q8_0,
+    }
+
+    dir_lora: Path = args.lora_path
+    lparams, state = load_adapter(dir_lora)
+    lora_pairs = split_lora_pairs(state)
+
+    base_model_id = args.base_model_id or lparams.get("base_model_name_or_path")
+    if args.base is None and not base_model_id:
+        logger.error("Error: no base model given (--base or --base-model-id) and none recorded in adapter_config.json")
+        sys.exit(1)
+    hparams = load_base_hparams(args.base, base_model_id)
+
+    # llama.cpp scales by alpha / r; rsLoRA trains with alpha / sqrt(r)
+    rank = lparams["r"]
+    alpha = float(lparams.get("lora_alpha", rank))
+    if lparams.get("use_rslora"):
+        alpha *= math.sqrt(rank)
+    logger.info(f"LoRA: {len(lora_pairs)} target weights, r = {rank}, alpha = {alpha:g}")
+
+    fname_out: Path = args.outfile if args.outfile is not None else dir_lora / "ggml-adapter-model-{ftype}.gguf"
+    if fname_out.is_dir():
+        fname_out = fname_out / "ggml-adapter-model-{ftype}.gguf"
+
+    with torch.inference_mode():
+        model_architecture = get_model_architecture(hparams, ModelType.TEXT)
+        logger.info(f"Base model architecture: {model_architecture}")
+        try:
+            model_class = ModelBase.from_model_architecture(model_architecture, model_type=ModelType.TEXT)
+        except NotImplementedError:
+            logger.error(f"Model {model_architecture} is not supported")
+            sys.exit(1)
+
+        model_instance = lora_model_class(model_class)(
+            dir_lora, ftype_map[args.outtype], fname_out,
+            is_big_endian=args.bigendian,
+            eager=True,
+            dry_run=args.dry_run,
+            hparams=hparams,
+            dir_lora_model=dir_lora,
+            lora_alpha=alpha,
+            lora_pairs=lora_pairs,
+        )
+
+        logger.info("Exporting adapter...")
+        model_instance.write()
+        logger.info(f"Adapter successfully exported to {model_instance.fname_out}")
+
+
+if __name__ == '__main__':
+    main()
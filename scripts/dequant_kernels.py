@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Row-block dequantization of pre-quantized checkpoints (GPTQ, FP8, compressed-tensors) for
+# ModelBase.dequant_model().
+#
+# The whole-tensor versions (the *_reference functions, kept for bench_dequant.py) unpack a
+# packed weight into full-size int8/int16/int32 intermediates, gather the zeros and scales to
+# full size (or repeat_interleave the block scales) and only then produce the float32 result,
+# so a large layer peaks at several times its float32 size. The kernels here allocate the
+# float32 output once and fill it a block of rows at a time; everything else is at most one
+# block. Every element goes through the same torch ops, so the output is bit-identical.
+
+from __future__ import annotations
+
+from typing import Sequence
+
+import torch
+
+
+# elements of output per block (the int/float intermediates of one block are a few times this)
+CHUNK_ELEMENTS = 1 << 20
+
+
+def dequant_simple_reference(weight: torch.Tensor, scale: torch.Tensor, block_size: Sequence[int] | None = None) -> torch.Tensor:
+    scale = scale.float()
+
+    if block_size is not None:
+        for i, size in enumerate(block_size):
+            scale = scale.repeat_interleave(size, i)
+        # unpad the scale (e.g. when the tensor size isn't a multiple of the block size)
+        scale = scale[tuple(slice(0, size) for size in weight.shape)]
+
+    return weight.float() * scale
+
+
+def dequant_simple(weight: torch.Tensor, scale: torch.Tensor, block_size: Sequence[int] | None = None,
+                   chunk_elements: int = CHUNK_ELEMENTS) -> torch.Tensor:
+    if weight.dim() == 0:
+        return dequant_simple_reference(weight, scale, block_size)
+    scale = scale.float()
+    n_rows = weight.shape[0]
+    row_elements = max(1, weight[0].numel())
+    rows = max(1, chunk_elements // row_elements)
+    if block_size is not None:
+        rows = max(block_size[0], rows // block_size[0] * block_size[0])  # whole scale blocks
+    # only a scale with one row per weight row (or per row block) is split; others broadcast
+    per_row = scale.dim() == weight.dim() and scale.shape[0] > 1
+
+    out = torch.empty(weight.shape, dtype=torch.float32)
+    for r0 in range(0, n_rows, rows):
+        r1 = min(n_rows, r0 + rows)
+        if block_size is not None:
+            s = scale[r0 // block_size[0]:(r1 + block_size[0] - 1) // block_size[0]]
+            for i, size in enumerate(block_size):
+                s = s.repeat_interleave(size, i)
+            s = s[(slice(0, r1 - r0), *(slice(0, size) for size in weight.shape[1:]))]
+        else:
+            s = scale[r0:r1] if per_row else scale
+        torch.mul(weight[r0:r1].float(), s, out=out[r0:r1])
+    return out
+
+
+# ref: https://github.com/ModelCloud/GPTQModel/blob/037c5c0f6c9e33c500d975b038d02e7ca437546d/gptqmodel/nn_modules/qlinear/__init__.py#L437-L476
+def _gptq_zeros(qzeros: torch.Tensor, scales: torch.Tensor, bits: int, checkpoint_format: str) -> tuple[torch.Tensor, torch.Tensor]:
+    maxq = (2 ** bits) - 1
+    pack_dtype_bits = qzeros.dtype.itemsize * 8
+    pack_factor = pack_dtype_bits // bits
+    wf = torch.tensor(list(range(0, pack_dtype_bits, bits)), dtype=torch.int32).unsqueeze(0)
+
+    zeros = torch.bitwise_right_shift(
+        qzeros.unsqueeze(2).expand(-1, -1, pack_factor),
+        wf.unsqueeze(0)
+    ).to(torch.int16 if bits == 8 else torch.int8)
+    zeros = torch.bitwise_and(zeros, maxq).reshape(scales.shape)
+
+    # gptq_v2 doesn't need to offset zeros
+    if checkpoint_format == "gptq":
+        zeros += 1
+    return zeros, wf
+
+
+def _gptq_unpack(qweight: torch.Tensor, wf: torch.Tensor, bits: int) -> torch.Tensor:
+    maxq = (2 ** bits) - 1
+    weight = torch.bitwise_and(
+        torch.bitwise_right_shift(
+            qweight.unsqueeze(1).expand(-1, wf.shape[-1], -1),
+            wf.unsqueeze(-1)
+        ).to(torch.int16 if bits == 8 else torch.int8),
+        maxq
+    )
+    return weight.reshape(weight.shape[0] * weight.shape[1], weight.shape[2])
+
+
+def dequant_gptq_reference(g_idx: torch.Tensor, qweight: torch.Tensor, qzeros: torch.Tensor, scales: torch.Tensor,
+                           bits: int, checkpoint_format: str = "gptq") -> torch.Tensor:
+    assert bits in (2, 3, 4, 8)
+    assert qweight.dtype == qzeros.dtype
+    if bits == 3:
+        raise NotImplementedError("3-bit gptq dequantization is not yet implemented")
+
+    zeros, wf = _gptq_zeros(qzeros, scales, bits, checkpoint_format)
+    weight = _gptq_unpack(qweight, wf, bits)
+    return (scales[g_idx].float() * (weight - zeros[g_idx]).float()).T
+
+
+def dequant_gptq(g_idx: torch.Tensor, qweight: torch.Tensor, qzeros: torch.Tensor, scales: torch.Tensor,
+                 bits: int, checkpoint_format: str = "gptq", chunk_elements: int = CHUNK_ELEMENTS) -> torch.Tensor:
+    assert bits in (2, 3, 4, 8)
+    assert qweight.dtype == qzeros.dtype
+    if bits == 3:
+        raise NotImplementedError("3-bit gptq dequantization is not yet implemented")
+
+    # the zeros are per group: as small as the scales
+    zeros, wf = _gptq_zeros(qzeros, scales, bits, checkpoint_format)
+    pack_factor = wf.shape[-1]
+    n_out = qweight.shape[1]
+    packed_rows = max(1, chunk_elements // (pack_factor * n_out))
+
+    # (in_features, out_features), returned transposed like the reference
+    out = torch.empty((qweight.shape[0] * pack_factor, n_out), dtype=torch.float32)
+    for p0 in range(0, qweight.shape[0], packed_rows):
+        p1 = min(qweight.shape[0], p0 + packed_rows)
+        g = g_idx[p0 * pack_factor:p1 * pack_factor]
+        weight = _gptq_unpack(qweight[p0:p1], wf, bits)
+        torch.mul(scales[g].float(), (weight - zeros[g]).float(), out=out[p0 * pack_factor:p1 * pack_factor])
+    return out.T
+
+
+def _packed_offset(zero_point: torch.Tensor | None, shifts: torch.Tensor, mask: int, num_bits: int, n_rows: int) -> torch.Tensor | int:
+    if zero_point is None:
+        return 1 << (num_bits - 1)
+    assert len(zero_point.shape) == 2
+    offset = (zero_point.unsqueeze(1) >> shifts.reshape(1, -1, 1)) & mask
+    offset = offset.reshape(-1, zero_point.shape[1])
+    # trim padding, and prepare for broadcast
+    # NOTE: the zero-point is packed along dim 0
+    return offset[:n_rows, :].unsqueeze(-1)
+
+
+def dequant_packed_reference(w: torch.Tensor, scale: torch.Tensor, shape: Sequence[int], zero_point: torch.Tensor | None,
+                             num_bits: int, group_size: int) -> torch.Tensor:
+    assert w.dtype == torch.int32
+    shape = tuple(shape)
+    assert len(shape) == 2
+    mask = (1 << num_bits) - 1
+
+    shifts = torch.arange(0, 32 - (num_bits - 1), num_bits, dtype=torch.int32)
+    offset = _packed_offset(zero_point, shifts, mask, num_bits, shape[0])
+
+    # extract values
+    # NOTE: the weights are packed along dim 1
+    unpacked = (w.unsqueeze(-1) >> shifts.reshape(1, 1, -1)) & mask
+    unpacked = unpacked.reshape(shape[0], -1)
+
+    # trim padding
+    unpacked = unpacked[:, :shape[1]]
+
+    # prepare for broadcast of the scale
+    unpacked = unpacked.reshape(shape[0], (unpacked.shape[-1] + group_size - 1) // group_size, group_size)
+    unpacked = unpacked - offset
+
+    return (unpacked * scale.unsqueeze(-1).float()).reshape(shape)
+
+
+def dequant_packed(w: torch.Tensor, scale: torch.Tensor, shape: Sequence[int], zero_point: torch.Tensor | None,
+                   num_bits: int, group_size: int, chunk_elements: int = CHUNK_ELEMENTS) -> torch.Tensor:
+    assert w.dtype == torch.int32
+    shape = tuple(shape)
+    assert len(shape) == 2
+    mask = (1 << num_bits) - 1
+
+    shifts = torch.arange(0, 32 - (num_bits - 1), num_bits, dtype=torch.int32)
+    offset = _packed_offset(zero_point, shifts, mask, num_bits, shape[0])
+    n_groups = (shape[1] + group_size - 1) // group_size
+    rows = max(1, chunk_elements // shape[1])
+
+    out = torch.empty(shape, dtype=torch.float32)
+    for r0 in range(0, shape[0], rows):
+        r1 = min(shape[0], r0 + rows)
+        unpacked = (w[r0:r1].unsqueeze(-1) >> shifts.reshape(1, 1, -1)) & mask
+        unpacked = unpacked.reshape(r1 - r0, -1)[:, :shape[1]]
+        unpacked = unpacked.reshape(r1 - r0, n_groups, group_size)
+        unpacked = unpacked - (offset if isinstance(offset, int) else offset[r0:r1])
+        out[r0:r1] = (unpacked * scale[r0:r1].unsqueeze(-1).float()).reshape(r1 - r0, shape[1])
+    return out
+
+
+def gptq_shape(qweight_shape: Sequence[int], qweight_dtype: torch.dtype, bits: int) -> tuple[int, int]:
+    """Shape of the dequantized (transposed) GPTQ weight."""
+    pack_factor = qweight_dtype.itemsize * 8 // bits
+    return (qweight_shape[1], qweight_shape[0] * pack_factor)
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# K-quant encoders (Q4_K, Q5_K, Q6_K) for gguf.quants and llama.cpp's per-tensor type mixture,
+# so convert_hf_to_gguf.py --outtype q4_k_m writes the deployable file in a single pass
+# (no f16 intermediate + llama-quantize).
+#
+# The encoders are vectorized ports of quantize_row_q{4,5,6}_K_ref (ggml-quants.c, no imatrix):
+# every block of a row group is processed at once, and the per-block sums keep the C loops'
+# left-to-right float32 accumulation order so rounding decisions match the reference.
+
+from __future__ import annotations
+
+import numpy as np
+
+import gguf
+from gguf.constants import QK_K
+
+GROUP_MAX_EPS = np.float32(1e-15)
+
+KQUANT_FTYPES: dict[gguf.LlamaFileType, gguf.GGMLQuantizationType] = {
+    gguf.LlamaFileType.MOSTLY_Q4_K_M: gguf.GGMLQuantizationType.Q4_K,
+    gguf.LlamaFileType.MOSTLY_Q5_K_M: gguf.GGMLQuantizationType.Q5_K,
+    gguf.LlamaFileType.MOSTLY_Q6_K: gguf.GGMLQuantizationType.Q6_K,
+}
+
+# llama.cpp's fallbacks for rows that are not a multiple of QK_K
+INCOMPATIBLE_FALLBACK: dict[gguf.GGMLQuantizationType, gguf.GGMLQuantizationType] = {
+    gguf.GGMLQuantizationType.Q4_K: gguf.GGMLQuantizationType.Q5_0,
+    gguf.GGMLQuantizationType.Q5_K: gguf.GGMLQuantizationType.Q5_1,
+    gguf.GGMLQuantizationType.Q6_K: gguf.GGMLQuantizationType.Q8_0,
+}
+
+
+# The helpers below work on element-major (n, n_groups) arrays: element i of every group is one
+# contiguous row, so the sequential sums are plain vector adds.
+
+def _seq_sum(values: np.ndarray) -> np.ndarray:
+    # float32 sum over axis 0 in index order (np.sum is pairwise and rounds differently)
+    acc = values[0].copy()
+    for row in values[1:]:
+        acc += row
+    return acc
+
+
+def _nearest_int(values: np.ndarray) -> np.ndarray:
+    # ggml's nearest_int() rounds half to even, like np.rint
+    return np.rint(values).astype(np.int32)
+
+
+def make_qkx2_quants(x: np.ndarray, weights: np.ndarray, nmax: int, rmin: float, rdelta: float, nstep: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(scale, L, -min) of each column of x for asymmetric nmax-level quantization (use_mad = false)."""
+    x_min = np.minimum(x.min(axis=0), 0)
+    x_max = x.max(axis=0)
+    sum_w = _seq_sum(weights)
+    sum_x = _seq_sum(weights * x)
+    flat = x_max == x_min
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        iscale = np.float32(nmax) / (x_max - x_min)
+        scale = np.float32(1) / iscale
+        L = np.clip(_nearest_int(iscale * (x - x_min)), 0, nmax)
+        diff = (scale * L.astype(np.float32) + x_min) - x
+        best_mad = _seq_sum(weights * (diff * diff))
+
+        for step in range(nstep + 1):
+            # as in ggml, later steps start from the best min found so far
+            iscale = (np.float32(rmin) + np.float32(rdelta) * np.float32(step) + np.float32(nmax)) / (x_max - x_min)
+            laux = np.clip(_nearest_int(iscale * (x - x_min)), 0, nmax)
+            lf = laux.astype(np.float32)
+            wl = weights * lf
+            sum_l = _seq_sum(wl)
+            sum_l2 = _seq_sum(wl * lf)
+            sum_xl = _seq_sum(wl * x)
+            D = sum_w * sum_l2 - sum_l * sum_l
+            this_scale = (sum_w * sum_xl - sum_x * sum_l) / D
+            this_min = (sum_l2 * sum_x - sum_l * sum_xl) / D
+            positive = this_min > 0
+            this_min = np.where(positive, np.float32(0), this_min)
+            this_scale = np.where(positive, sum_xl / sum_l2, this_scale)
+            diff = (this_scale * lf + this_min) - x
+            mad = _seq_sum(weights * (diff * diff))
+            better = (D > 0) & (mad < best_mad)
+            L = np.where(better, laux, L)
+            best_mad = np.where(better, mad, best_mad)
+            scale = np.where(better, this_scale, scale)
+            x_min = np.where(better, this_min, x_min)
+
+    scale = np.where(flat, np.float32(0), scale)
+    L = np.where(flat, 0, L)
+    return scale.astype(np.float32), L, (-x_min).astype(np.float32)
+
+
+def make_qx_quants(x: np.ndarray, nmax: int) -> tuple[np.ndarray, np.ndarray]:
+    """(scale, L) of each column of x for symmetric quantization, rmse_type = 1 (weights x^2), no imatrix."""
+    idx = np.argmax(np.abs(x), axis=0)[None, :]
+    x_max = np.take_along_axis(x, idx, axis=0)[0]
+    zero = np.abs(x_max) < GROUP_MAX_EPS
+    w = x * x
+
+    def attempt(iscale: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        l = np.clip(_nearest_int(iscale * x), -nmax, nmax - 1)
+        lf = l.astype(np.float32)
+        return l + nmax, _seq_sum(w * x * lf), _seq_sum(w * lf * lf)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        L, sumlx, suml2 = attempt(np.float32(-nmax) / x_max)
+        scale = np.where(suml2 != 0, sumlx / suml2, np.float32(0))
+        best = scale * sumlx
+        for step in range(-9, 10):
+            if step == 0:
+                continue
+            laux, sumlx, suml2 = attempt(-(np.float32(nmax) + np.float32(0.1) * np.float32(step)) / x_max)
+            better = (suml2 > 0) & (sumlx * sumlx > best * suml2)
+            L = np.where(better, laux, L)
+            scale = np.where(better, sumlx / suml2, scale)
+            best = np.where(better, scale * sumlx, best)
+
+    scale = np.where(zero, np.float32(0), scale)
+    L = np.where(zero, 0, L)
+    return scale.astype(np.float32), L
+
+
+def _pack_scale_min_k4(ls: np.ndarray, lm: np.ndarray) -> np.ndarray:
+    # 6-bit scales and mins of the 8 sub-blocks in 12 bytes (inverse of gguf's Q4_K.get_scale_min)
+    scales = np.empty((ls.shape[0], 12), dtype=np.uint8)
+    scales[:, 0:4] = ls[:, :4] | ((ls[:, 4:] >> 4) << 6)
+    scales[:, 4:8] = lm[:, :4] | ((lm[:, 4:] >> 4) << 6)
+    scales[:, 8:12] = (ls[:, 4:] & 0xF) | ((lm[:, 4:] & 0xF) << 4)
+    return scales
+
+
+def _quantize_k_asym(blocks: np.ndarray, nmax: int, rmin: float, nstep: int) -> tuple[np.ndarray, ...]:
+    # shared part of Q4_K and Q5_K: 8 sub-blocks of 32 with a 6-bit scale and min each
+    n_blocks = blocks.shape[0]
+    x = np.ascontiguousarray(blocks.reshape((n_blocks * 8, 32)).T)
+    av_x = np.sqrt(_seq_sum(x * x) / np.float32(32))
+    weights = av_x + np.abs(x)
+    scales, L, mins = make_qkx2_quants(x, weights, nmax, rmin, 0.1, nstep)
+    scales = scales.reshape((n_blocks, 8))
+    mins = mins.reshape((n_blocks, 8))
+
+    max_scale = np.maximum(scales.max(axis=-1), 0)
+    max_min = np.maximum(mins.max(axis=-1), 0)
+    with np.errstate(divide="ignore"):
+        inv_scale = np.where(max_scale > 0, np.float32(63) / max_scale, np.float32(0))
+        inv_min = np.where(max_min > 0, np.float32(63) / max_min, np.float32(0))
+    # uint8_t ls = nearest_int(...): wraps like the C assignment before clamping
+    ls = np.minimum(_nearest_int(inv_scale[:, None] * scales) & 0xFF, 63).astype(np.uint8)
+    lm = np.minimum(_nearest_int(inv_min[:, None] * mins) & 0xFF, 63).astype(np.uint8)
+
+    d = (max_scale / np.float32(63)).astype(np.float16)
+    dmin = (max_min / np.float32(63)).astype(np.float16)
+    sub_d = (d.astype(np.float32)[:, None] * ls).reshape(-1)
+    sub_dm = (dmin.astype(np.float32)[:, None] * lm).reshape(-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        requant = np.clip(_nearest_int((x + sub_dm) / sub_d), 0, nmax)
+    L = np.where(sub_d != 0, requant, L).astype(np.uint8).T.reshape((n_blocks, 4, 2, 32))
+
+    head = np.concatenate([d.reshape((-1, 1)).view(np.uint8), dmin.reshape((-1, 1)).view(np.uint8),
+                           _pack_scale_min_k4(ls, lm)], axis=-1)
+    return head, L
+
+
+def quantize_blocks_q4_k(blocks: np.ndarray) -> np.ndarray:
+    head, L = _quantize_k_asym(blocks, 15, -1.0, 20)
+    qs = L[:, :, 0] | (L[:, :, 1] << np.uint8(4))
+    return np.concatenate([head, qs.reshape((blocks.shape[0], QK_K // 2))], axis=-1)
+
+
+def quantize_blocks_q5_k(blocks: np.ndarray) -> np.ndarray:
+    n_blocks = blocks.shape[0]
+    head, L = _quantize_k_asym(blocks, 31, -0.5, 15)
+    low = L & np.uint8(0xF)
+    qs = low[:, :, 0] | (low[:, :, 1] << np.uint8(4))
+    # bit i of qh[j] is the 5th bit of element j of sub-block i
+    high = (L >> np.uint8(4)).reshape((n_blocks, 8, 32)).transpose((0, 2, 1))
+    qh = np.bitwise_or.reduce(high << np.arange(8, dtype=np.uint8), axis=-1)
+    return np.concatenate([head, qh, qs.reshape((n_blocks, QK_K // 2))], axis=-1)
+
+
+def quantize_blocks_q6_k(blocks: np.ndarray) -> np.ndarray:
+    n_blocks = blocks.shape[0]
+    x = np.ascontiguousarray(blocks.reshape((n_blocks * 16, 16)).T)
+    scales, L = make_qx_quants(x, 32)
+    scales = scales.reshape((n_blocks, 16))
+
+    idx = np.argmax(np.abs(scales), axis=-1)[:, None]
+    max_scale = np.take_along_axis(scales, idx, axis=-1)[:, 0]
+    zero = np.abs(max_scale) < GROUP_MAX_EPS
+    with np.errstate(divide="ignore", invalid="ignore"):
+        iscale = np.float32(-128) / max_scale
+        d = np.where(zero, np.float32(0), np.float32(1) / iscale).astype(np.float16)
+        sc = np.minimum(_nearest_int(iscale[:, None] * scales), 127)
+        sc = np.where(zero[:, None], 0, sc).astype(np.int8)
+        sub_d = (d.astype(np.float32)[:, None] * sc).reshape(-1)
+        requant = np.clip(_nearest_int(x / sub_d), -32, 31) + 32
+    L = np.where(sub_d != 0, requant, L)
+    L = np.where(np.repeat(zero, 16), 0, L).astype(np.uint8).T.reshape((n_blocks, 2, 4, 32))
+
+    low = L & np.uint8(0xF)
+    ql = low[:, :, 0:2] | (low[:, :, 2:4] << np.uint8(4))
+    qh = np.bitwise_or.reduce((L >> np.uint8(4)) << np.array([0, 2, 4, 6], dtype=np.uint8).reshape((1, 1, 4, 1)), axis=2)
+    return np.concatenate([ql.reshape((n_blocks, QK_K // 2)), qh.reshape((n_blocks, QK_K // 4)),
+                           sc.view(np.uint8), d.reshape((-1, 1)).view(np.uint8)], axis=-1)
+
+
+def register_kquants() -> None:
+    """Installs the encoders on gguf.quants' Q4_K/Q5_K/Q6_K (kept if the package already implements them)."""
+    for qtype, fn in (
+        (gguf.GGMLQuantizationType.Q4_K, quantize_blocks_q4_k),
+        (gguf.GGMLQuantizationType.Q5_K, quantize_blocks_q5_k),
+        (gguf.GGMLQuantizationType.Q6_K, quantize_blocks_q6_k),
+    ):
+        cls = gguf.quants._type_traits[qtype]
+        if "quantize_blocks" not in vars(cls):
+            setattr(cls, "quantize_blocks", classmethod(lambda cls, blocks, fn=fn: fn(blocks)))
+
+
+def use_more_bits(i_layer: int, n_layers: int) -> bool:
+    return i_layer < n_layers // 8 or i_layer >= 7 * n_layers // 8 or (i_layer - n_layers // 8) % 3 == 2
+
+
+def kquant_tensor_type(ftype: gguf.LlamaFileType, name: str, shape: tuple[int, ...], bid: int | None,
+                       n_layers: int, n_expert: int = 0, has_output: bool = True) -> gguf.GGMLQuantizationType:
+    """Type of one quantizable tensor, following llama_tensor_get_type() in llama.cpp for Q4_K_M/Q5_K_M/Q6_K."""
+    Q = gguf.GGMLQuantizationType
+    qtype = KQUANT_FTYPES[ftype]
+    medium = ftype in (gguf.LlamaFileType.MOSTLY_Q4_K_M, gguf.LlamaFileType.MOSTLY_Q5_K_M)
+    more_bits = bid is not None and use_more_bits(bid, n_layers)
+
+    # with tied embeddings token_embd doubles as the output projection
+    if name == "output.weight" or (not has_output and name == "token_embd.weight"):
+        return Q.Q8_0 if shape[-1] % QK_K != 0 else Q.Q6_K
+    if name.endswith("attn_v.weight"):
+        if medium and more_bits:
+            qtype = Q.Q6_K
+        if n_expert == 8:
+            qtype = Q.Q8_0
+    elif name.endswith("attn_k.weight"):
+        if n_expert == 8:
+            qtype = Q.Q8_0
+    elif "ffn_down" in name:
+        if medium and more_bits:
+            qtype = Q.Q6_K
+    elif name.endswith("attn_output.weight"):
+        if n_expert == 8 and ftype == gguf.LlamaFileType.MOSTLY_Q4_K_M:
+            qtype = Q.Q5_K
+    elif name.endswith("attn_qkv.weight"):
+        if ftype == gguf.LlamaFileType.MOSTLY_Q4_K_M:
+            qtype = Q.Q5_K
+        elif ftype == gguf.LlamaFileType.MOSTLY_Q5_K_M:
+            qtype = Q.Q6_K
+
+    if shape[-1] % QK_K != 0:
+        qtype = INCOMPATIBLE_FALLBACK.get(qtype, qtype)
+    return qtype
+
+
+register_kquants()
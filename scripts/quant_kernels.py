@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Row-chunked quantization for the GGUF writer: a drop-in for gguf.quants.quantize() whose
+# temporaries are bounded by one chunk of rows instead of the whole tensor.
+#
+# gguf.quants.quantize() needs the whole tensor as float32 first (prepare_tensors up-casts bf16
+# with data_torch.to(torch.float32)), so a 13824x5120 bf16 weight briefly costs 283 MB of f32
+# on top of its output. Here the output is allocated once and each chunk of rows is converted
+# into a reused float32 scratch buffer (torch sources via copy_(), no intermediate tensor) and
+# quantized straight into its slice of the output. Q8_0, TQ1_0, TQ2_0 and BF16 have dedicated
+# kernels (numba when installed, otherwise NumPy with out= buffers); the other types run their
+# gguf.quants quantize_blocks() per chunk. The bytes are identical to gguf.quants.quantize()
+# for finite inputs (casts of NaN to integers are platform-defined in both).
+
+from __future__ import annotations
+
+import os
+from typing import Any, Callable
+
+import numpy as np
+
+import gguf
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# float32 elements per chunk: 512 KiB scratch buffers stay in cache (also the fastest size
+# for the block-wise quantize_blocks() of the K-quants)
+CHUNK_ELEMENTS = 1 << 17
+
+# GGUF_QUANT_NUMBA=0 forces the NumPy kernels (e.g. to compare both with bench_quant.py)
+USE_NUMBA = numba is not None and os.environ.get("GGUF_QUANT_NUMBA", "1") != "0"
+
+GGMLQuantizationType = gguf.GGMLQuantizationType
+
+
+def output_meta(shape: tuple[int, ...], qtype: GGMLQuantizationType) -> tuple[type, tuple[int, ...]]:
+    """(dtype, shape) of gguf.quants.quantize(array of this shape, qtype)."""
+    if qtype == GGMLQuantizationType.F32:
+        return np.float32, tuple(shape)
+    if qtype == GGMLQuantizationType.F16:
+        return np.float16, tuple(shape)
+    if qtype not in gguf.quants._type_traits:
+        raise NotImplementedError(f"Quantization for {qtype.name} is not yet implemented")
+    block_size, _ = gguf.GGML_QUANT_SIZES[qtype]
+    if len(shape) == 0 or shape[-1] % block_size != 0:
+        raise gguf.QuantError(f"Can't quantize tensor with shape {tuple(shape)} to {qtype.name}")
+    return np.uint8, gguf.quant_shape_to_byte_shape(shape, qtype)
+
+
+# NumPy kernels: (x: f32 blocks, out: uint8 blocks, scratch) -> None, where scratch holds
+# three f32 buffers shaped like x and a (n_blocks, 1) buffer for the block scales
+
+
+def _roundf_into(n: np.ndarray, a: np.ndarray, fl: np.ndarray) -> np.ndarray:
+    # gguf.quants.np_roundf(n) (round half away from zero) into a, with fl as scratch
+    np.abs(n, out=a)
+    np.floor(a, out=fl)
+    np.subtract(a, fl, out=a)
+    np.multiply(a, 2, out=a)
+    np.floor(a, out=a)
+    np.add(fl, a, out=a)
+    np.sign(n, out=fl)
+    np.multiply(fl, a, out=a)
+    return a
+
+
+def _q8_0_numpy(x: np.ndarray, out: np.ndarray, scratch: list[np.ndarray]) -> None:
+    t1, t2, t3, d = scratch
+    np.abs(x, out=t1)
+    np.max(t1, axis=1, keepdims=True, out=d)
+    np.divide(d, 127, out=d)
+    # id = 1 / d, or 0 for all-zero blocks
+    t3[:, :1] = 0
+    np.divide(1, d, out=t3[:, :1], where=d != 0)
+    np.multiply(x, t3[:, :1], out=t1)
+    qs = _roundf_into(t1, t2, t3)
+    np.copyto(out[:, 2:].view(np.int8), qs, casting="unsafe")
+    np.copyto(out[:, :2].view(np.float16), d, casting="same_kind")
+
+
+_NUMPY_KERNELS: dict[GGMLQuantizationType, Callable[[np.ndarray, np.ndarray, list[np.ndarray]], None]] = {
+    GGMLQuantizationType.Q8_0: _q8_0_numpy,
+}
+
+
+# numba kernels: (x: f32 blocks, out: uint8 blocks, d: f32 scales) -> None; the f16 conversion
+# of d (round to nearest even, like ndarray.astype) stays in NumPy
+_NUMBA_KERNELS: dict[GGMLQuantizationType, tuple[Callable[..., None], int]] = {}
+
+if numba is not None:
+    @numba.njit(cache=True, nogil=True)
+    def _roundf(v):
+        a = abs(v)
+        fl = np.floor(a)
+        b = fl + np.floor(np.float32(2) * (a - fl))
+        if v < 0:
+            return -b
+        return b
+
+    @numba.njit(cache=True, nogil=True)
+    def _amax_inv(x, i, scale):
+        amax = np.float32(0)
+        for j in range(x.shape[1]):
+            v = abs(x[i, j])
+            if v > amax:
+                amax = v
+        d = amax / scale
+        inv = np.float32(0) if d == 0 else np.float32(1) / d
+        return d, inv
+
+    @numba.njit(cache=True, nogil=True)
+    def _q8_0_numba(x, out, d):
+        for i in range(x.shape[0]):
+            d[i], inv = _amax_inv(x, i, np.float32(127))
+            for j in range(32):
+                out[i, 2 + j] = np.int32(_roundf(x[i, j] * inv)) & 0xFF
+
+    @numba.njit(cache=True, nogil=True)
+    def _tq2_0_numba(x, out, d):
+        for i in range(x.shape[0]):
+            d[i], inv = _amax_inv(x, i, np.float32(1))
+            for k in range(2):
+                for l in range(32):
+                    byte = 0
+                    for j in range(4):
+                        q = np.int32(_roundf(x[i, k * 128 + j * 32 + l] * inv)) + 1
+                        byte |= q << (2 * j)
+                    out[i, k * 32 + l] = byte & 0xFF
+
+    @numba.njit(cache=True, nogil=True)
+    def _tq1_0_numba(x, out, d):
+        q = np.empty(256, dtype=np.int32)
+        for i in range(x.shape[0]):
+            d[i], inv = _amax_inv(x, i, np.float32(1))
+            for e in range(256):
+                q[e] = np.int32(_roundf(x[i, e] * inv)) + 1
+            # 5 trits per byte (4 for qh), then scaled to fixed point as in quantize_row_tq1_0_ref
+            for l in range(32):
+                s = q[l] * 81 + q[32 + l] * 27 + q[64 + l] * 9 + q[96 + l] * 3 + q[128 + l]
+                out[i, l] = (s * 256 + 242) // 243
+            for l in range(16):
+                s = q[160 + l] * 81 + q[176 + l] * 27 + q[192 + l] * 9 + q[208 + l] * 3 + q[224 + l]
+                out[i, 32 + l] = (s * 256 + 242) // 243
+            for l in range(4):
+                s = q[240 + l] * 81 + q[244 + l] * 27 + q[248 + l] * 9 + q[252 + l] * 3
+                out[i, 48 + l] = (s * 256 + 242) // 243
+
+    @numba.njit(cache=True, nogil=True)
+    def _bf16_numba(n, out):
+        # n: f32 bits as uint32, out: uint16; same as gguf.quants.BF16 (quiet NaN, round to nearest even)
+        for i in range(n.shape[0]):
+            v = np.int64(n[i])
+            if (v & 0x7fffffff) > 0x7f800000:
+                v = (v & 0xffff0000) | (64 << 16)
+            out[i] = (v + (0x7fff + ((v >> 16) & 1))) >> 16
+
+    # kernel, byte offset of the f16 scale in a block
+    _NUMBA_KERNELS = {
+        GGMLQuantizationType.Q8_0: (_q8_0_numba, 0),
+        GGMLQuantizationType.TQ1_0: (_tq1_0_numba, 52),
+        GGMLQuantizationType.TQ2_0: (_tq2_0_numba, 64),
+    }
+
+
+class ChunkQuantizer:
+    """Quantizes (n_rows, row_len) sources chunk by chunk into a preallocated output, reusing its scratch buffers."""
+
+    def __init__(self, qtype: GGMLQuantizationType, row_len: int, *, chunk_elements: int = CHUNK_ELEMENTS, use_numba: bool = USE_NUMBA):
+        self.qtype = qtype
+        self.row_len = row_len
+        self.chunk_rows = max(1, chunk_elements // row_len)
+        self.block_size, self.type_size = gguf.GGML_QUANT_SIZES[qtype]
+        self.use_numba = use_numba and numba is not None
+        self.x: np.ndarray | None = None
+        n_blocks = self.chunk_rows * row_len // self.block_size
+        if self.use_numba and (qtype in _NUMBA_KERNELS or qtype == GGMLQuantizationType.BF16):
+            self.scratch = [np.empty(n_blocks, dtype=np.float32)]
+        elif not self.use_numba and qtype in _NUMPY_KERNELS:
+            blocks = (n_blocks, self.block_size)
+            self.scratch = [np.empty(blocks, dtype=np.float32) for _ in range(3)] + [np.empty((n_blocks, 1), dtype=np.float32)]
+        else:
+            self.scratch = []
+
+    def _load(self, rows: Any) -> np.ndarray:
+        # rows as float32: the source itself when it already is contiguous f32, otherwise the scratch
+        if isinstance(rows, np.ndarray) and rows.dtype == np.float32 and rows.flags.c_contiguous:
+            return rows
+        if self.x is None:
+            self.x = np.empty((self.chunk_rows, self.row_len), dtype=np.float32)
+        x = self.x[:rows.shape[0]]
+        if isinstance(rows, np.ndarray):
+            np.copyto(x, rows, casting="same_kind")
+        else:  # torch: any dtype, converted like .to(torch.float32) without a temporary tensor
+            import torch
+            torch.from_numpy(x).copy_(rows)
+        return x
+
+    def _quantize_chunk(self, rows: Any, out: np.ndarray) -> None:
+        qtype = self.qtype
+        if qtype in (GGMLQuantizationType.F32, GGMLQuantizationType.F16):
+            if isinstance(rows, np.ndarray):
+                np.copyto(out, rows, casting="same_kind")
+            else:
+                np.copyto(out, self._load(rows), casting="same_kind")
+            return
+
+        x = self._load(rows)
+        blocks = x.reshape((-1, self.block_size))
+        out_blocks = out.reshape((-1, self.type_size))
+        n_blocks = blocks.shape[0]
+
+        if self.use_numba and qtype == GGMLQuantizationType.BF16:
+            _bf16_numba(x.reshape(-1).view(np.uint32), out.reshape(-1).view(np.uint16))
+        elif self.use_numba and qtype in _NUMBA_KERNELS:
+            kernel, d_offset = _NUMBA_KERNELS[qtype]
+            d = self.scratch[0][:n_blocks]
+            kernel(blocks, out_blocks, d)
+            np.copyto(out_blocks[:, d_offset:d_offset + 2].view(np.float16)[:, 0], d, casting="same_kind")
+        elif not self.use_numba and qtype in _NUMPY_KERNELS:
+            _NUMPY_KERNELS[qtype](blocks, out_blocks, [s[:n_blocks] for s in self.scratch])
+        else:
+            out_blocks[...] = gguf.quants._type_traits[qtype].quantize_blocks(blocks)
+
+    def quantize_into(self, src: Any, out: np.ndarray) -> None:
+        rows = src.reshape((-1, self.row_len))
+        out_rows = out.reshape((rows.shape[0], -1))
+        for start in range(0, rows.shape[0], self.chunk_rows):
+            end = min(rows.shape[0], start + self.chunk_rows)
+            self._quantize_chunk(rows[start:end], out_rows[start:end])
+
+
+def quantize_array(src: Any, qtype: GGMLQuantizationType, *, use_numba: bool = USE_NUMBA) -> np.ndarray:
+    """Eager quantization of a numpy array or torch tensor of any float dtype."""
+    shape = tuple(src.shape)
+    dtype, oshape = output_meta(shape, qtype)
+    if qtype == GGMLQuantizationType.F32 and isinstance(src, np.ndarray) and src.dtype == np.float32:
+        return src  # like gguf.quants.quantize: astype(np.float32, copy=False)
+    out = np.empty(oshape, dtype=dtype)
+    if out.size > 0:
+        ChunkQuantizer(qtype, shape[-1] if shape else 1, use_numba=use_numba).quantize_into(src, out)
+    return out
+
+
+def quantize(data: Any, qtype: GGMLQuantizationType) -> Any:
+    """
+    Drop-in for gguf.quants.quantize(). A lazy input (numpy, or torch: e.g. the untouched bf16
+    source tensor) gives a lazy output, evaluated chunk by chunk when the writer materializes it.
+    """
+    dtype, oshape = output_meta(tuple(data.shape), qtype)
+    if isinstance(data, gguf.LazyBase):
+        meta = gguf.LazyNumpyTensor.meta_with_dtype_and_shape(dtype, oshape)
+        return gguf.LazyNumpyTensor(meta=meta, args=(data, qtype), func=quantize_array)
+    return quantize_array(data, qtype)
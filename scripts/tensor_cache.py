@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Content-addressed cache of converted tensors (convert_hf_to_gguf.py --cache-dir).
+#
+# Re-converting a merged fine-tune usually changes only the tensors a LoRA touched. Every
+# quantized output tensor is keyed by the sha256 of the source bytes it is computed from
+# (the safetensors ranges at the leaves of its lazy graph), the model class and hparams, the
+# converter code, the output name and the GGML type. A hit is spliced into the output file
+# by the writer (copy_file_range, like a passthrough tensor); a miss is computed as usual and
+# its bytes are stored when the writer materializes it, in whichever process or thread that is.
+#
+# Layout: <cache dir>/<key[:2]>/<key>.bin (the raw tensor data) and <key>.json (its size and
+# how long it took to quantize, for the time-saved report). Delete the directory to clear it.
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import time
+from functools import partial
+from pathlib import Path
+from types import ModuleType
+from typing import Any
+
+import numpy as np
+
+import gguf
+import quant_kernels
+from tensor_writer import FileRangeTensor, lazy_inputs, range_sha256
+
+
+logger = logging.getLogger("tensor-cache")
+
+
+def code_version(*modules: ModuleType) -> str:
+    """sha256 of the source files of the modules that compute the tensors."""
+    h = hashlib.sha256()
+    for module in modules:
+        path = getattr(module, "__file__", None)
+        if path is not None:
+            h.update(Path(path).read_bytes())
+    return h.hexdigest()
+
+
+def source_ranges(t: Any) -> list[gguf.utility.LocalTensorRange] | None:
+    """
+    The file ranges a lazy tensor is computed from, in graph order, or None when its value also
+    depends on something the key can't see (an evaluated node, an eager array argument, a
+    remote or in-memory source).
+    """
+    if not isinstance(t, gguf.LazyBase):
+        return None
+    ranges: list[gguf.utility.LocalTensorRange] = []
+    seen: set[int] = set()
+    stack = [t]
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        if node._data is not None:
+            return None
+        args = [*node._args, *node._kwargs.values()]
+        if any(hasattr(a, "shape") and hasattr(a, "dtype") and not isinstance(a, (gguf.LazyBase, gguf.utility.LocalTensor)) for a in args):
+            return None
+        children = lazy_inputs(node)
+        if children:
+            stack.extend(reversed(children))
+        elif len(node._args) == 1 and isinstance(node._args[0], gguf.utility.LocalTensor):
+            ranges.append(node._args[0].data_range)
+        else:
+            return None
+    return ranges
+
+
+def _quantize_and_store(path: Path, data: Any, qtype: gguf.GGMLQuantizationType) -> np.ndarray:
+    start = time.perf_counter()
+    out = quant_kernels.quantize_array(data, qtype)
+    seconds = time.perf_counter() - start
+    tmp = path.with_name(f"{path.stem}.{os.getpid()}.tmp")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.with_suffix(".json").write_text(json.dumps({"nbytes": out.nbytes, "seconds": seconds}))
+        np.ascontiguousarray(out).tofile(tmp)
+        os.replace(tmp, path)  # the .bin appears complete or not at all
+    except OSError as e:
+        logger.warning(f"could not store {path.name} in the tensor cache: {e}")
+        tmp.unlink(missing_ok=True)
+    return out
+
+
+class TensorCache:
+    def __init__(self, root: Path, context: dict[str, Any]):
+        self.root = Path(root)
+        self.context = hashlib.sha256(json.dumps(context, sort_keys=True, default=str).encode()).hexdigest()
+        self.source_digests: dict[tuple[str, int, int], str] = {}
+        self.hits = 0
+        self.hit_bytes = 0
+        self.saved_seconds = 0.0
+        self.misses = 0
+        self.uncacheable = 0
+        self.hash_seconds = 0.0
+
+    def _source_digest(self, r: gguf.utility.LocalTensorRange) -> str:
+        # a source tensor can feed several outputs (split or stacked tensors): hash it once
+        k = (str(r.filename), r.offset, r.size)
+        if k not in self.source_digests:
+            with open(r.filename, "rb") as f:
+                self.source_digests[k] = range_sha256(f.fileno(), r.offset, r.size)
+        return self.source_digests[k]
+
+    def key(self, name: str, data: Any, qtype: gguf.GGMLQuantizationType) -> str | None:
+        ranges = source_ranges(data)
+        if not ranges:
+            return None
+        start = time.perf_counter()
+        sources = [self._source_digest(r) for r in ranges]
+        self.hash_seconds += time.perf_counter() - start
+        return hashlib.sha256(json.dumps({
+            "context": self.context,
+            "name": name,
+            "shape": list(data.shape),
+            "qtype": qtype.name,
+            "sources": sources,
+        }).encode()).hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.bin"
+
+    def quantize(self, name: str, data: Any, qtype: gguf.GGMLQuantizationType) -> Any:
+        """Drop-in for quant_kernels.quantize(): a cached FileRangeTensor, or a lazy tensor that stores itself."""
+        dtype, oshape = quant_kernels.output_meta(tuple(data.shape), qtype)
+        key = self.key(name, data, qtype)
+        if key is None:
+            self.uncacheable += 1
+            return quant_kernels.quantize(data, qtype)
+
+        path = self.path(key)
+        nbytes = int(np.prod(oshape)) * np.dtype(dtype).itemsize
+        try:
+            hit = path.stat().st_size == nbytes
+        except FileNotFoundError:
+            hit = False
+        if hit:
+            self.hits += 1
+            self.hit_bytes += nbytes
+            try:
+                self.saved_seconds += json.loads(path.with_suffix(".json").read_text())["seconds"]
+            except (OSError, ValueError, KeyError):
+                pass
+            return FileRangeTensor(gguf.utility.LocalTensorRange(path, 0, nbytes), dtype, oshape)
+
+        self.misses += 1
+        meta = gguf.LazyNumpyTensor.meta_with_dtype_and_shape(dtype, oshape)
+        return gguf.LazyNumpyTensor(meta=meta, args=(data, qtype), func=partial(_quantize_and_store, path))
+
+    def report(self) -> None:
+        total = self.hits + self.misses + self.uncacheable
+        if total == 0:
+            return
+        logger.info(f"Tensor cache: {self.hits}/{total} tensors ({self.hits / total:.1%}, "
+                    f"{gguf.GGUFWriter.format_n_bytes_to_str(self.hit_bytes)}) spliced from {self.root}, "
+                    f"~{self.saved_seconds:.1f} s of quantization saved; {self.misses} converted and stored, "
+                    f"{self.uncacheable} not cacheable; {self.hash_seconds:.1f} s hashing sources")
@@ -0,0 +1,707 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Parallel and resumable tensor-data writers for gguf.GGUFWriter (--threads, --pipeline, --resume).
+#
+# In lazy mode (the default) convert_hf_to_gguf.py only records how each output tensor is
+# computed; the dtype casts, modify_tensors() transforms and quantization all run when the
+# tensor is materialized by the writer. Once prepare_tensors() has finished, every output
+# tensor (and its byte offset in the output file) is known, so the materialization can be
+# fanned out: forked workers inherit the lazy graphs, evaluate one tensor each and pwrite()
+# it at its planned offset. Stateful transforms (expert / QK-norm stacking) have already run
+# serially while planning, and the file layout does not depend on the completion order,
+# so the output is byte-identical to the serial writer.
+
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+import gguf
+
+
+logger = logging.getLogger("tensor-writer")
+
+# The writer whose lazy tensors the forked workers materialize (inherited via fork)
+_writer: gguf.GGUFWriter | None = None
+_fds: list[int] = []
+_checksums = False
+
+
+@dataclass
+class TensorJob:
+    file_id: int
+    name: str
+    offset: int
+    nbytes: int
+    part: int = -1  # expert slice of a StackedTensor
+
+
+def can_fork() -> bool:
+    return "fork" in multiprocessing.get_all_start_methods()
+
+
+def copy_file_range(src_path: str | os.PathLike, src_offset: int, size: int, dst_fd: int, dst_offset: int) -> None:
+    """Kernel-side file-to-file copy (copy_file_range, then sendfile), with a read/pwrite fallback."""
+    with open(src_path, "rb") as src:
+        src_fd = src.fileno()
+        done = 0
+        if hasattr(os, "copy_file_range"):
+            try:
+                while done < size:
+                    n = os.copy_file_range(src_fd, dst_fd, size - done, src_offset + done, dst_offset + done)
+                    if n == 0:
+                        break
+                    done += n
+            except OSError:
+                pass  # e.g. EXDEV on older kernels, unsupported filesystems
+        if done < size and hasattr(os, "sendfile"):
+            try:
+                os.lseek(dst_fd, dst_offset + done, os.SEEK_SET)
+                while done < size:
+                    n = os.sendfile(dst_fd, src_fd, src_offset + done, size - done)
+                    if n == 0:
+                        break
+                    done += n
+            except OSError:
+                pass
+        while done < size:
+            chunk = os.pread(src_fd, min(size - done, 64 * 1024 * 1024), src_offset + done)
+            if not chunk:
+                raise EOFError(f"{src_path}: unexpected end of file at offset {src_offset + done}")
+            pwrite_all(dst_fd, np.frombuffer(chunk, dtype=np.uint8), dst_offset + done)
+            done += len(chunk)
+
+
+class FileRangeTensor:
+    """
+    An output tensor whose bytes already exist in a source file (unchanged name-only tensors
+    in the target dtype). It is copied file-to-file instead of passing through torch and numpy.
+    """
+
+    def __init__(self, src: gguf.utility.LocalTensorRange, dtype: np.dtype, shape: tuple[int, ...]):
+        self.src = src
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(shape)
+        self.nbytes = src.size
+        assert self.nbytes == int(np.prod(self.shape)) * self.dtype.itemsize
+
+    def copy_to(self, fd: int, offset: int) -> None:
+        copy_file_range(self.src.filename, self.src.offset, self.nbytes, fd, offset)
+
+    def sha256(self) -> str:
+        with open(self.src.filename, "rb") as src:
+            return range_sha256(src.fileno(), self.src.offset, self.nbytes)
+
+    def tofile(self, fout: Any) -> None:
+        # same contract as ndarray.tofile: written at (and advancing) the current position
+        fout.flush()
+        try:
+            fd = fout.fileno()
+        except (AttributeError, OSError):  # in-memory spooled temp file
+            with open(self.src.filename, "rb") as src:
+                src.seek(self.src.offset)
+                remaining = self.nbytes
+                while remaining > 0:
+                    chunk = src.read(min(remaining, 64 * 1024 * 1024))
+                    fout.write(chunk)
+                    remaining -= len(chunk)
+            return
+        start = fout.tell()
+        self.copy_to(fd, start)
+        fout.seek(start + self.nbytes)
+
+
+class StackedTensor:
+    """
+    torch.stack(experts) in the output type, kept as one lazy (or cached) array per expert. The
+    stacked layout is known up front, so each expert slice is materialized and written at its
+    own offset, and no more than one expert per writer is ever in memory.
+    """
+
+    def __init__(self, parts: list[Any]):
+        self.parts = parts
+        self.dtype = np.dtype(parts[0].dtype)
+        self.shape = (len(parts), *parts[0].shape)
+        self.part_nbytes = int(np.prod(parts[0].shape)) * self.dtype.itemsize
+        self.nbytes = self.part_nbytes * len(parts)
+        assert all(tuple(p.shape) == self.shape[1:] and np.dtype(p.dtype) == self.dtype for p in parts)
+
+    def tofile(self, fout: Any) -> None:
+        for i, part in enumerate(self.parts):
+            (part if isinstance(part, FileRangeTensor) else materialize(part)).tofile(fout)
+            self.parts[i] = None
+
+
+def materialize(tensor: Any) -> np.ndarray:
+    if isinstance(tensor, gguf.LazyBase):
+        tensor = type(tensor).to_eager(tensor)
+    return np.ascontiguousarray(tensor)
+
+
+def pwrite_all(fd: int, data: np.ndarray, offset: int) -> None:
+    view = memoryview(data.reshape(-1).view(np.uint8))
+    while view:
+        n = os.pwrite(fd, view, offset)
+        view = view[n:]
+        offset += n
+
+
+def data_sha256(data: np.ndarray) -> str:
+    return hashlib.sha256(memoryview(data.reshape(-1).view(np.uint8))).hexdigest()
+
+
+def range_sha256(fd: int, offset: int, nbytes: int) -> str:
+    h = hashlib.sha256()
+    done = 0
+    while done < nbytes:
+        chunk = os.pread(fd, min(nbytes - done, 16 * 1024 * 1024), offset + done)
+        if not chunk:
+            break  # short file: the digest will not match
+        h.update(chunk)
+        done += len(chunk)
+    return h.hexdigest()
+
+
+def write_data(fd: int, data: np.ndarray | FileRangeTensor, job: TensorJob, checksum: bool = False) -> str | None:
+    """Writes one materialized tensor at its planned offset; returns its sha256 if asked to."""
+    assert data.nbytes == job.nbytes, f"{job.name}: expected {job.nbytes} bytes, got {data.nbytes}"
+    if isinstance(data, FileRangeTensor):
+        data.copy_to(fd, job.offset)
+        return data.sha256() if checksum else None
+    pwrite_all(fd, data, job.offset)
+    return data_sha256(data) if checksum else None
+
+
+def plan_tensor_data(writer: gguf.GGUFWriter) -> tuple[list[TensorJob], list[int]]:
+    """
+    Writes the tensor infos and the alignment padding, then returns the absolute offset of
+    every tensor (same layout as GGUFWriter.write_tensors_to_file) and the final file sizes.
+    """
+    writer.write_ti_data_to_file()
+    assert writer.fout is not None
+
+    jobs: list[TensorJob] = []
+    ends: list[int] = []
+    for file_id, (fout, tensors) in enumerate(zip(writer.fout, writer.tensors)):
+        writer.write_padding(fout, fout.tell())
+        fout.flush()
+        offset = fout.tell()
+        for name, ti in tensors.items():
+            if isinstance(ti.tensor, StackedTensor):
+                # one job per expert, at its slice of the stacked tensor
+                for part in range(len(ti.tensor.parts)):
+                    jobs.append(TensorJob(file_id, name, offset + part * ti.tensor.part_nbytes, ti.tensor.part_nbytes, part))
+            else:
+                jobs.append(TensorJob(file_id, name, offset, ti.nbytes))
+            offset += gguf.GGUFWriter.ggml_pad(ti.nbytes, writer.data_alignment)
+        ends.append(offset)
+    return jobs, ends
+
+
+def job_tensor(writer: gguf.GGUFWriter, job: TensorJob) -> Any:
+    tensor = writer.tensors[job.file_id][job.name].tensor
+    return tensor.parts[job.part] if job.part >= 0 else tensor
+
+
+def release_job(writer: gguf.GGUFWriter, job: TensorJob) -> None:
+    ti = writer.tensors[job.file_id][job.name]
+    if job.part >= 0:
+        ti.tensor.parts[job.part] = None
+    else:
+        ti.tensor = None
+
+
+def finish_tensor_data(writer: gguf.GGUFWriter, ends: list[int]) -> None:
+    assert writer.fout is not None
+    for fout, end in zip(writer.fout, ends):
+        fout.truncate(end)  # trailing padding of the last tensor
+        fout.seek(end)
+    for tensors in writer.tensors:
+        for ti in tensors.values():
+            ti.tensor = None
+    writer.state = gguf.gguf_writer.WriterState.WEIGHTS
+
+
+def _init_worker(paths: list[str]) -> None:
+    global _fds
+    _fds = [os.open(path, os.O_WRONLY) for path in paths]
+    if "torch" in sys.modules:
+        # one tensor per process: intra-op threads would only oversubscribe the cores
+        sys.modules["torch"].set_num_threads(1)
+
+
+def _write_job(job: TensorJob) -> str | None:
+    assert _writer is not None
+    tensor = job_tensor(_writer, job)
+    if not isinstance(tensor, FileRangeTensor):
+        tensor = materialize(tensor)
+    return write_data(_fds[job.file_id], tensor, job, _checksums)
+
+
+def write_tensors_parallel(writer: gguf.GGUFWriter, n_workers: int, *, progress: bool = False,
+                           journal: ConversionJournal | None = None) -> None:
+    """Drop-in replacement for writer.write_tensors_to_file() with n_workers processes."""
+    global _writer, _checksums
+
+    jobs, ends = (journal.pending, journal.ends) if journal is not None else plan_tensor_data(writer)
+    assert writer.fout is not None
+    paths = [fout.name for fout in writer.fout]
+
+    bar = None
+    if progress:
+        from tqdm import tqdm
+        bar = tqdm(desc=f"Writing ({n_workers} workers)", total=sum(job.nbytes for job in jobs), unit="byte", unit_scale=True)
+
+    _writer = writer
+    _checksums = journal is not None
+    try:
+        ctx = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=ctx, initializer=_init_worker, initargs=(paths,)) as pool:
+            for job, digest in zip(jobs, pool.map(_write_job, jobs)):
+                if journal is not None:
+                    journal.record(job, digest)
+                if bar is not None:
+                    bar.update(job.nbytes)
+    finally:
+        _writer = None
+        _checksums = False
+        if bar is not None:
+            bar.close()
+
+    finish_tensor_data(writer, ends)
+
+
+# Pipelined mode: read -> transform -> quantize -> write stages in one process.
+#
+# A lazy output tensor is a graph: source leaves (safetensors mmap / remote reads), then the
+# torch transforms ending in .numpy(), then the quantization node. Each stage materializes
+# one level of that graph, so disk reads, transforms, quantization and writes of different
+# tensors overlap. Heavy torch/numpy kernels release the GIL, so the stages run as threads.
+
+
+def _lazy_children(o: Any) -> list[gguf.LazyBase]:
+    if isinstance(o, gguf.LazyBase):
+        return [o]
+    if isinstance(o, (list, tuple)):
+        return [c for item in o for c in _lazy_children(item)]
+    if isinstance(o, dict):
+        return [c for item in o.values() for c in _lazy_children(item)]
+    return []
+
+
+def lazy_inputs(t: Any) -> list[gguf.LazyBase]:
+    """Direct lazy inputs of a lazy node (the transformed array a quantization node consumes)."""
+    if not isinstance(t, gguf.LazyBase) or t._data is not None:
+        return []
+    return _lazy_children((t._args, t._kwargs))
+
+
+def lazy_leaves(t: Any) -> list[gguf.LazyBase]:
+    """Unevaluated nodes that read source data (no lazy inputs of their own)."""
+    leaves: list[gguf.LazyBase] = []
+    seen: set[int] = set()
+    stack = [t] if isinstance(t, gguf.LazyBase) else []
+    while stack:
+        node = stack.pop()
+        if id(node) in seen or node._data is not None:
+            continue
+        seen.add(id(node))
+        children = lazy_inputs(node)
+        if children:
+            stack.extend(children)
+        else:
+            leaves.append(node)
+    return leaves
+
+
+def meta_nbytes(t: Any) -> int:
+    meta = t._meta if isinstance(t, gguf.LazyBase) else t
+    if isinstance(meta, np.ndarray):
+        return meta.size * meta.itemsize
+    numel = getattr(meta, "numel", None)
+    return numel() * meta.element_size() if numel is not None else 0
+
+
+def prefetch(leaf: gguf.LazyBase) -> int:
+    """Evaluates a source leaf and copies it into RAM, so the disk read happens in this stage."""
+    data = type(leaf).to_eager(leaf)
+    leaf._data = data.clone() if hasattr(data, "clone") else np.array(data)
+    return meta_nbytes(leaf)
+
+
+class MemoryBudget:
+    """Bytes in flight between the reader and the writer (a tensor larger than the budget runs alone)."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self.cond = threading.Condition()
+
+    def acquire(self, n: int) -> None:
+        with self.cond:
+            while self.limit > 0 and self.used > 0 and self.used + n > self.limit:
+                self.cond.wait()
+            self.used += n
+
+    def release(self, n: int) -> None:
+        with self.cond:
+            self.used -= n
+            self.cond.notify_all()
+
+
+class StageStats:
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self.busy = 0.0
+        self.items = 0
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+    def add(self, seconds: float, nbytes: int) -> None:
+        with self.lock:
+            self.busy += seconds
+            self.items += 1
+            self.nbytes += nbytes
+
+    def report(self, wall: float) -> str:
+        utilization = self.busy / (wall * self.workers) if wall > 0 else 0.0
+        return f"{self.name:9s} x{self.workers:<3d} {utilization:6.1%} busy, {self.items} tensors, {self.nbytes / 1e9:.2f} GB"
+
+
+class TensorPipeline:
+    """
+    reader (1 thread, prefetching) -> transform workers -> quantize workers -> writer (caller thread,
+    output order). Bounded queues plus a byte budget cap the memory held by in-flight tensors.
+    """
+
+    def __init__(self, writer: gguf.GGUFWriter, n_transform: int, n_quantize: int, memory_budget: int):
+        self.writer = writer
+        self.n_transform = max(1, n_transform)
+        self.n_quantize = max(1, n_quantize)
+        self.budget = MemoryBudget(memory_budget)
+        self.transform_q: queue.Queue = queue.Queue(maxsize=2 * self.n_transform)
+        self.quantize_q: queue.Queue = queue.Queue(maxsize=2 * self.n_quantize)
+        self.results: dict[int, Any] = {}
+        self.results_cond = threading.Condition()
+        self.stats = {
+            "read": StageStats("read", 1),
+            "transform": StageStats("transform", self.n_transform),
+            "quantize": StageStats("quantize", self.n_quantize),
+            "write": StageStats("write", 1),
+        }
+
+    def _publish(self, i: int, value: Any) -> None:
+        with self.results_cond:
+            self.results[i] = value
+            self.results_cond.notify_all()
+
+    def _read(self, jobs: list[TensorJob]) -> None:
+        i = 0
+        try:
+            for i, job in enumerate(jobs):
+                tensor = job_tensor(self.writer, job)
+                if isinstance(tensor, FileRangeTensor):
+                    # copied file-to-file by the writer: no RAM, nothing to compute
+                    self.transform_q.put((i, tensor, 0))
+                    continue
+                leaves = lazy_leaves(tensor)
+                inputs = lazy_inputs(tensor)
+                cost = job.nbytes + sum(meta_nbytes(t) for t in leaves + inputs)
+                self.budget.acquire(cost)
+                start = time.perf_counter()
+                nbytes = sum(prefetch(leaf) for leaf in leaves)
+                self.stats["read"].add(time.perf_counter() - start, nbytes)
+                self.transform_q.put((i, tensor, cost))
+        except Exception as e:  # surfaced by the writer when it reaches tensor i
+            self._publish(i, e)
+        finally:
+            for _ in range(self.n_transform):
+                self.transform_q.put(None)
+
+    def _transform(self) -> None:
+        while (item := self.transform_q.get()) is not None:
+            i, tensor, cost = item
+            if isinstance(tensor, FileRangeTensor):
+                self.quantize_q.put(item)
+                continue
+            try:
+                start = time.perf_counter()
+                inputs = lazy_inputs(tensor)
+                for t in inputs:
+                    type(t).to_eager(t)
+                self.stats["transform"].add(time.perf_counter() - start, sum(meta_nbytes(t) for t in inputs))
+                self.quantize_q.put(item)
+            except Exception as e:
+                self._publish(i, e)
+
+    def _quantize(self) -> None:
+        while (item := self.quantize_q.get()) is not None:
+            i, tensor, cost = item
+            try:
+                if isinstance(tensor, FileRangeTensor):
+                    self._publish(i, (tensor, cost))
+                    continue
+                start = time.perf_counter()
+                data = materialize(tensor)
+                self.stats["quantize"].add(time.perf_counter() - start, data.nbytes)
+                self._publish(i, (data, cost))
+            except Exception as e:
+                self._publish(i, e)
+
+    def run(self, *, progress: bool = False, journal: ConversionJournal | None = None) -> None:
+        jobs, ends = (journal.pending, journal.ends) if journal is not None else plan_tensor_data(self.writer)
+        assert self.writer.fout is not None
+        fds = [fout.fileno() for fout in self.writer.fout]
+
+        bar = None
+        if progress:
+            from tqdm import tqdm
+            bar = tqdm(desc="Writing (pipelined)", total=sum(job.nbytes for job in jobs), unit="byte", unit_scale=True)
+
+        wall_start = time.perf_counter()
+        threads = [threading.Thread(target=self._read, args=(jobs,), daemon=True)]
+        threads += [threading.Thread(target=self._transform, daemon=True) for _ in range(self.n_transform)]
+        threads += [threading.Thread(target=self._quantize, daemon=True) for _ in range(self.n_quantize)]
+        for thread in threads:
+            thread.start()
+
+        try:
+            for i, job in enumerate(jobs):
+                with self.results_cond:
+                    while i not in self.results:
+                        self.results_cond.wait()
+                    result = self.results.pop(i)
+                if isinstance(result, Exception):
+                    raise result
+                data, cost = result
+                start = time.perf_counter()
+                digest = write_data(fds[job.file_id], data, job, journal is not None)
+                self.stats["write"].add(time.perf_counter() - start, job.nbytes)
+                if journal is not None:
+                    journal.record(job, digest)
+                release_job(self.writer, job)
+                del data, result
+                self.budget.release(cost)
+                if bar is not None:
+                    bar.update(job.nbytes)
+        finally:
+            for _ in range(self.n_quantize):
+                self.quantize_q.put(None)
+            if bar is not None:
+                bar.close()
+
+        finish_tensor_data(self.writer, ends)
+        wall = time.perf_counter() - wall_start
+        logger.info(f"Pipeline: {wall:.1f} s wall, memory budget {gguf.GGUFWriter.format_n_bytes_to_str(self.budget.limit) if self.budget.limit else 'unlimited'}")
+        for stage in self.stats.values():
+            logger.info("  " + stage.report(wall))
+
+
+# Resumable mode (--resume).
+#
+# The header, kv data and tensor infos of every shard only depend on the conversion plan, so
+# they are rendered in memory first. A journal next to the first shard (<shard>.journal, JSON
+# lines) records that plan, then every tensor once its bytes are written, with their sha256.
+# A restarted conversion with the same plan and the same partial headers on disk keeps the
+# files (no truncation), re-hashes the journaled tensors and only writes the others. The
+# journal is not fsync()ed: a tensor that never reached the disk fails its check and is redone.
+
+JOURNAL_VERSION = 1
+
+
+class ConversionJournal:
+    def __init__(self, path: Path, plan: str, jobs: list[TensorJob], ends: list[int]):
+        self.path = path
+        self.plan = plan
+        self.jobs = jobs
+        self.ends = ends
+        self.pending = jobs
+        self.file: Any = None
+
+    def load(self) -> dict[tuple[int, str, int], dict[str, Any]]:
+        """Entries of an existing journal for the same plan (a torn last line is ignored)."""
+        entries: dict[tuple[int, str, int], dict[str, Any]] = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                head = json.loads(f.readline() or "{}")
+                if head.get("version") != JOURNAL_VERSION or head.get("plan") != self.plan:
+                    logger.warning(f"{self.path} belongs to a different conversion (model, outtype or layout changed), starting over")
+                    return {}
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        break
+                    entries[(entry["file"], entry["name"], entry.get("part", -1))] = entry
+        except FileNotFoundError:
+            pass
+        except (json.JSONDecodeError, AttributeError, KeyError):
+            logger.warning(f"{self.path} is unreadable, starting over")
+            return {}
+        return entries
+
+    def start(self, done: list[tuple[TensorJob, str]]) -> None:
+        """Rewrites the journal with the verified tensors only, then appends to it."""
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"version": JOURNAL_VERSION, "plan": self.plan}) + "\n")
+            for job, digest in done:
+                f.write(self._line(job, digest))
+        os.replace(tmp, self.path)
+        self.file = open(self.path, "a", encoding="utf-8")
+        finished = {(job.file_id, job.name, job.part) for job, _ in done}
+        self.pending = [job for job in self.jobs if (job.file_id, job.name, job.part) not in finished]
+
+    @staticmethod
+    def _line(job: TensorJob, digest: str) -> str:
+        return json.dumps({"file": job.file_id, "name": job.name, "part": job.part, "offset": job.offset, "nbytes": job.nbytes, "sha256": digest}) + "\n"
+
+    def record(self, job: TensorJob, digest: str | None) -> None:
+        assert digest is not None
+        self.file.write(self._line(job, digest))
+        self.file.flush()
+
+    def complete(self, writer: gguf.GGUFWriter) -> None:
+        """The output is whole: make it durable, then drop the journal."""
+        assert writer.fout is not None
+        for fout in writer.fout:
+            fout.flush()
+            os.fsync(fout.fileno())
+        self.file.close()
+        self.path.unlink()
+
+
+def open_resumable(writer: gguf.GGUFWriter, path: Path, source: Any = None) -> ConversionJournal:
+    """
+    Replaces write_header_to_file(path) + write_kv_data_to_file() for --resume: writes the
+    header, kv data and tensor infos of every shard, or keeps the partial output of an earlier
+    run with the same plan. source identifies the input model (e.g. file sizes and mtimes).
+    Returns the journal, whose pending jobs still have to be written.
+    """
+    writer.path = Path(path)
+    filenames = writer.print_plan()
+
+    # render the headers in memory; GGUFWriter writes to whatever file objects it is given
+    writer.fout = [io.BytesIO() for _ in filenames]  # type: ignore[misc]
+    writer.state = gguf.gguf_writer.WriterState.EMPTY
+    writer.write_header_to_file()
+    writer.write_kv_data_to_file()
+    jobs, ends = plan_tensor_data(writer)
+    headers = [fout.getvalue() for fout in writer.fout]  # type: ignore[attr-defined]
+
+    plan = hashlib.sha256(json.dumps({
+        "source": source,
+        "files": [Path(name).name for name in filenames],
+        "headers": [hashlib.sha256(header).hexdigest() for header in headers],
+        "ends": ends,
+    }, sort_keys=True, default=str).encode()).hexdigest()
+    journal = ConversionJournal(Path(f"{filenames[0]}.journal"), plan, jobs, ends)
+
+    entries = journal.load()
+    if entries:
+        for name, header in zip(filenames, headers):
+            try:
+                with open(name, "rb") as f:
+                    same = f.read(len(header)) == header
+            except FileNotFoundError:
+                same = False
+            if not same:
+                logger.warning(f"{name} does not match {journal.path}, starting over")
+                entries = {}
+                break
+
+    if entries:
+        writer.fout = [open(name, "r+b") for name in filenames]
+    else:
+        writer.fout = [open(name, "wb") for name in filenames]
+        for fout, header in zip(writer.fout, headers):
+            fout.write(header)
+            fout.flush()
+    for fout, header in zip(writer.fout, headers):
+        fout.seek(len(header))
+    writer.state = gguf.gguf_writer.WriterState.TI_DATA
+
+    done: list[tuple[TensorJob, str]] = []
+    for job in jobs:
+        entry = entries.get((job.file_id, job.name, job.part))
+        if entry is None or entry["offset"] != job.offset or entry["nbytes"] != job.nbytes:
+            continue
+        if range_sha256(writer.fout[job.file_id].fileno(), job.offset, job.nbytes) == entry["sha256"]:
+            done.append((job, entry["sha256"]))
+    if entries:
+        nbytes = sum(job.nbytes for job, _ in done)
+        logger.info(f"Resuming: {len(done)}/{len(jobs)} tensors ({gguf.GGUFWriter.format_n_bytes_to_str(nbytes)}) already written and verified")
+    journal.start(done)
+    return journal
+
+
+def write_tensors_journaled(writer: gguf.GGUFWriter, journal: ConversionJournal, *, progress: bool = False) -> None:
+    """Serial writer for --resume: each pending tensor is written at its offset, then journaled."""
+    assert writer.fout is not None
+    fds = [fout.fileno() for fout in writer.fout]
+
+    bar = None
+    if progress:
+        from tqdm import tqdm
+        bar = tqdm(desc="Writing", total=sum(job.nbytes for job in journal.pending), unit="byte", unit_scale=True)
+
+    try:
+        for job in journal.pending:
+            tensor = job_tensor(writer, job)
+            data = tensor if isinstance(tensor, FileRangeTensor) else materialize(tensor)
+            journal.record(job, write_data(fds[job.file_id], data, job, checksum=True))
+            release_job(writer, job)
+            del tensor, data
+            if bar is not None:
+                bar.update(job.nbytes)
+    finally:
+        if bar is not None:
+            bar.close()
+
+    finish_tensor_data(writer, journal.ends)
+
+
+def write_tensors(writer: gguf.GGUFWriter, n_workers: int = 1, *, progress: bool = False,
+                  pipeline: bool = False, memory_budget: int = 0, journal: ConversionJournal | None = None) -> None:
+    """
+    pipeline: staged threads (n_workers transform + n_workers quantize) within memory_budget bytes.
+    Otherwise n_workers > 1 forks worker processes when possible (lazy tensors, fork, no temp file).
+    journal: from open_resumable(); only its pending tensors are written, and it is removed at the end.
+    """
+    if journal is not None:
+        if pipeline:
+            TensorPipeline(writer, n_workers, n_workers, memory_budget).run(progress=progress, journal=journal)
+        elif n_workers > 1 and can_fork():
+            write_tensors_parallel(writer, n_workers, progress=progress, journal=journal)
+        else:
+            write_tensors_journaled(writer, journal, progress=progress)
+        journal.complete(writer)
+        return
+    if (n_workers > 1 or pipeline) and (writer.temp_file is not None or writer.use_temp_file):
+        logger.warning("--threads/--pipeline are ignored with --use-temp-file")
+    elif pipeline:
+        TensorPipeline(writer, n_workers, n_workers, memory_budget).run(progress=progress)
+        return
+    elif n_workers > 1:
+        if not can_fork():
+            logger.warning("--threads needs the 'fork' start method, converting serially")
+        else:
+            write_tensors_parallel(writer, n_workers, progress=progress)
+            return
+    writer.write_tensors_to_file(progress=progress)
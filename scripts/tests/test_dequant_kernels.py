@@ -0,0 +1,80 @@
+# The chunked kernels must be bit-identical to the whole-tensor references
+# (bench_dequant.py measures the memory; this only checks the bits).
+
+import pytest
+import torch
+
+import dequant_kernels
+
+CHUNKS = [1, 7, 777, dequant_kernels.CHUNK_ELEMENTS]
+
+
+def randint(g: torch.Generator, shape: tuple[int, ...], dtype: torch.dtype) -> torch.Tensor:
+    return torch.randint(-(2 ** 31), 2 ** 31 - 1, shape, generator=g, dtype=torch.int64).to(dtype)
+
+
+def assert_identical(out: torch.Tensor, ref: torch.Tensor) -> None:
+    assert out.shape == ref.shape and out.dtype == ref.dtype
+    # compare bits, not values (NaN != NaN)
+    assert torch.equal(out.contiguous().view(torch.int32), ref.contiguous().view(torch.int32))
+
+
+@pytest.mark.parametrize("chunk", CHUNKS)
+@pytest.mark.parametrize("rows,cols,block_size", [
+    (300, 200, [128, 128]),  # scale padded on both dims
+    (257, 96, [32, 64]),     # non-square blocks, padded rows
+    (128, 256, [128, 128]),  # exact multiple
+])
+def test_dequant_simple_block_scales(rows: int, cols: int, block_size: list[int], chunk: int):
+    g = torch.Generator().manual_seed(rows * cols)
+    weight = (torch.randn((rows, cols), generator=g) * 100).to(torch.float8_e4m3fn)
+    scale = torch.rand(((rows + block_size[0] - 1) // block_size[0], (cols + block_size[1] - 1) // block_size[1]), generator=g).to(torch.bfloat16)
+    ref = dequant_kernels.dequant_simple_reference(weight, scale, block_size)
+    assert_identical(dequant_kernels.dequant_simple(weight, scale, block_size, chunk_elements=chunk), ref)
+
+
+@pytest.mark.parametrize("chunk", CHUNKS)
+@pytest.mark.parametrize("scale_shape", [(301, 1), (1, 1), ()])
+def test_dequant_simple_channel_and_tensor_scales(scale_shape: tuple[int, ...], chunk: int):
+    g = torch.Generator().manual_seed(1)
+    weight = torch.randint(-128, 128, (301, 50), generator=g, dtype=torch.int8)
+    scale = torch.rand(scale_shape, generator=g).to(torch.float16)
+    ref = dequant_kernels.dequant_simple_reference(weight, scale)
+    assert_identical(dequant_kernels.dequant_simple(weight, scale, chunk_elements=chunk), ref)
+
+
+@pytest.mark.parametrize("chunk", CHUNKS)
+@pytest.mark.parametrize("bits,checkpoint_format", [(2, "gptq"), (4, "gptq"), (4, "gptq_v2"), (8, "gptq")])
+def test_dequant_gptq(bits: int, checkpoint_format: str, chunk: int):
+    g = torch.Generator().manual_seed(bits)
+    pack_factor = 32 // bits
+    n_in, n_out, group_size = 40 * pack_factor, 6 * pack_factor, 32
+    n_groups = (n_in + group_size - 1) // group_size
+    qweight = randint(g, (n_in // pack_factor, n_out), torch.int32)
+    qzeros = randint(g, (n_groups, n_out // pack_factor), torch.int32)
+    scales = torch.rand((n_groups, n_out), generator=g).to(torch.float16)
+    g_idx = (torch.arange(n_in, dtype=torch.int32) // group_size)[torch.randperm(n_in, generator=g)]  # act-order
+    args = (g_idx, qweight, qzeros, scales, bits, checkpoint_format)
+    out = dequant_kernels.dequant_gptq(*args, chunk_elements=chunk)
+    assert_identical(out, dequant_kernels.dequant_gptq_reference(*args))
+    assert tuple(out.shape) == dequant_kernels.gptq_shape(qweight.shape, qweight.dtype, bits)
+
+
+def test_dequant_gptq_3bit_is_not_implemented():
+    q = torch.zeros((3, 32), dtype=torch.int32)
+    with pytest.raises(NotImplementedError):
+        dequant_kernels.dequant_gptq(torch.zeros(32, dtype=torch.int32), q, q, torch.zeros((1, 32)), 3)
+
+
+@pytest.mark.parametrize("chunk", CHUNKS)
+@pytest.mark.parametrize("zero_point", [False, True])
+@pytest.mark.parametrize("rows,cols", [(37, 256), (64, 384)])
+def test_dequant_packed(rows: int, cols: int, zero_point: bool, chunk: int):
+    g = torch.Generator().manual_seed(rows)
+    num_bits, group_size = 4, 128
+    per_word = 32 // num_bits
+    w = randint(g, (rows, (cols + per_word - 1) // per_word), torch.int32)
+    scale = torch.rand((rows, cols // group_size), generator=g).to(torch.bfloat16)
+    zp = randint(g, ((rows + per_word - 1) // per_word, cols // group_size), torch.int32) if zero_point else None  # padded rows
+    args = (w, scale, (rows, cols), zp, num_bits, group_size)
+    assert_identical(dequant_kernels.dequant_packed(*args, chunk_elements=chunk), dequant_kernels.dequant_packed_reference(*args))